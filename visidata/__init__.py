@@ -58,6 +58,7 @@ import visidata._types
 import visidata.column
 
 import visidata.interface
+import visidata.columnar
 import visidata.sheets
 import visidata.rename_col
 import visidata.indexsheet
@@ -67,6 +68,7 @@ import visidata.statusbar
 import visidata.textsheet
 import visidata.threads
 import visidata.path
+import visidata.sidecar
 import visidata.guide
 
 import visidata.stored_list
@@ -1,8 +1,12 @@
 import sys
 import math
 import functools
+import itertools
 import collections
 import statistics
+import numbers
+import decimal
+import bisect
 
 from visidata import Progress, Sheet, Column, ColumnsSheet, VisiData
 from visidata import vd, anytype, vlen, asyncthread, wrapply, AttrDict, date, INPROGRESS
@@ -30,13 +34,17 @@ def getValueRows(self, rows):
     'Generate (value, row) for each row in *rows* at this column, excluding null and error values.'
     f = self.sheet.isNullFunc()
 
-    for r in Progress(rows, 'calculating'):
-        try:
-            v = self.getTypedValue(r)
-            if not f(v):
-                yield v, r
-        except Exception:
-            pass
+    it = iter(Progress(rows, 'calculating'))
+    while True:
+        block = list(itertools.islice(it, 1000))  # calculate values for blocks of rows at once
+        if not block:
+            break
+        for v, r in zip(self.getTypedValues(block), block):
+            try:
+                if not f(v):
+                    yield v, r
+            except Exception:
+                pass
 
 @Column.api
 def getValues(self, rows):
@@ -76,12 +84,13 @@ Column.aggregators = property(aggregators_get, aggregators_set)
 
 
 class Aggregator:
-    def __init__(self, name, type, funcValues=None, helpstr='foo'):
+    def __init__(self, name, type, funcValues=None, helpstr='foo', accumulator=None):
         'Define aggregator `name` that calls funcValues(values)'
         self.type = type
         self.funcValues = funcValues  # funcValues(values)
         self.helpstr = helpstr
         self.name = name
+        self.accumulator = accumulator  # Accumulator class to aggregate values one at a time, or None
 
     def aggregate(self, col, rows):  # wrap builtins so they can have a .type
         vals = list(col.getValues(rows))
@@ -94,10 +103,263 @@ class Aggregator:
 
 
 @VisiData.api
-def aggregator(vd, name, funcValues, helpstr='', *, type=None):
+def aggregator(vd, name, funcValues, helpstr='', *, type=None, accumulator=None):
     '''Define simple aggregator *name* that calls ``funcValues(values)`` to aggregate *values*.
-       Use *type* to force type of aggregated column (default to use type of source column).'''
-    vd.aggregators[name] = Aggregator(name, type, funcValues=funcValues, helpstr=helpstr)
+       Use *type* to force type of aggregated column (default to use type of source column).
+       Use *accumulator* to give an Accumulator class which computes the same result one value at a time.'''
+    vd.aggregators[name] = Aggregator(name, type, funcValues=funcValues, helpstr=helpstr, accumulator=accumulator)
+
+
+class Accumulator:
+    '''Incremental state of an aggregator over a stream of non-null values.
+       Subclasses implement ``add(value)`` and ``result()``, and may implement ``addValues(values)`` to add a list of values at once.'''
+    error = None  # first exception raised by add(); result is this error
+
+    def update(self, v):
+        if self.error is None:
+            try:
+                self.add(v)
+            except Exception as e:
+                self.error = e
+
+    def updateValues(self, vals):
+        'Update with each of the list of *vals*, in order.'
+        if self.error is None:
+            try:
+                self.addValues(vals)
+            except Exception as e:
+                self.error = e
+
+    def addValues(self, vals):
+        for v in vals:
+            self.add(v)
+
+    def value(self):
+        if self.error is not None:
+            raise self.error
+        return self.result()
+
+
+class CountAccumulator(Accumulator):
+    def __init__(self):
+        self.n = 0
+
+    def add(self, v):
+        self.n += 1
+
+    def addValues(self, vals):
+        self.n += len(vals)
+
+    def result(self):
+        return self.n
+
+
+class SumAccumulator(Accumulator):
+    def __init__(self):
+        self.total = None
+
+    def add(self, v):
+        if self.total is None:
+            self.total = type(v)()  # like vsum
+        self.total += v
+
+    def addValues(self, vals):
+        if vals and self.total is None:
+            self.total = type(vals[0])()
+        self.total = sum(vals, self.total)
+
+    def result(self):
+        return 0 if self.total is None else self.total
+
+
+class MeanAccumulator(Accumulator):
+    def __init__(self):
+        self.total = 0
+        self.n = 0
+
+    def add(self, v):
+        self.total += v
+        self.n += 1
+
+    def addValues(self, vals):
+        self.total = sum(vals, self.total)
+        self.n += len(vals)
+
+    def result(self):
+        if self.n:
+            return float(self.total)/self.n
+
+
+class MinAccumulator(Accumulator):
+    def __init__(self):
+        self.n = 0
+        self.v = None
+
+    def add(self, v):
+        if not self.n or v < self.v:
+            self.v = v
+        self.n += 1
+
+    def addValues(self, vals):
+        if vals:
+            self.add(min(vals))  # first of the smallest, like min()
+            self.n += len(vals)-1
+
+    def result(self):
+        return self.v
+
+
+class MaxAccumulator(MinAccumulator):
+    def add(self, v):
+        if not self.n or self.v < v:
+            self.v = v
+        self.n += 1
+
+    def addValues(self, vals):
+        if vals:
+            self.add(max(vals))
+            self.n += len(vals)-1
+
+
+class DistinctAccumulator(Accumulator):
+    def __init__(self):
+        self.values = set()
+
+    def add(self, v):
+        self.values.add(v)
+
+    def addValues(self, vals):
+        self.values.update(vals)
+
+    def result(self):
+        return self.values
+
+
+class StdevAccumulator(Accumulator):
+    'Sample standard deviation, by Welford online algorithm.'
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, v):
+        v = self.checkNumber(v)
+        self.n += 1
+        delta = v - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(v - self.mean)
+
+    def addValues(self, vals):
+        n, mean, m2 = self.n, self.mean, self.m2
+        for v in map(self.checkNumber, vals):
+            n += 1
+            delta = v - mean
+            mean += delta/n
+            m2 += delta*(v - mean)
+        self.n, self.mean, self.m2 = n, mean, m2
+
+    def result(self):
+        if self.n == 0:
+            return None
+        if self.n < 2:
+            raise statistics.StatisticsError('stdev requires at least two data points')
+        return math.sqrt(self.m2/(self.n-1))
+
+    @staticmethod
+    def checkNumber(v) -> float:
+        'Return *v* as float, or raise TypeError for the same non-numeric values (like dates) as statistics.stdev.'
+        if not isinstance(v, (numbers.Real, decimal.Decimal)):
+            raise TypeError(f"can't convert type '{type(v).__name__}' to numerator/denominator")
+        return float(v)
+
+
+def _mix64(x) -> int:
+    'Return 64-bit int with the bits of int *x* mixed, by the splitmix64 finalizer.'
+    x &= 0xffffffffffffffff
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return x ^ (x >> 31)
+
+
+class ApproxDistinctAccumulator(Accumulator):
+    'Approximate number of distinct values in constant memory (2**p bytes), by HyperLogLog; the standard error is about 1.04/sqrt(2**p), or 1.6%.'
+    p = 12
+
+    def __init__(self):
+        self.registers = bytearray(1 << self.p)
+
+    def add(self, v):
+        x = _mix64(hash(v))  # equal values have equal hashes, like for set()
+        nbits = 64 - self.p
+        rest = x & ((1 << nbits) - 1)
+        rank = nbits - rest.bit_length() + 1  # position of the first 1 bit
+        i = x >> nbits
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def result(self):
+        m = len(self.registers)
+        est = 0.7213/(1+1.079/m) * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5*m and zeros:
+            est = m * math.log(m/zeros)  # linear counting, for small numbers of values
+        return round(est)
+
+
+class ApproxPercentileAccumulator(Accumulator):
+    'Approximate *pct* percentile in constant memory, by the P-square algorithm (Jain and Chlamtac, 1985), which adjusts 5 markers as values are added.'
+    def __init__(self, pct):
+        p = pct/100
+        self.p = p
+        self.q = []  # marker heights; the values themselves, sorted, until there are 5
+        self.n = [0, 1, 2, 3, 4]  # marker positions
+        self.want = [0, 2*p, 4*p, 2+2*p, 4]  # desired marker positions
+        self.dwant = [0, p/2, p, (1+p)/2, 1]
+
+    def add(self, v):
+        v = float(v)  # like PercentileAggregator
+        q, n = self.q, self.n
+        if len(q) < 5:
+            bisect.insort(q, v)
+            return
+
+        if v < q[0]:
+            q[0] = v
+            k = 0
+        elif v >= q[4]:
+            q[4] = v
+            k = 3
+        else:
+            k = bisect.bisect_right(q, v) - 1
+        for i in range(k+1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.want[i] += self.dwant[i]
+
+        for i in (1, 2, 3):
+            d = self.want[i] - n[i]
+            if (d >= 1 and n[i+1]-n[i] > 1) or (d <= -1 and n[i-1]-n[i] < -1):
+                d = 1 if d > 0 else -1
+                qi = q[i] + d/(n[i+1]-n[i-1]) * ((n[i]-n[i-1]+d)*(q[i+1]-q[i])/(n[i+1]-n[i]) + (n[i+1]-n[i]-d)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+                if not q[i-1] < qi < q[i+1]:  # parabolic estimate out of order; use linear
+                    qi = q[i] + d*(q[i+d]-q[i])/(n[i+d]-n[i])
+                q[i] = qi
+                n[i] += d
+
+    def result(self):
+        if len(self.q) < 5 or self.n[4] < 5:  # exact for up to 5 values
+            return _percentile(self.q, self.p)
+        return self.q[2]
+
+
+def accumulate(accumulator):
+    'Return function to aggregate a list of values with a new *accumulator*.'
+    def _accumulate(vals):
+        acc = accumulator()
+        acc.updateValues(list(vals))
+        return acc.value()
+    return _accumulate
+
 
 ## specific aggregator implementations
 
@@ -145,17 +407,19 @@ def quantiles(q, helpstr):
     return [PercentileAggregator(round(100*i/q), helpstr) for i in range(1, q)]
 
 
-vd.aggregator('min', min, 'minimum value')
-vd.aggregator('max', max, 'maximum value')
-vd.aggregator('avg', mean, 'arithmetic mean of values', type=float)
-vd.aggregator('mean', mean, 'arithmetic mean of values', type=float)
+vd.aggregator('min', min, 'minimum value', accumulator=MinAccumulator)
+vd.aggregator('max', max, 'maximum value', accumulator=MaxAccumulator)
+vd.aggregator('avg', mean, 'arithmetic mean of values', type=float, accumulator=MeanAccumulator)
+vd.aggregator('mean', mean, 'arithmetic mean of values', type=float, accumulator=MeanAccumulator)
 vd.aggregator('median', statistics.median, 'median of values')
 vd.aggregator('mode', statistics.mode, 'mode of values')
-vd.aggregator('sum', vsum, 'sum of values')
-vd.aggregator('distinct', set, 'distinct values', type=vlen)
-vd.aggregator('count', lambda values: sum(1 for v in values), 'number of values', type=int)
+vd.aggregator('sum', vsum, 'sum of values', accumulator=SumAccumulator)
+vd.aggregator('distinct', set, 'distinct values', type=vlen, accumulator=DistinctAccumulator)
+vd.aggregator('count', lambda values: sum(1 for v in values), 'number of values', type=int, accumulator=CountAccumulator)
 vd.aggregator('list', list, 'list of values', type=anytype)
-vd.aggregator('stdev', statistics.stdev, 'standard deviation of values', type=float)
+vd.aggregator('stdev', statistics.stdev, 'standard deviation of values', type=float, accumulator=StdevAccumulator)
+vd.aggregator('approx_distinct', accumulate(ApproxDistinctAccumulator), 'approximate number of distinct values, in constant memory', type=int, accumulator=ApproxDistinctAccumulator)
+vd.aggregator('approx_median', accumulate(functools.partial(ApproxPercentileAccumulator, 50)), 'approximate median of values, in constant memory', accumulator=functools.partial(ApproxPercentileAccumulator, 50))
 
 vd.aggregators['q3'] = quantiles(3, 'tertiles (33/66th pctile)')
 vd.aggregators['q4'] = quantiles(4, 'quartiles (25/50/75th pctile)')
@@ -295,3 +559,44 @@ ColumnsSheet.addCommand('g+', 'aggregate-cols', 'addAggregators(selectedRows or
 vd.addMenuItems('''
     Column > Add aggregator > aggregate-col
 ''')
+
+
+def test_accumulators(vd):
+    vals = [3, 1.5, 4, 1.5, 9, 2]
+    acc = vd.aggregators['stdev'].accumulator()
+    acc.updateValues([date(2020, 1, 1), date(2020, 1, 2)])
+    assert acc.error, 'stdev of dates'
+
+    for aggname in 'min max sum mean count distinct stdev'.split():
+        agg = vd.aggregators[aggname]
+        acc = agg.accumulator()
+        for v in vals:
+            acc.update(v)
+        assert acc.value() == agg.funcValues(vals) or abs(acc.value() - agg.funcValues(vals)) < 1e-9, aggname
+        acc = agg.accumulator()
+        acc.updateValues(vals[:2])
+        acc.updateValues(vals[2:])
+        assert acc.value() == agg.funcValues(vals) or abs(acc.value() - agg.funcValues(vals)) < 1e-9, aggname
+        assert agg.accumulator().value() == Aggregator.aggregate(agg, Column('x', getter=lambda c,r: r, sheet=Sheet('empty')), []), aggname
+
+
+def test_approx_accumulators(vd):
+    import random
+    rng = random.Random(0)
+    vals = [rng.randrange(20000) for i in range(50000)]
+
+    acc = ApproxDistinctAccumulator()
+    acc.updateValues(vals)
+    assert abs(acc.value() - len(set(vals))) < 0.05*len(set(vals))
+    assert vd.aggregators['approx_distinct'].funcValues([1, 1.0, 2, 'a', 'a']) == 3  # equal values like set()
+
+    acc = ApproxPercentileAccumulator(50)
+    acc.updateValues(vals)
+    assert abs(acc.value() - statistics.median(vals)) < 0.02*20000
+    acc = ApproxPercentileAccumulator(90)
+    for v in vals:
+        acc.update(v)
+    assert abs(acc.value() - _percentile(sorted(vals), 0.9)) < 0.02*20000
+
+    for n in range(6):  # exact for up to 5 values
+        assert vd.aggregators['approx_median'].funcValues(vals[:n]) == _percentile(sorted(vals[:n]), 0.5)
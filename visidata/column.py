@@ -6,8 +6,10 @@ import threading
 import re
 import time
 import json
+import sys
+import weakref
 
-from visidata import options, anytype, stacktrace, vd, drawcache
+from visidata import options, anytype, stacktrace, vd, VisiData, drawcache
 from visidata import asyncthread, dispwidth, clipstr, iterchars
 from visidata import wrapply, TypedWrapper, TypedExceptionWrapper
 from visidata import Extensible, AttrDict, undoAttrFunc, ExplodingMock, MissingAttrFormatter
@@ -19,8 +21,10 @@ class InProgress(Exception):
         return  ['calculation in progress']
 
 INPROGRESS = TypedExceptionWrapper(None, exception=InProgress())  # sentinel
+NOTCACHED = object()  # sentinel for a value not (or no longer) in a column cache
 
 vd.option('col_cache_size', 0, 'max number of cache entries in each cached column')
+vd.option('cache_memory_limit', 0, 'max MB of values cached by all cached columns together; least recently used are evicted first (0 for no limit)')
 vd.option('disp_formatter', 'generic', 'formatter to create the text in each cell (also used by text savers)', replay=True)
 vd.option('disp_displayer', 'generic', 'displayer to render the text in each cell', replay=False)
 
@@ -40,6 +44,161 @@ class DisplayWrapper:
     def __eq__(self, other):
         return self.value == other
 
+class ColumnCacheManager:
+    '''Approximate memory accounting of values cached by all cached columns on all sheets, in one global least-recently-used order.
+
+    Each column cache is registered with a unique id, so entries of a cleared or garbage-collected column go stale instead of needing to be found and removed.
+    While options.cache_memory_limit is 0 (no limit), nothing is accounted; the option is read again after every *check_adds* values cached, and setting a limit accounts for all values already cached.'''
+    entry_overhead = 100  # approx bytes per entry for the rowid key and the dict slots in both caches
+    check_interval = 1024*1024  # bytes added between checks of options.cache_memory_limit
+    check_adds = 1024  # values cached between checks of options.cache_memory_limit, while there is no limit
+
+    def __init__(self):
+        self.lru = collections.OrderedDict()  # (cacheid, rowid) -> nbytes, least recently used first
+        self.columns = {}   # cacheid -> weakref to Column
+        self.colbytes = {}  # cacheid -> nbytes cached by that column
+        self.colentries = {}  # cacheid -> number of entries in lru
+        self.nbytes = 0     # total of colbytes
+        self.nextcheck = self.check_interval  # check limit when nbytes exceeds this
+        self.nstale = 0     # entries in lru of unregistered caches
+        self.ids = itertools.count(1)
+        self.limit = 0      # options.cache_memory_limit in bytes, as of last check
+        self.nadds = 0      # values cached since last check, while there is no limit
+        self.lock = threading.RLock()  # columns are cached and garbage-collected in several threads
+
+    @property
+    def nentries(self):
+        return len(self.lru) - self.nstale
+
+    def register(self, col) -> int:
+        'Return new cacheid for the (empty) cache of *col*.'
+        cacheid = next(self.ids)
+        with self.lock:
+            self.columns[cacheid] = weakref.ref(col, lambda ref, cacheid=cacheid: self.unregister(cacheid))
+            self.colbytes[cacheid] = 0
+            self.colentries[cacheid] = 0
+        return cacheid
+
+    def unregister(self, cacheid):
+        'Forget all entries cached under *cacheid*.  Their entries in the LRU are compacted away later, by add().'
+        with self.lock:
+            if self.columns.pop(cacheid, None) is None:
+                return
+            self.nbytes -= self.colbytes.pop(cacheid)
+            self.nstale += self.colentries.pop(cacheid)
+
+    def _compact(self):
+        if self.nstale > len(self.lru)//2:
+            self.lru = collections.OrderedDict((k, n) for k, n in self.lru.items() if k[0] in self.columns)
+            self.nstale = 0
+
+    def _discard(self, cacheid, n):
+        self.colbytes[cacheid] -= n
+        self.colentries[cacheid] -= 1
+        self.nbytes -= n
+
+    def _account(self, cacheid, k, v):
+        key = (cacheid, k)
+        oldn = self.lru.pop(key, None)
+        if oldn is not None:
+            self._discard(cacheid, oldn)
+
+        n = sys.getsizeof(v) + self.entry_overhead
+        self.lru[key] = n
+        self.colbytes[cacheid] += n
+        self.colentries[cacheid] += 1
+        self.nbytes += n
+
+    def add(self, col, k, v):
+        'Account for value *v* just cached for rowid *k* in *col*, then evict least recently used values from all columns while over options.cache_memory_limit.'
+        if not self.limit:
+            self.nadds += 1
+            if self.nadds < self.check_adds:
+                return
+            self.checkLimit()
+            if not self.limit:
+                return
+
+        with self.lock:
+            cacheid = col._cacheid
+            if cacheid not in self.colbytes:
+                return
+            self._account(cacheid, k, v)
+            self._compact()
+
+            if self.nbytes > self.nextcheck:
+                self.checkLimit()
+
+    def checkLimit(self):
+        'Evict values while over options.cache_memory_limit, and set when to check it next.'
+        limit = vd.options.cache_memory_limit*1024*1024
+        with self.lock:
+            self.nadds = 0
+            if limit and not self.limit:
+                self.accountAll()
+            elif self.limit and not limit:
+                self.clearAccounting()
+            self.limit = limit
+
+            if limit:
+                self.evict(limit)
+                self.nextcheck = min(limit, self.nbytes+self.check_interval)
+
+    def accountAll(self):
+        'Account for all values in all registered column caches, which were not accounted while there was no limit.'
+        self.clearAccounting()
+        for cacheid, ref in list(self.columns.items()):
+            col = ref()
+            if col is not None and col._cachedValues:
+                for k, v in list(col._cachedValues.items()):
+                    self._account(cacheid, k, v)
+
+    def clearAccounting(self):
+        self.lru = collections.OrderedDict()
+        self.colbytes = dict.fromkeys(self.columns, 0)
+        self.colentries = dict.fromkeys(self.columns, 0)
+        self.nbytes = 0
+        self.nstale = 0
+
+    def touch(self, col, k):
+        'Mark cached value for rowid *k* in *col* as most recently used.'
+        if not self.limit:
+            return
+        with self.lock:
+            try:
+                self.lru.move_to_end((col._cacheid, k))
+            except KeyError:  # in progress, or added before the cache was registered
+                pass
+
+    def remove(self, col, k):
+        'Stop accounting for cached value for rowid *k*, which was removed from the cache of *col*.'
+        if not self.limit:
+            return
+        with self.lock:
+            n = self.lru.pop((col._cacheid, k), None)
+            if n is not None and col._cacheid in self.columns:
+                self._discard(col._cacheid, n)
+
+    def evict(self, maxbytes):
+        'Remove least recently used values from column caches until no more than *maxbytes* are cached.'
+        with self.lock:
+            while self.nbytes > maxbytes and self.lru:
+                (cacheid, k), n = self.lru.popitem(last=False)
+                ref = self.columns.get(cacheid)
+                if ref is None:
+                    self.nstale -= 1
+                    continue
+                self._discard(cacheid, n)
+                col = ref()
+                if col is not None and col._cachedValues is not None:
+                    col._cachedValues.pop(k, None)
+
+
+@VisiData.lazy_property
+def colCache(vd):
+    return ColumnCacheManager()
+
+
 def _default_colnames():
     'A B C .. Z AA AB .. ZZ AAA .. to infinity'
     i=0
@@ -87,6 +246,7 @@ class Column(Extensible):
         self.displayer = ''
         self.defer = False
         self.disp_expert = 0    # auto-hide if options.disp_expert less than col.disp_expert
+        self._cacheid = None    # registered with vd.colCache if cached
 
         self.setCache(cache)
         for k, v in kwargs.items():
@@ -99,6 +259,7 @@ class Column(Extensible):
         ret.keycol = 0   # column copies lose their key status
         if self._cachedValues is not None:
             ret._cachedValues = collections.OrderedDict()  # an unrelated cache for copied columns
+            ret._cacheid = vd.colCache.register(ret)
         return ret
 
     def __str__(self):
@@ -120,7 +281,7 @@ class Column(Extensible):
     def recalc(self, sheet=None):
         'Reset column cache, attach column to *sheet*, and reify column name.'
         if self._cachedValues:
-            self._cachedValues.clear()
+            self.clearCache()
         if sheet:
             self.sheet = sheet
         self.name = self._name
@@ -145,6 +306,8 @@ class Column(Extensible):
         if self.sheet:
             name = self.sheet.maybeClean(name)
 
+        if self.sheet and name != getattr(self, '_name', None):
+            self.sheet.clearColumnNameCaches()
         self._name = name
 
     @property
@@ -182,7 +345,10 @@ class Column(Extensible):
         if self.width != w:
             if self.width == 0 or w == 0:  # hide/unhide
                 vd.addUndo(setattr, self, '_width', self.width)
+            hidden = self.hidden
             self._width = w
+            if self.hidden != hidden and self.sheet:
+                self.sheet.clearColumnCaches()
 
     @property
     def formatted_help(self):
@@ -258,6 +424,36 @@ class Column(Extensible):
         gt = vd.getType(self._type)
         return gt.formatter(self._fmtstr or gt.fmtstr, typedval)
 
+    def make_formatValue(self):
+        'Return function equivalent to ``formatValue(typedval)``, with the type and fmtstr of this column looked up once, for formatting many values.'
+        if type(self).formatValue is not Column.formatValue or self.type is anytype:
+            return self.formatValue
+
+        gt = vd.getType(self._type)
+        formatter = gt.formatter
+        fmtstr = self._fmtstr or gt.fmtstr
+        encoding, encoding_errors = options.encoding, options.encoding_errors
+        typefmts = {}  # type(typedval) -> fmtstr from options, for numericFormatter
+        numeric = not fmtstr and formatter == vd.numericFormatter
+
+        def _formatValue(typedval, width=None):
+            if typedval is None:
+                return None
+            if isinstance(typedval, bytes):
+                typedval = typedval.decode(encoding, encoding_errors)
+            if numeric:
+                t = type(typedval)
+                f = typefmts.get(t)
+                if f is None:
+                    try:
+                        f = typefmts[t] = options['disp_'+t.__name__+'_fmt']
+                    except Exception:
+                        return formatter(fmtstr, typedval)  # let numericFormatter handle it
+                return formatter(f, typedval)
+            return formatter(fmtstr, typedval)
+
+        return _formatValue
+
     def displayer_generic(self, dw:DisplayWrapper, width=None):
         '''Fit *dw.text* into *width* charcells.
            Generate list of (attr:str, text:str) suitable for clipdraw_chunks.
@@ -305,14 +501,56 @@ class Column(Extensible):
         'Return the properly-typed value for the given row at this column, or a TypedWrapper object in case of null or error.'
         return wrapply(self.type, wrapply(self.getValue, row))
 
+    def getTypedValues(self, rows, prog=None) -> list:
+        'Return list of typed values for each of *rows*, adding to *prog* for each row.  Overridable by columns that can compute many values at once.'
+        ret = []
+        getTypedValue = self.getTypedValue
+        if type(self).getValue is not Column.getValue or type(self).getTypedValue is not Column.getTypedValue or self._cachedValues is not None or self.defer:
+            for r in rows:
+                ret.append(getTypedValue(r))
+                if prog:
+                    prog.addProgress(1)
+            return ret
+
+        # same as getTypedValue, without wrapply for each value
+        calcValue = self.calcValue
+        typefunc = self.type
+        for r in rows:
+            try:
+                v = calcValue(r)
+                if v is None or isinstance(v, (TypedWrapper, Exception)):
+                    v = wrapply(typefunc, v)
+                else:
+                    v = typefunc(v)
+            except Exception:
+                v = getTypedValue(r)  # calculate again to wrap the exception
+            ret.append(v)
+            if prog:
+                prog.addProgress(1)
+        return ret
+
     def setCache(self, cache):
         '''Set cache behavior for this column to *cache*:
 
            - ``False`` (default): getValue never caches; calcValue is always called.
            - ``True``: getValue maintains a cache of ``options.col_cache_size``.
-           - ``"async"``: ``getValue`` launches thread for every uncached result, maintains cache of infinite size.  Returns invalid value until cache entry available.'''
+           - ``"async"``: ``getValue`` launches thread for every uncached result, maintains cache of unlimited size.  Returns invalid value until cache entry available.
+
+           All cached values together are limited to ``options.cache_memory_limit`` MB.'''
         self.cache = cache
-        self._cachedValues = collections.OrderedDict() if self.cache else None
+        self._cachedValues = None
+        if self._cacheid:
+            vd.colCache.unregister(self._cacheid)
+            self._cacheid = None
+        if self.cache:
+            self.clearCache()
+
+    def clearCache(self):
+        'Replace the cache of this column with a new empty one.'
+        if self._cacheid:
+            vd.colCache.unregister(self._cacheid)
+        self._cachedValues = collections.OrderedDict()
+        self._cacheid = vd.colCache.register(self)
 
     @asyncthread
     def _calcIntoCacheAsync(self, row):
@@ -323,7 +561,9 @@ class Column(Extensible):
     def _calcIntoCache(self, row):
         ret = wrapply(self.calcValue, row)
         if not isinstance(ret, TypedExceptionWrapper) or ret.val is not INPROGRESS:
-            self._cachedValues[self.sheet.rowid(row)] = ret
+            k = self.sheet.rowid(row)
+            self._cachedValues[k] = ret
+            vd.colCache.add(self, k, ret)
         return ret
 
     def getValue(self, row):
@@ -340,8 +580,10 @@ class Column(Extensible):
             return self.calcValue(row)
 
         k = self.sheet.rowid(row)
-        if k in self._cachedValues:
-            return self._cachedValues[k]
+        ret = self._cachedValues.get(k, NOTCACHED)  # a single read, as the global cache can evict from another thread
+        if ret is not NOTCACHED:
+            vd.colCache.touch(self, k)
+            return ret
 
         if self.cache == 'async':
             ret = self._calcIntoCacheAsync(row)
@@ -350,7 +592,8 @@ class Column(Extensible):
 
             cachesize = options.col_cache_size
             if cachesize > 0 and len(self._cachedValues) > cachesize:
-                self._cachedValues.popitem(last=False)
+                k, _ = self._cachedValues.popitem(last=False)
+                vd.colCache.remove(self, k)
 
         return ret
 
@@ -420,6 +663,23 @@ class Column(Extensible):
         'Return string displayed in this column for given *row*.'
         return self.getCell(row).text
 
+    def getDisplayValues(self, rows:list) -> list:
+        'Return list of strings displayed in this column for each of *rows*.'
+        ret = []
+        width = (self.width or 0)*2
+        formatter = self.make_formatter()
+        for row, typedval in zip(rows, self.getTypedValues(rows)):
+            if type(typedval) is TypedWrapper and typedval.val is None:
+                ret.append('')
+            elif isinstance(typedval, (TypedWrapper, threading.Thread)):
+                ret.append(self.getCell(row).text)
+            else:
+                try:
+                    ret.append(formatter(typedval, width=width) or '')
+                except Exception:
+                    ret.append(self.getCell(row).text)
+        return ret
+
     def putValue(self, row, val):
         'Change value for *row* in this column to *val* immediately.  Does not check the type.  Overridable; by default calls ``.setter(row, val)``.'
         if self.setter:
@@ -569,3 +829,37 @@ vd.addGlobals(
     ColumnAttr=AttrColumn,
     DisplayWrapper=DisplayWrapper
 )
+
+
+def test_column_cache_limit(vd):
+    from visidata import Sheet
+    vs = Sheet('test_cache', rows=[[str(i)*10000] for i in range(100)])
+    col1 = Column('a', getter=lambda c,r: r[0], cache=True)
+    col2 = Column('b', getter=lambda c,r: r[0]*2, cache=True)
+    vs.addColumn(col1)
+    vs.addColumn(col2)
+
+    col1.getValue(vs.rows[0])
+    assert not vd.colCache.nentries  # no accounting without a limit
+
+    vd.options.cache_memory_limit = 1
+    vd.colCache.checkLimit()
+    assert vd.colCache.nentries == 1
+    try:
+        for r in vs.rows:
+            col1.getValue(r)
+            col2.getValue(r)
+        assert vd.colCache.nbytes <= 1024*1024
+        assert 0 < len(col1._cachedValues) < 100
+        assert 0 < len(col2._cachedValues) < 100
+        assert vs.rows[-1][0] in col1._cachedValues.values()  # most recently used
+        assert vs.rows[0][0] not in col1._cachedValues.values()  # least recently used
+        assert 'MB/1MB]' in vs.threadStatus  # shown while no thread is running
+        nbytes = vd.colCache.nbytes
+        col1.recalc()
+        assert not col1._cachedValues
+        assert vd.colCache.nbytes < nbytes
+    finally:
+        vd.options.cache_memory_limit = 0
+        vd.colCache.checkLimit()
+    assert not vd.colCache.nentries
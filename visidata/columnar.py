@@ -0,0 +1,172 @@
+import itertools
+from array import array
+
+from visidata import vd, VisiData
+
+
+vd.option('columnar_rows', False, 'store rows of sequence sheets (tsv/csv/etc) in compact per-column arrays', replay=True)
+
+
+class _ColumnData:
+    'Values of one column in a ColumnarStore.'
+    __slots__ = ('firstrow', 'buf', 'ends', 'others')
+
+    def __init__(self, firstrow=0):
+        self.firstrow = firstrow  # rows before this column was added have no value
+        self.buf = bytearray()    # all str values, utf-8 encoded and concatenated
+        self.ends = array('Q')    # end offset in buf of the value for each row; its start is the previous end
+        self.others = {}          # rownum -> value, for None, non-str, and edited values
+
+    def append(self, rownum, v):
+        if type(v) is str:
+            self.buf += v.encode('utf-8', 'surrogatepass')
+        else:
+            self.others[rownum] = v
+        self.ends.append(len(self.buf))
+
+    def get(self, rownum):
+        if rownum in self.others:
+            return self.others[rownum]
+        i = rownum - self.firstrow
+        if i < 0:
+            return None
+        return self.buf[self.ends[i-1] if i else 0:self.ends[i]].decode('utf-8', 'surrogatepass')
+
+
+_storeids = itertools.count()
+
+
+class ColumnarStore:
+    '''Column-oriented storage for rows of a SequenceSheet.
+
+    Each column keeps its str values utf-8 encoded in a single ``bytearray``, with an ``array`` of offsets into it, so a cell costs its encoded length plus 8 bytes instead of a Python str.
+    None, non-str, and edited values are kept per column in a dict by row number.'''
+    def __init__(self):
+        self.columns = []     # list of _ColumnData
+        self.nrows = 0
+        self.fields = []      # column names, for attribute access on rows
+        self.rowidBase = next(_storeids) << 40  # rowids of different stores (like from each reload) never collide
+
+    @property
+    def ncols(self):
+        return len(self.columns)
+
+    def addColumn(self):
+        self.columns.append(_ColumnData(self.nrows))
+
+    def append(self, values) -> int:
+        'Append a row of *values*, and return its row number.'
+        for i in range(len(self.columns), len(values)):
+            self.addColumn()
+
+        rownum = self.nrows
+        for coldata, v in itertools.zip_longest(self.columns, values):
+            coldata.append(rownum, v)
+
+        self.nrows += 1
+        return rownum
+
+    def rowids(self) -> range:
+        'Return range of rowids of all rows in this store.'
+        return range(self.rowidBase, self.rowidBase+self.nrows)
+
+    def get(self, rownum:int, colnum:int):
+        return self.columns[colnum].get(rownum)
+
+    def set(self, rownum:int, colnum:int, v):
+        while colnum >= len(self.columns):
+            self.addColumn()
+        self.columns[colnum].others[rownum] = v
+
+    def itercol(self, colnum:int):
+        'Generate all values in column *colnum*, in row number order.'
+        get = self.columns[colnum].get
+        for rownum in range(self.nrows):
+            yield get(rownum)
+
+
+class ColumnarRow:
+    'Sequence proxy for one row in a ColumnarStore.  Copies are detached plain lists.'
+    __slots__ = ('_store', '_rownum')
+
+    def __init__(self, store, rownum):
+        self._store = store
+        self._rownum = rownum
+
+    def __len__(self):
+        return self._store.ncols
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return list(self)[k]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('column index out of range')
+        return self._store.get(self._rownum, k)
+
+    def __setitem__(self, k, v):
+        if k < 0:
+            k += len(self)
+        if k < 0:
+            raise IndexError('column index out of range')
+        self._store.set(self._rownum, k, v)
+
+    def __getattr__(self, k):
+        'to enable .fieldname'
+        try:
+            return self[self._store.fields.index(k)]
+        except ValueError as e:
+            raise AttributeError(k) from e
+
+    def __iter__(self):
+        store, rownum = self._store, self._rownum
+        for coldata in store.columns:
+            yield coldata.get(rownum)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return list(self)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+vd.addGlobals(
+    ColumnarStore=ColumnarStore,
+    ColumnarRow=ColumnarRow,
+)
+
+
+def test_columnar_rows(vd):
+    import visidata
+    from visidata import Path
+    vd.options.columnar_rows = True
+    try:
+        vs = vd.openSource(Path(str(vd.pkg_resources_files(visidata) / 'tests/sample.tsv')))
+        vd.sync(vs.ensureLoaded())
+    finally:
+        vd.options.columnar_rows = False
+
+    assert isinstance(vs.rows[0], ColumnarRow)
+    assert vs.nRows == 43
+    assert [c.getValue(vs.rows[0]) for c in vs.columns] == '2016-01-06 East Jones Pencil 95 1.99 189.05'.split()
+
+    vs.columns[1].setValue(vs.rows[0], 'West')
+    assert vs.rows[0][1] == 'West'
+    assert vs.rows[1][1] == 'Central'
+    assert list(vs.rows[0])[:3] == ['2016-01-06', 'West', 'Jones']
+
+    store = ColumnarStore()
+    store.append(['a', 'b'])
+    store.append(['a', 'c', 'd'])
+    store.append([None, 'e'])
+    assert list(store.itercol(1)) == ['b', 'c', 'e']
+    assert list(store.itercol(2)) == [None, 'd', None]
+    assert len(store.columns[1].buf) == 3
+    assert store.rowids()[1] != ColumnarStore().rowidBase+1
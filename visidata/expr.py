@@ -1,16 +1,60 @@
+import ast
+import itertools
 import time
 
-from visidata import Progress, Sheet, Column, asyncthread, vd, Column
+from visidata import VisiData, Progress, Sheet, Column, asyncthread, vd, Column, LazyComputeRow, wrapply
+
+
+vd.option('expr_numpy', True, 'evaluate arithmetic expressions of float columns over arrays of values with numpy (if installed), when calculating many rows at once')
+
+
+@VisiData.lazy_property
+def exprNumpy(vd):
+    'numpy module, or False if not installed.'
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return False
+
+
+# ast nodes allowed in expressions evaluated over numpy arrays, which must give the same results as over Python floats
+_arrayNodes = (ast.Expression, ast.Name, ast.Load, ast.BinOp, ast.UnaryOp, ast.Compare,
+               ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+               ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class ExprRowNames(dict):
+    'Names for evaluating an expression on one row: values of *cols* ({name: Column}), calculated when first used, and names in *ctxnames* from the row context.'
+    __slots__ = ('col', 'row', 'cols', 'ctxnames')
+
+    def __init__(self, col, row, cols, ctxnames):
+        self.col = col
+        self.row = row
+        self.cols = cols
+        self.ctxnames = ctxnames
+
+    def __missing__(self, k):
+        c = self.cols.get(k)
+        if c is not None:
+            ret = self[k] = c.getTypedValue(self.row)
+            return ret
+        if k in self.ctxnames:
+            return LazyComputeRow(self.col.sheet, self.row, self.col, curcol=self.col)[k]
+        raise KeyError(k)  # global
 
 
 class ExprColumn(Column):
     'Column using *expr* to derive the value from each row.'
+    batchRows = 1000  # rows evaluated together by getTypedValues
+
     def __init__(self, name, expr=None, **kwargs):
         super().__init__(name, **kwargs)
         self.expr = expr or name
         self.ncalcs = 0
         self.totaltime = 0
         self.maxtime = 0
+        self._batching = False
 
     def calcValue(self, row):
         t0 = time.perf_counter()
@@ -27,6 +71,94 @@ class ExprColumn(Column):
         if a != b:
             vd.warning("Cannot change value of calculated column.  Use `'` to freeze column.")
 
+    def bindNames(self):
+        '''Return (cols, ctxnames) for the names used by the expression, as the row context would find them:
+           *cols* is {name: Column} of other columns on this sheet, and *ctxnames* is the set of other names from the row context (not globals).'''
+        cols = {}
+        ctxnames = set()
+        lcm = LazyComputeRow(self.sheet, None, self, curcol=self)._lcm
+        colsByName = self.sheet.availColsByName
+        for name in self.compiledExpr.co_names:
+            c = next((c for c in colsByName.get(name, []) if c is not self), None)
+            if c is not None:
+                cols[name] = c
+            elif name in lcm or name in lcm.locals or name in ('sheet', 'row', '_row', 'col'):
+                ctxnames.add(name)
+        return cols, ctxnames
+
+    def isArithmetic(self, cols):
+        'Return True if the expression only uses arithmetic and single comparisons of *cols* and numeric constants.'
+        try:
+            tree = ast.parse(self.expr.strip(), mode='eval')
+        except SyntaxError:
+            return False
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant):
+                if type(node.value) not in (int, float) or abs(node.value) > 2**53:
+                    return False
+            elif not isinstance(node, _arrayNodes):
+                return False
+            elif isinstance(node, ast.Name) and node.id not in cols:
+                return False
+            elif isinstance(node, ast.Compare) and len(node.ops) > 1:
+                return False
+        return bool(cols)
+
+    def evalArrays(self, colvals:dict, n):
+        'Return list of values of the expression evaluated over numpy arrays of *colvals* ({name: list of values}), or None if not possible with the same results.'
+        np = vd.exprNumpy
+        arrays = {}
+        for name, vals in colvals.items():
+            if any(type(v) is not float for v in vals):
+                return None
+            arrays[name] = np.array(vals, dtype=np.float64)
+        try:
+            with np.errstate(all='raise'):
+                r = eval(self.compiledExpr, {'__builtins__': {}}, arrays)
+        except Exception:  # Python would raise or give different results, for at least some rows
+            return None
+        if not isinstance(r, np.ndarray) or r.shape != (n,):
+            return None
+        return r.tolist()
+
+    def getTypedValues(self, rows, prog=None) -> list:
+        '''Return list of typed values for each of *rows*, evaluating the expression for blocks of rows with names resolved once.
+           If the expression is arithmetic of float columns, evaluate each block as numpy arrays.'''
+        if self._batching or self._cachedValues is not None or self.defer or not self.compiledExpr:
+            return super().getTypedValues(rows, prog)
+
+        cols, ctxnames = self.bindNames()
+        arrays = self.sheet.options.expr_numpy and self.isArithmetic(cols) and vd.exprNumpy
+        gl = vd.getGlobals()
+        ret = []
+        self._batching = True  # expressions referencing this column again calculate each row separately
+        try:
+            it = iter(rows)
+            while True:
+                block = list(itertools.islice(it, self.batchRows))
+                if not block:
+                    break
+                t0 = time.perf_counter()
+                vals = None
+                if arrays:
+                    colvals = {name: c.getTypedValues(block) for name, c in cols.items()}
+                    vals = self.evalArrays(colvals, len(block))
+                if vals is not None:
+                    ret.extend(wrapply(self.type, v) for v in vals)
+                else:
+                    for row in block:
+                        v = wrapply(eval, self.compiledExpr, gl, ExprRowNames(self, row, cols, ctxnames))
+                        ret.append(wrapply(self.type, v))
+                t1 = time.perf_counter()
+                self.ncalcs += len(block)
+                self.maxtime = max(self.maxtime, (t1-t0)/len(block))
+                self.totaltime += (t1-t0)
+                if prog:
+                    prog.addProgress(len(block))
+        finally:
+            self._batching = False
+        return ret
+
     @property
     def expr(self):
         return self._expr
@@ -70,6 +202,26 @@ class CompleteExpr:
         return base + varnames[state%len(varnames)]
 
 
+def test_expr_batch(vd):
+    from visidata import ColumnItem, TypedExceptionWrapper
+    vs = Sheet('test', rows=[[1.5, 2.0, 'x'], [3.0, 0.0, 'y'], [-2.0, 4.0, None]])
+    vs.addColumn(ColumnItem('a', 0, type=float))
+    vs.addColumn(ColumnItem('b', 1, type=float))
+    vs.addColumn(ColumnItem('s', 2))
+    for expr in ['a*2 + b', 'a > b', 'a / b', 's.upper() if s else a', 'row.a + nRows']:
+        c = ExprColumn('e', expr)
+        vs.addColumn(c)
+        vd.clearCaches()
+        expected = [c.getTypedValue(r) for r in vs.rows]
+        got = c.getTypedValues(vs.rows)
+        for x, y in zip(expected, got):
+            if isinstance(x, TypedExceptionWrapper):
+                assert isinstance(y, TypedExceptionWrapper), expr
+            else:
+                assert x == y and type(x) is type(y), expr
+        vs.columns.remove(c)
+
+
 @Column.api
 @asyncthread
 def setValuesFromExpr(self, rows, expr, **kwargs):
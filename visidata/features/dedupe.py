@@ -10,6 +10,18 @@ in the sheet.
 If key columns *are* specified, then duplicates are detected based on the
 values in just those columns.
 
+With `options.dedupe_hash`, only a 128-bit fingerprint of each unique key is
+kept (plus a reference to its first row), instead of the tuple of values.
+With `options.dedupe_verify` (the default), a matching fingerprint is confirmed
+by comparing the values of both rows, so a hash collision cannot mark a
+unique row as a duplicate.  Fingerprints are of a normalized form of the
+values, so values which are equal in Python (like `1`, `1.0` and `True`) are
+duplicates, as they are without `options.dedupe_hash`.  When more than
+`options.dedupe_max_fingerprints` are needed, the fingerprints are spilled
+into partitioned temporary files, and the remaining rows are checked one
+partition at a time; the files are read in blocks, but the unique
+fingerprints of one partition are kept in memory at once.
+
 ## Commands
 
 - `select-duplicate-rows` sets the selection status in VisiData to `selected`
@@ -23,10 +35,63 @@ values in just those columns.
 __author__ = "Jeremy Singer-Vine <jsvine@gmail.com>"
 
 from copy import copy
+import decimal
+import fractions
+import hashlib
+import numbers
+import struct
+import tempfile
 
 from visidata import Sheet, TableSheet, asyncthread, Progress, vd
 
 
+vd.option('dedupe_hash', False, 'keep 128-bit fingerprints of keys instead of their values when deduplicating', replay=True)
+vd.option('dedupe_verify', True, 'compare values of rows with the same fingerprint when deduplicating', replay=True)
+vd.option('dedupe_max_fingerprints', 0, 'spill fingerprints to temporary files beyond this many unique keys (0 for no limit)')
+
+_spillrec = struct.Struct('<16sQ')  # fingerprint, row index
+_spillblock = 4096  # records read from a spill file at a time
+
+
+def normalized(v) -> bytes:
+    'Return bytes for *v* which are the same for values that are equal in Python, like 1, 1.0, True and Decimal("1.0").'
+    if v is None:
+        return b'n'
+    if isinstance(v, str):
+        return b's' + v.encode('utf-8', 'surrogateescape')
+    if isinstance(v, bytes):
+        return b'b' + v
+    if isinstance(v, (numbers.Rational, float, decimal.Decimal)):
+        try:
+            q = fractions.Fraction(v)
+        except (ValueError, OverflowError):  # nan, inf
+            return b'f' + repr(float(v)).encode()
+        return b'q%d/%d' % (q.numerator, q.denominator)
+    if isinstance(v, (tuple, list)):
+        return b't' + fingerprint(v)
+    return b'r' + repr(v).encode('utf-8', 'surrogateescape')
+
+
+def fingerprint(vals):
+    'Return 128-bit hash of the normalized values in *vals*.'
+    h = hashlib.blake2b(digest_size=16)
+    for v in vals:
+        b = normalized(v)
+        h.update(struct.pack('<Q', len(b)))
+        h.update(b)
+    return h.digest()
+
+
+def _iterSpilled(f):
+    'Generate (fingerprint, row index) for the records in spill file *f*, reading a block at a time.'
+    f.seek(0)
+    while True:
+        block = f.read(_spillrec.size*_spillblock)
+        if not block:
+            return
+        yield from _spillrec.iter_unpack(block)
+
+
 def gen_identify_duplicates(sheet):
     """
     Takes a sheet, and returns a generator yielding a tuple for each row
@@ -45,6 +110,10 @@ def gen_identify_duplicates(sheet):
     else:
         cols_to_check = sheet.keyCols
 
+    if sheet.options.dedupe_hash:
+        yield from gen_identify_duplicates_hashed(sheet, cols_to_check)
+        return
+
     seen = set()
     for r in sheet.rows:
         vals = tuple(col.getValue(r) for col in cols_to_check)
@@ -54,6 +123,92 @@ def gen_identify_duplicates(sheet):
         yield (r, is_dupe)
 
 
+def gen_identify_duplicates_hashed(sheet, cols):
+    """
+    Like `gen_identify_duplicates`, but keeping only a fingerprint and the
+    index of the first row of each unique key in *cols*.
+    """
+    verify = sheet.options.dedupe_verify
+    maxfps = sheet.options.dedupe_max_fingerprints
+    rows = sheet.rows
+
+    def getvals(r):
+        return tuple(col.getValue(r) for col in cols)
+
+    seen = {}  # fingerprint -> index of first row, or list of indexes on collision
+    for i, r in enumerate(rows):
+        if maxfps and len(seen) >= maxfps:
+            yield from _gen_spilled_duplicates(sheet, seen, i, getvals, verify)
+            return
+
+        vals = getvals(r)
+        fp = fingerprint(vals)
+        firsts = seen.get(fp)
+        if firsts is None:
+            seen[fp] = i
+            yield (r, False)
+        elif not verify:
+            yield (r, True)
+        elif _isdupe(rows, firsts, vals, getvals):
+            yield (r, True)
+        else:
+            seen[fp] = (firsts if isinstance(firsts, list) else [firsts]) + [i]
+            yield (r, False)
+
+
+def _isdupe(rows, firsts, vals, getvals):
+    'Return True if *vals* are the values of any of the rows at indexes *firsts*.'
+    if not isinstance(firsts, list):
+        return getvals(rows[firsts]) == vals
+    return any(getvals(rows[j]) == vals for j in firsts)
+
+
+def _gen_spilled_duplicates(sheet, seen, start, getvals, verify):
+    """
+    Yield `(row, is_dupe)` for rows from index *start*, given the *seen*
+    fingerprints of earlier rows, using partitioned temporary files so that
+    only one partition of fingerprints is in memory at a time.
+    """
+    rows = sheet.rows
+    maxfps = sheet.options.dedupe_max_fingerprints
+    nparts = min(256, max(2, -(-len(rows) // maxfps)))
+    parts = [tempfile.TemporaryFile() for _ in range(nparts)]
+    try:
+        # earlier rows first, so that the first occurrence in each partition is the first in the sheet
+        for fp, firsts in seen.items():
+            for j in (firsts if isinstance(firsts, list) else [firsts]):
+                parts[fp[0] % nparts].write(_spillrec.pack(fp, j))
+        seen.clear()
+
+        for i in range(start, len(rows)):
+            fp = fingerprint(getvals(rows[i]))
+            parts[fp[0] % nparts].write(_spillrec.pack(fp, i))
+
+        dupes = bytearray(len(rows)-start)
+        for f in parts:
+            firsts = {}
+            for fp, i in _iterSpilled(f):
+                prev = firsts.get(fp)
+                if prev is None:
+                    firsts[fp] = i
+                elif not verify:
+                    dupes[i-start] = 1
+                else:
+                    vals = getvals(rows[i])
+                    if _isdupe(rows, prev, vals, getvals):
+                        if i >= start:
+                            dupes[i-start] = 1
+                    else:
+                        firsts[fp] = (prev if isinstance(prev, list) else [prev]) + [i]
+            f.close()
+    finally:
+        for f in parts:
+            f.close()
+
+    for i in range(start, len(rows)):
+        yield (rows[i], dupes[i-start] == 1)
+
+
 @Sheet.api
 @asyncthread
 def select_duplicate_rows(sheet, duplicates=True):
@@ -102,6 +257,33 @@ def dedupe_rows(sheet):
     return vs
 
 
+def test_dedupe_hashed(vd):
+    from visidata import ItemColumn
+    keys = list('abcabdxyzzaxe') + [1, 1.0, True, 2.5, decimal.Decimal('2.5'), None, None, (1, 'a'), (True, 'a')]
+    vs = Sheet('dups', columns=[ItemColumn('k', 0)], rows=[[k] for k in keys])
+    expected = [0, 1, 2, 5, 6, 7, 8, 12, 13, 16, 18, 20]  # indexes of first rows with each key
+
+    def deduped():
+        ds = vs.dedupe_rows()
+        vd.sync(ds.reload())
+        vs.clearSelected()
+        vd.sync(vs.select_duplicate_rows())
+        assert not any(vs.isSelected(r) for r in ds.rows)
+        assert len(ds.rows) + vs.nSelectedRows == len(vs.rows)
+        rowidx = {id(r):i for i, r in enumerate(vs.rows)}
+        return [rowidx[id(r)] for r in ds.rows]
+
+    assert deduped() == expected
+    vs.options.dedupe_hash = True
+    try:
+        assert deduped() == expected
+        vs.options.dedupe_max_fingerprints = 3
+        assert deduped() == expected
+    finally:
+        vs.options.unset('dedupe_hash')
+        vs.options.unset('dedupe_max_fingerprints')
+
+
 # Add longname-commands to VisiData to execute these methods
 TableSheet.addCommand(None, "select-duplicate-rows", "sheet.select_duplicate_rows()", "select each row that is a duplicate of a prior row")
 TableSheet.addCommand(None, "dedupe-rows", "vd.push(sheet.dedupe_rows())", "open new sheet in which only non-duplicate rows in the active sheet are included")
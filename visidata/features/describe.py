@@ -1,11 +1,14 @@
+import collections
+import itertools
 from copy import copy
 from statistics import mode, median, mean, stdev
 
-from visidata import vd, Column, ColumnAttr, vlen, RowColorizer, asyncthread, Progress, wrapply
+from visidata import vd, Column, ColumnAttr, ItemColumn, vlen, RowColorizer, asyncthread, Progress, wrapply, TypedExceptionWrapper, getitemdeep
 from visidata import BaseSheet, TableSheet, ColumnsSheet, SheetsSheet
 
 
 vd.option('describe_aggrs', 'mean stdev', 'numeric aggregators to calculate on Describe sheet', help=vd.help_aggregators)
+vd.option('describe_workers', 0, 'number of worker processes for describing columns of large sheets in parallel (0 or 1 to describe serially)', replay=True)
 
 
 @Column.api
@@ -20,6 +23,184 @@ def isError(col, row):
         return True
 
 
+def _describe_chunk(rows, exprs, start):
+    'Return list of ({raw value: [indexes of rows with that value]}, [indexes of rows with errors]) for each of *exprs* over *rows*, counting from *start*.  Run in worker process.'
+    ret = []
+    for expr in exprs:
+        groups = {}
+        erroridxs = []
+        for i, row in enumerate(rows, start):
+            try:
+                k = getitemdeep(row, expr, None)
+            except Exception:
+                erroridxs.append(i)
+                continue
+            idxs = groups.get(k)
+            if idxs is None:
+                groups[k] = [i]
+            else:
+                idxs.append(i)
+        ret.append((groups, erroridxs))
+    return ret
+
+
+_jsonTypes = (int, float, str, bool, type(None))  # types of stats kept in the sidecar cache
+
+
+class DescribeStats:
+    '''Stats for one source column, updated a chunk of rows at a time, so that all columns of a sheet can be described in a single pass over its rows.
+       Typed values are counted by distinct value, for mode, distinct, min, max, and median; sum and describe_aggrs are accumulated in row order.'''
+    def __init__(self, srccol, aggrnames):
+        self.srccol = srccol
+        self.isNull = srccol.sheet.isNullFunc()
+        self.numeric = vd.isNumeric(srccol)
+        self.errors = []        # source rows with errors
+        self.nulls = []         # source rows with null values
+        self.nullvals = set()   # distinct null values
+        self.counts = {}        # typed value -> number of rows, in order of first appearance
+        self.unhashable = None  # first exception from counting an unhashable value
+        self.total = 0          # like sum(), in row order
+        self.totalError = None
+        self.accumulators = {}  # aggrname -> Accumulator
+        self.vals = None        # all typed values, only for aggregators without an Accumulator
+
+        if self.numeric:
+            for aggrname in aggrnames:
+                acc = getattr(vd.aggregators[aggrname], 'accumulator', None)
+                if acc:
+                    self.accumulators[aggrname] = acc()
+                else:
+                    self.vals = []
+
+    def update(self, rows):
+        'Update stats with the values of each of *rows*.'
+        col = self.srccol
+        getValue, typefunc, isNull = col.getValue, col.type, self.isNull
+        if type(col).getValue is Column.getValue and col._cachedValues is None and not col.defer:
+            getValue = col.calcValue  # same as getValue for uncached columns
+        counts = self.counts
+        vals = []
+        for r in rows:
+            try:
+                v = getValue(r)
+                if isNull(v):
+                    self.nulls.append(r)
+                    self.nullvals.add(v)
+                    continue
+                v = typefunc(v)
+            except Exception:
+                self.errors.append(r)
+                continue
+
+            try:
+                counts[v] = counts.get(v, 0) + 1
+            except TypeError as e:
+                self.errors.append(r)
+                self.unhashable = self.unhashable or e
+                continue
+
+            vals.append(v)
+
+        if self.numeric:
+            self.addValues(vals)
+
+    def updateGroups(self, rows, groups, erroridxs):
+        'Update stats with *groups* of {raw value: [indexes into *rows*]}, and *erroridxs* of rows with errors, from _describe_chunk.'
+        typefunc, isNull = self.srccol.type, self.isNull
+        counts = self.counts
+        nullidxs = []
+        erroridxs = list(erroridxs)
+        vals = {}  # row index -> typed value
+        for k, idxs in groups.items():
+            try:
+                if isNull(k):
+                    nullidxs.extend(idxs)
+                    self.nullvals.add(k)
+                    continue
+                v = typefunc(k)
+                counts[v] = counts.get(v, 0) + len(idxs)
+            except Exception:
+                erroridxs.extend(idxs)
+                continue
+
+            if self.numeric:
+                vals.update(dict.fromkeys(idxs, v))
+
+        if vals:  # in row order, for the same float sums as describing serially
+            self.addValues([vals[i] for i in sorted(vals)])
+
+        self.nulls.extend(rows[i] for i in sorted(nullidxs))
+        self.errors.extend(rows[i] for i in sorted(erroridxs))
+
+    def addValues(self, vals):
+        'Update sum and describe_aggrs with typed *vals*.'
+        if self.totalError is None:
+            try:
+                self.total = sum(vals, self.total)
+            except Exception as e:
+                self.totalError = e
+
+        for acc in self.accumulators.values():
+            acc.updateValues(vals)
+
+        if self.vals is not None:
+            self.vals.extend(vals)
+
+    @property
+    def nvals(self):
+        return sum(self.counts.values())
+
+    def mode(self):
+        if self.unhashable:
+            raise self.unhashable
+        if not self.counts:
+            return mode([])
+        return max(self.counts.items(), key=lambda kv: kv[1])[0]  # first of the most common, like statistics.mode
+
+    def median(self):
+        n = self.nvals
+        if not n:
+            return median([])
+
+        i = n//2  # like statistics.median: value at sorted index i, or mean of values at i-1 and i
+        seen = 0
+        lo = None
+        for v in sorted(self.counts):
+            c = self.counts[v]
+            if seen <= i-1 < seen+c:
+                lo = v
+            if seen <= i < seen+c:
+                return v if n % 2 else (lo+v)/2
+            seen += c
+
+    def sum(self):
+        if self.totalError:
+            raise self.totalError
+        return self.total
+
+    def aggregate(self, aggrname):
+        acc = self.accumulators.get(aggrname)
+        if acc is None:
+            return vd.aggregators[aggrname].funcValues(self.vals)
+        if not self.nvals:
+            return vd.aggregators[aggrname].funcValues([])
+        return acc.value()
+
+    def calcStats(self, d, aggrnames):
+        'Fill *d* with the stats for the values seen so far.'
+        d['errors'] = self.errors
+        d['nulls'] = self.nulls
+        d['distinct'] = self.nullvals.union(self.counts)
+        d['mode'] = wrapply(self.mode)
+        if self.numeric:
+            d['min'] = wrapply(min, self.counts)
+            d['max'] = wrapply(max, self.counts)
+            d['sum'] = wrapply(self.sum)
+            d['median'] = wrapply(self.median)
+            for aggrname in aggrnames:
+                d[aggrname] = wrapply(self.aggregate, aggrname)
+
+
 class DescribeColumn(Column):
     def __init__(self, name, **kwargs):
         kwargs.setdefault('width', 10)
@@ -53,6 +234,8 @@ class DescribeSheet(ColumnsSheet):
         RowColorizer(7, 'color_key_col', lambda s,c,r,v: r and r in r.sheet.keyCols),
     ]
     nKeys = 2
+    describeChunkRows = 10000  # source rows described together, and minimum number sent to each worker process
+    maxCachedDistinct = 10000  # stats of columns with more distinct values are not kept in the sidecar cache
 
     def loader(self):
         super().loader()
@@ -63,43 +246,141 @@ class DescribeSheet(ColumnsSheet):
         for aggrname in vd.options.describe_aggrs.split():
             self.addColumn(DescribeColumn(aggrname, type=float))
 
-        for srccol in Progress(self.rows, 'categorizing'):
-            if not srccol.hidden:
-                self.reloadColumn(srccol)
+        uncached = collections.defaultdict(list)  # source sheet -> [srccol] without cached stats
+        for srccol in self.rows:
+            if not self.loadCachedStats(srccol, self.describeData[srccol]):
+                uncached[srccol.sheet].append(srccol)
+
+        for vs, srccols in uncached.items():
+            self.describeColumns(vs, srccols)
+
+        for vs in set(c.sheet for c in self.rows):
+            vs.saveSidecarTypes()  # also writes the stats cached above
 
     def reloadColumn(self, srccol):
-            d = self.describeData[srccol]
-            isNull = srccol.sheet.isNullFunc()
-
-            vals = list()
-            d['errors'] = list()
-            d['nulls'] = list()
-            d['distinct'] = set()
-
-            for sr in Progress(srccol.sheet.rows, 'calculating'):
-                try:
-                    v = srccol.getValue(sr)
-                    if isNull(v):
-                        d['nulls'].append(sr)
-                    else:
-                        v = srccol.type(v)
-                        vals.append(v)
-                    d['distinct'].add(v)
-                except Exception as e:
-                    d['errors'].append(sr)
-
-            d['mode'] = self.calcStatistic(d, mode, vals)
-            if vd.isNumeric(srccol):
-                for func in [min, max, sum, median]:  # use type
-                    d[func.__name__] = self.calcStatistic(d, func, vals)
-                for aggrname in vd.options.describe_aggrs.split():
-                    aggr = vd.aggregators[aggrname].funcValues
-                    d[aggrname] = self.calcStatistic(d, aggr, vals)
-
-    def calcStatistic(self, d, func, *args, **kwargs):
-        r = wrapply(func, *args, **kwargs)
-        d[func.__name__] = r
-        return r
+        'Calculate stats for *srccol*, unless cached.'
+        if not self.loadCachedStats(srccol, self.describeData[srccol]):
+            self.describeColumns(srccol.sheet, [srccol])
+            srccol.sheet.saveSidecarTypes()  # also writes the stats cached above
+
+    def describeColumns(self, vs, srccols):
+        'Calculate stats for all *srccols* of sheet *vs* in a single pass over its rows.'
+        aggrnames = vd.options.describe_aggrs.split()
+        stats = None
+        if self.canDescribeParallel(vs, srccols):
+            stats = self.describeParallel(vs, srccols, aggrnames)
+
+        if stats is None:
+            stats = [DescribeStats(c, aggrnames) for c in srccols]
+            it = iter(vs.rows)
+            with Progress(gerund='describing', total=vs.nRows) as prog:
+                while True:
+                    chunk = list(itertools.islice(it, self.describeChunkRows))
+                    if not chunk:
+                        break
+                    for st in stats:
+                        st.update(chunk)
+                    prog.addProgress(len(chunk))
+
+        for st in stats:
+            d = self.describeData[st.srccol]
+            st.calcStats(d, aggrnames)
+            self.saveCachedStats(st.srccol, d)
+
+    def canDescribeParallel(self, vs, srccols):
+        'Return True if *srccols* can be described in worker processes: plain item columns only.'
+        if self.options.describe_workers <= 1:
+            return False
+        if not isinstance(vs.rows, list) or len(vs.rows) < 2*self.describeChunkRows:
+            return False
+        return all(type(c) is ItemColumn and not c.defer for c in srccols)
+
+    def describeParallel(self, vs, srccols, aggrnames):
+        '''Group the rows of *vs* by the raw values of each of *srccols* in worker processes, in chunks of rows.
+           Then type and check for null only one value of each group, to update stats in the main process.
+           Return list of DescribeStats, or None if the rows could not be grouped (like unhashable or unpicklable values).'''
+        rows = vs.rows
+        nworkers = self.options.describe_workers
+        chunksize = max(self.describeChunkRows, -(-len(rows)//(nworkers*4)))
+        exprs = [c.expr for c in srccols]
+        stats = [DescribeStats(c, aggrnames) for c in srccols]
+
+        def _mergeChunk(fut, n):
+            for st, (groups, erroridxs) in zip(stats, fut.result()):
+                st.updateGroups(rows, groups, erroridxs)
+            prog.addProgress(n)
+
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor = vd.sessionPool('describe', nworkers)
+        pending = []
+        try:
+            with Progress(gerund='describing', total=len(rows)) as prog:
+                for start in range(0, len(rows), chunksize):
+                    chunk = rows[start:start+chunksize]
+                    pending.append((executor.submit(_describe_chunk, chunk, exprs, start), len(chunk)))
+                    if len(pending) >= nworkers*2:
+                        _mergeChunk(*pending.pop(0))
+
+                while pending:
+                    _mergeChunk(*pending.pop(0))
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):  # a worker died; start a new pool next time
+                vd.brokenPool('describe', executor)
+            vd.exceptionCaught(e, status=False)
+            vd.warning('could not describe in parallel; describing serially')
+            return None
+        finally:
+            for fut, n in pending:
+                fut.cancel()
+
+        return stats
+
+    def _cachedStats(self, srccol):
+        'Return (sidecar, key) for the stats of *srccol*, or (None, None) if its sheet does not match its source file.'
+        vs = srccol.sheet
+        sc = vs.sidecar()
+        if sc is None or vs.hasBeenModified or vs._ordering:
+            return None, None
+        return sc, '\t'.join(map(str, (srccol.name, type(srccol).__name__, srccol.typestr, srccol.expr, vd.options.describe_aggrs)))
+
+    def loadCachedStats(self, srccol, d):
+        'Fill *d* with stats for *srccol* from sidecar cache.  Return True if found.'
+        sc, k = self._cachedStats(srccol)
+        stats = sc.get('describe', {}).get(k) if sc else None
+        if not stats or stats.get('nrows') != srccol.sheet.nRows:
+            return False
+
+        rows = srccol.sheet.rows
+        d.update(stats['values'])
+        d['distinct'] = set(d['distinct'])
+        d['errors'] = [rows[i] for i in stats['errors']]
+        d['nulls'] = [rows[i] for i in stats['nulls']]
+        return True
+
+    def saveCachedStats(self, srccol, d):
+        sc, k = self._cachedStats(srccol)
+        if not sc:
+            return
+
+        # only stats which load back from json as the same values with the same types
+        values = {}
+        for statname, v in d.items():
+            if statname in ('errors', 'nulls'):
+                continue
+            if statname == 'distinct':
+                if len(v) > self.maxCachedDistinct or not all(type(x) in _jsonTypes for x in v):
+                    return
+                v = list(v)
+            elif type(v) not in _jsonTypes:
+                return  # like errors, which are recomputed every time for their stacktraces
+            values[statname] = v
+
+        rowidx = {id(r):i for i, r in enumerate(srccol.sheet.rows)} if d['errors'] or d['nulls'] else {}
+        sc.data.setdefault('describe', {})[k] = dict(nrows=srccol.sheet.nRows,
+                        values=values,
+                        errors=[rowidx[id(r)] for r in d['errors']],
+                        nulls=[rowidx[id(r)] for r in d['nulls']])
 
     def openCell(self, col, row):
         'open copy of source sheet with rows described in current cell'
@@ -122,3 +403,95 @@ DescribeSheet.addCommand('zu', 'unselect-cell', 'cursorRow.sheet.unselect(cursor
 vd.addMenuItems('Data > Statistics > describe-sheet')
 
 vd.addGlobals({'DescribeSheet':DescribeSheet})
+
+
+def test_describe_single_pass(vd):
+    from visidata import Sheet
+    import statistics
+    rows = [dict(a=str(i%7) if i%5 else None, b=['x', '', '2.5', str(i)][i%4], c=[1e16, 1.0, -1e16, 0.1][i%4]) for i in range(100)]
+    vs = Sheet('test_describe', rows=rows)
+    vs.addColumn(ItemColumn('a', type=int))
+    vs.addColumn(ItemColumn('b', type=float))
+    vs.addColumn(ItemColumn('c', type=float))
+
+    def describe(nworkers):
+        vd.options.describe_workers = nworkers
+        ds = DescribeSheet('test_describe_describe', source=[vs])
+        ds.ensureLoaded()
+        vd.sync()
+        return [{k: v if isinstance(v, (list, set)) else str(v) for k, v in ds.describeData[c].items()} for c in vs.columns]
+
+    a = [int(r['a']) for r in rows if r['a'] is not None]
+    b = [float(r['b']) for r in rows if r['b'] not in ('x', '')]
+    try:
+        DescribeSheet.describeChunkRows = 7
+        da, db, dc = describe(0)
+        assert (da['mode'], da['median'], da['sum']) == (str(statistics.mode(a)), str(statistics.median(a)), str(sum(a)))
+        assert (db['min'], db['max'], db['median']) == (str(min(b)), str(max(b)), str(statistics.median(b)))
+        assert abs(float(db['stdev']) - statistics.stdev(b)) < 1e-9
+        assert len(da['nulls']) == 20 and len(da['distinct']) == 8
+        assert len(db['errors']) == 50 and not db['nulls']  # 'x' and ''
+        assert dc['sum'] == str(sum(r['c'] for r in rows))  # float sums depend on order
+        assert describe(2) == [da, db, dc]
+        pool = vd.sessionPool('describe', 2)
+        assert describe(2) == [da, db, dc] and vd.sessionPool('describe', 2) is pool  # same worker processes every time
+    finally:
+        DescribeSheet.describeChunkRows = 10000
+        vd.options.describe_workers = 0
+
+
+def test_describe_sidecar(vd):
+    import os
+    import tempfile
+    from visidata import Path, Sidecar
+
+    nsaves = 0
+    save = Sidecar.save
+    def _save(sc):
+        nonlocal nsaves
+        nsaves += 1
+        save(sc)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, 'nums.tsv')
+        with open(fn, 'w') as fp:
+            fp.write('n\ts\n' + ''.join('%d\tx%d\n' % (i, i%3) for i in range(10)))
+
+        def describe():
+            vs = vd.openSource(Path(fn))
+            vd.sync(vs.ensureLoaded())
+            vs.column('n').type = int
+            ds = DescribeSheet('nums_describe', source=[vs])
+            vd.sync(ds.ensureLoaded())
+            return [ds.describeData[c] for c in vs.columns]
+
+        cachehome = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = tmpdir
+        vd.options.sidecar_cache = True
+        vd.options.tsv_mmap = True
+        Sidecar.save = _save
+        try:
+            fresh = describe()
+            assert nsaves == 2  # once for the row index, once for the types and stats
+            describeColumns = DescribeSheet.describeColumns
+            DescribeSheet.describeColumns = None  # not called when all stats are cached
+            try:
+                cached = describe()
+            finally:
+                DescribeSheet.describeColumns = describeColumns
+            assert nsaves == 3  # only the types and stats again
+        finally:
+            Sidecar.save = save
+            vd.options.unset('sidecar_cache')
+            vd.options.unset('tsv_mmap')
+            if cachehome is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = cachehome
+            vd._sidecars.clear()
+
+        for d1, d2 in zip(fresh, cached):
+            assert {k: (type(v), v) for k, v in d1.items() if k not in ('errors', 'nulls')} == \
+                   {k: (type(v), v) for k, v in d2.items() if k not in ('errors', 'nulls')}
+        assert fresh[0]['sum'] == 45 and fresh[0]['distinct'] == set(range(10))
+        assert cached[1]['distinct'] == {'x0', 'x1', 'x2'}
@@ -1,11 +1,10 @@
-import collections
 from visidata import Column, Sheet, VisiData, ColumnItem, Progress, TypedExceptionWrapper, SettableColumn
 from visidata import asyncthread, vd
 
 
 @Column.api
 def resetCache(col):
-    col._cachedValues = collections.OrderedDict()
+    col.clearCache()
     vd.status("reset cache for " + col.name)
 
 
@@ -3,7 +3,7 @@ import itertools
 import functools
 from copy import copy
 
-from visidata import vd, VisiData, asyncthread, Sheet, Progress, IndexSheet, Column, CellColorizer, ColumnItem, SubColumnItem, TypedWrapper, ColumnsSheet, AttrDict
+from visidata import vd, VisiData, asyncthread, Sheet, Progress, IndexSheet, Column, CellColorizer, ColumnItem, SubColumnItem, TypedWrapper, TypedExceptionWrapper, ColumnsSheet, AttrDict
 
 vd.help_join = '# Join Help\nHELPTODO'
 
@@ -103,29 +103,184 @@ def joinkey(sheetKeyCols, row):
     return tuple(c.getDisplayValue(row) for c in sheetKeyCols)
 
 
-def groupRowsByKey(sheets:dict, rowsBySheetKey, rowsByKey):
-    with Progress(gerund='grouping', total=sum(len(vs.rows) for vs in sheets)*2) as prog:
-        for vs in sheets:
-            # tally rows by keys for each sheet
-            rowsBySheetKey[vs] = collections.defaultdict(list)
-            for r in vs.rows:
+def keyRows(vs, keycols, prog, keys=None):
+    'Return dict of [joinkey] -> list of rows on *vs* with that key, in order of first appearance.  If *keys* is given, only include rows with those keys.'
+    ret = collections.defaultdict(list)
+    for r in vs.rows:
+        prog.addProgress(1)
+        key = joinkey(keycols, r)
+        if keys is None or key in keys:
+            ret[key].append(r)
+    return ret
+
+
+def groupRowsByKey(sheets:dict, rowsBySheetKey, jointype=''):
+    '''Fill *rowsBySheetKey* with [sheet] -> { key:list(rows) } for each of *sheets* ({ sheet: list of key columns }) but the first, which iterJoinedRows streams through these hashes without storing it.
+       For inner, outer and extend joins, only rows with keys on the first sheet are needed.  If the first sheet is smaller than the others, its keys (but not its rows) are collected first, and only rows with those keys are kept.
+       For inner joins, the other sheets are hashed smallest first, and each keeps only rows with keys on the sheets hashed before it.'''
+    first, *others = sheets
+    firstkeys = jointype in ('inner', 'outer', 'extend') and others and len(first.rows) < min(len(vs.rows) for vs in others)
+    if jointype == 'inner':
+        others.sort(key=lambda vs: len(vs.rows))
+
+    with Progress(gerund='grouping', total=sum(len(vs.rows) for vs in others) + (len(first.rows) if firstkeys else 0)) as prog:
+        keys = None
+        if firstkeys:
+            keys = set()
+            for r in first.rows:
                 prog.addProgress(1)
-                key = joinkey(sheets[vs], r)
-                rowsBySheetKey[vs][key].append(r)
-
-        for vs in sheets:
-            for r in vs.rows:
-                prog.addProgress(1)
-                key = joinkey(sheets[vs], r)
-                if key not in rowsByKey: # gather for this key has not been done yet
-                    # multiplicative for non-unique keys
-                    rowsByKey[key] = [
-                        dict(crow)
-                          for crow in itertools.product(*[
-                              [(vs2, j) for j in rowsBySheetKey[vs2].get(key, [None])]
-                                  for vs2 in sheets
-                          ])
-                    ]
+                keys.add(joinkey(sheets[first], r))
+
+        for vs in others:
+            rowsBySheetKey[vs] = keyRows(vs, sheets[vs], prog, keys)
+            if jointype == 'inner':
+                keys = rowsBySheetKey[vs]
+
+
+def iterJoinedRows(sheets:dict, rowsBySheetKey, jointype=''):
+    '''Generate joined rows as {sheet1:row1, sheet2:row2, ...} for *sheets* ({ sheet: list of key columns }), with each combination of rows with the same key (multiplicative for non-unique keys).
+       First for each row of the first sheet, in order, as it is looked up in the hashes of the other sheets in *rowsBySheetKey* (from groupRowsByKey).  Then, for full, diff and merge joins, for each key not on the first sheet, in order of first appearance over the other sheets.
+       A sheet without a matching row has None.  Only generate the rows for *jointype*.'''
+    if jointype not in ('full', 'merge', 'inner', 'outer', 'diff', 'extend'):
+        return
+
+    sheetlist = list(sheets)
+    first, *others = sheetlist
+    allkeys = jointype in ('full', 'diff', 'merge')  # also keys not on the first sheet
+    seen = set()
+    with Progress(gerund='joining', total=len(first.rows)) as prog:
+        for r in first.rows:
+            prog.addProgress(1)
+            key = joinkey(sheets[first], r)
+            if allkeys:
+                seen.add(key)
+            rowlists = [[r]] + [rowsBySheetKey[vs].get(key) or [None] for vs in others]
+            yield from iterCombinedRows(sheetlist, rowlists, jointype)
+
+    if allkeys:
+        for vs in others:
+            for key in rowsBySheetKey[vs]:
+                if key not in seen:
+                    seen.add(key)
+                    rowlists = [[None]] + [rowsBySheetKey[vs2].get(key) or [None] for vs2 in others]
+                    yield from iterCombinedRows(sheetlist, rowlists, jointype)
+
+
+def iterCombinedRows(sheets:list, rowlists:list, jointype=''):
+    'Generate joined rows for one key, for *jointype*.  *rowlists* has the rows with that key for each of *sheets*, or [None] if none.'
+    allmatched = all(rows[0] is not None for rows in rowlists)
+
+    if jointype == 'inner' and not allmatched:  # only rows with matching key on all sheets
+        return
+    if jointype == 'diff' and allmatched:  # only rows without matching key on all sheets
+        return
+
+    for crow in itertools.product(*rowlists):
+        if jointype in ('outer', 'extend') and crow[0] is None:  # all rows from first sheet
+            continue
+        yield dict(zip(sheets, crow))
+
+
+class MergeOrderError(Exception):
+    'Rows of a sheet are not in order of their join keys, so it cannot be merge-joined.'
+
+
+def sortedJoinOrder(sheets:dict):
+    '''Return True if the rows of all *sheets* ({ sheet: list of key columns }) are sorted in descending order of their key columns (by Sheet.orderBy), False if in ascending order, or None if they are not all sorted by their key columns first, in the same direction and with the same types.'''
+    reverses = set()
+    for vs, keycols in sheets.items():
+        ordering = vs._ordering[:len(keycols)]
+        if len(ordering) < len(keycols):
+            return None
+        for (c, reverse), keycol in zip(ordering, keycols):
+            if c is not keycol and c != keycol.name:  # colname strings until sorted
+                return None
+            reverses.add(reverse)
+
+    if len(reverses) != 1:
+        return None
+    if any(len(set(c.type for c in cols)) != 1 for cols in zip(*sheets.values())):
+        return None
+    return reverses.pop()
+
+
+def mergekey(keycols, row):
+    'Return key of *row* to merge-join by, from the typed values of *keycols*.  Keys compare like Sheet.sort orders rows: errors (by display value), then nulls, then other values.'
+    ret = []
+    for c in keycols:
+        v = c.getTypedValue(row)
+        if isinstance(v, TypedExceptionWrapper):
+            ret.append((0, c.getDisplayValue(row)))
+        elif type(v) is TypedWrapper:
+            ret.append((1,))
+        else:
+            ret.append((2, v))
+    return tuple(ret)
+
+
+def iterKeyRuns(vs, keycols, reverse, prog):
+    '''Generate (mergekey, list of rows) for each run of rows of *vs* with the same key, streaming through its rows in order.
+       Raise MergeOrderError if the keys are not in ascending (or descending, if *reverse*) order.'''
+    runkey, run = None, []
+    for r in vs.rows:
+        prog.addProgress(1)
+        key = mergekey(keycols, r)
+        if run and key != runkey:
+            try:
+                inorder = key < runkey if reverse else key > runkey
+            except TypeError:
+                inorder = False
+            if not inorder:
+                raise MergeOrderError(f'{vs.name} is not in order of its join keys')
+            yield runkey, run
+            run = []
+        runkey = key
+        run.append(r)
+
+    if run:
+        yield runkey, run
+
+
+def iterMergeJoinedRows(sheets:dict, reverse, jointype='', rowsBySheetKey=None):
+    '''Generate joined rows like iterJoinedRows, by merging runs of rows with the same key, for *sheets* ({ sheet: list of key columns }) all sorted by their key columns (see sortedJoinOrder).
+       Only the current run of each sheet is kept.  Keys are generated in sorted order, also for full, diff and merge joins.
+       If *rowsBySheetKey* is given, fill it like groupRowsByKey, but only with rows that match a row on the first sheet (for extend joins).
+       Raise MergeOrderError if the rows of any sheet are not in order after all.'''
+    if jointype not in ('full', 'merge', 'inner', 'outer', 'diff', 'extend'):
+        return
+
+    sheetlist = list(sheets)
+    first, *others = sheetlist
+    nextkey = max if reverse else min
+    with Progress(gerund='joining', total=sum(len(vs.rows) for vs in sheetlist)) as prog:
+        runiters = [iterKeyRuns(vs, sheets[vs], reverse, prog) for vs in sheetlist]
+        heads = [next(it, None) for it in runiters]
+        while any(heads):
+            if jointype == 'inner' and not all(heads):  # no more keys on all sheets
+                break
+            if jointype in ('outer', 'extend') and not heads[0]:  # no more keys on first sheet
+                break
+
+            try:
+                key = nextkey(h[0] for h in heads if h)
+            except TypeError as e:
+                raise MergeOrderError(f'join keys cannot be compared: {e}')
+
+            rowlists = []
+            for i, h in enumerate(heads):
+                if h and h[0] == key:
+                    rowlists.append(h[1])
+                    heads[i] = next(runiters[i], None)
+                else:
+                    rowlists.append([None])
+
+            if rowsBySheetKey is not None and rowlists[0][0] is not None:
+                firstkey = joinkey(sheets[first], rowlists[0][0])
+                for vs, rows in zip(others, rowlists[1:]):
+                    if rows[0] is not None:
+                        rowsBySheetKey[vs][firstkey] = rows
+
+            yield from iterCombinedRows(sheetlist, rowlists, jointype)
 
 
 class JoinKeyColumn(Column):
@@ -222,35 +377,25 @@ class JoinSheet(Sheet):
                       newname = c.name if ctr[c.name] == 1 else '%s_%s' % (vs.name, c.name)
                       self.addColumn(SubColumnItem(vs, c, name=newname))
 
-        rowsBySheetKey = {}   # [sheet] -> { key:list(rows), ... }
-        rowsByKey = {}  # [key] -> [{sheet1:row1, sheet2:row1, ... }, ...]
-
-        groupRowsByKey(self.sheetKeyCols, rowsBySheetKey, rowsByKey)
-
         self.rows = []
 
-        with Progress(gerund='joining', total=len(rowsByKey)) as prog:
-            for k, combinedRows in rowsByKey.items():
-                prog.addProgress(1)
+        reverse = sortedJoinOrder(self.sheetKeyCols)
+        if reverse is not None:
+            try:
+                for combinedRow in iterMergeJoinedRows(self.sheetKeyCols, reverse, self.jointype):
+                    self.addRow(combinedRow)
+                return
+            except MergeOrderError as e:
+                vd.warning(f'{e}; joining by hash instead')
+                self.rows = []
 
-                if self.jointype in ['full', 'merge']:  # keep all rows from all sheets
-                    for combinedRow in combinedRows:
-                        self.addRow(combinedRow)
+        rowsBySheetKey = {}   # [sheet] -> { key:list(rows), ... }, for all sheets but the first
 
-                elif self.jointype == 'inner':  # only rows with matching key on all sheets
-                    for combinedRow in combinedRows:
-                        if all(r is not None for r in combinedRow.values()):
-                            self.addRow(combinedRow)
+        groupRowsByKey(self.sheetKeyCols, rowsBySheetKey, self.jointype)
 
-                elif self.jointype == 'outer':  # all rows from first sheet
-                    for combinedRow in combinedRows:
-                        if combinedRow[sheets[0]]:
-                            self.addRow(combinedRow)
+        for combinedRow in iterJoinedRows(self.sheetKeyCols, rowsBySheetKey, self.jointype):
+            self.addRow(combinedRow)
 
-                elif self.jointype == 'diff':  # only rows without matching key on all sheets
-                    for combinedRow in combinedRows:
-                        if not all(r is not None for r in combinedRow.values()):
-                            self.addRow(combinedRow)
 
 
 ## for ExtendedSheet_reload below
@@ -289,7 +434,6 @@ def ExtendedSheet_reload(self, sheets):
             self.addColumn(copy(c))
 
     self.rowsBySheetKey = {}  # [srcSheet][key] -> list(rowobjs from sheets[0])
-    rowsByKey = {}  # [key] -> [{sheet1:row1, sheet2:row1, ... }, ...]
 
     for sheetnum, vs in enumerate(sheets[1:]):
         # subsequent elements are the rows from each source, in order of the source sheets
@@ -300,16 +444,25 @@ def ExtendedSheet_reload(self, sheets):
                 newcol = ExtendedColumn(newname, srcsheet=vs, rowsBySheetKey=self.rowsBySheetKey, firstJoinSource=sheets[0], sourceCol=c)
                 self.addColumn(newcol)
 
-    groupRowsByKey(self.sheetKeyCols, self.rowsBySheetKey, rowsByKey)
-
     self.rows = []
 
-    with Progress(gerund='joining', total=len(rowsByKey)) as prog:
-        for k, combinedRows in rowsByKey.items():
-            prog.addProgress(1)
-            for combinedRow in combinedRows:
-                if combinedRow[sheets[0]]:
-                    self.addRow(combinedRow[sheets[0]])
+    reverse = sortedJoinOrder(self.sheetKeyCols)
+    if reverse is not None:
+        try:
+            for vs in sheets[1:]:
+                self.rowsBySheetKey[vs] = collections.defaultdict(list)
+            for combinedRow in iterMergeJoinedRows(self.sheetKeyCols, reverse, 'extend', self.rowsBySheetKey):
+                self.addRow(combinedRow[sheets[0]])
+            return
+        except MergeOrderError as e:
+            vd.warning(f'{e}; joining by hash instead')
+            self.rows = []
+            self.rowsBySheetKey.clear()
+
+    groupRowsByKey(self.sheetKeyCols, self.rowsBySheetKey, 'extend')
+
+    for combinedRow in iterJoinedRows(self.sheetKeyCols, self.rowsBySheetKey, 'extend'):
+        self.addRow(combinedRow[sheets[0]])
 
 
 ## for ConcatSheet
@@ -382,6 +535,66 @@ def chooseJointype(vd):
             type='jointype')
 
 
+def test_sortmerge_join(vd):
+    def mksheet(name, keys):
+        vs = Sheet(name, rows=[[k, f'{name}{i}'] for i, k in enumerate(keys)])
+        vs.addColumn(ColumnItem('k', 0, type=int))
+        vs.addColumn(ColumnItem('v', 1))
+        vs.setKeys(vs.columns[:1])
+        return vs
+
+    a = mksheet('a', ['3', '1', '2', '4', None, 'x'])  # a4 is null, a5 is an error
+    b = mksheet('b', ['4', '2', '1', '4', '4', '5', None, 'y'])
+    vd.clearCaches()
+    def joined(jointype):
+        js = a.openJoin([b], jointype=jointype)
+        vd.sync(js.ensureLoaded())
+        return [(r[a] and r[a][1], r[b] and r[b][1]) for r in js.rows]
+
+    # hash join: rows of the first sheet in order
+    assert joined('outer') == [('a0', None), ('a1', 'b2'), ('a2', 'b1'), ('a3', 'b0'), ('a3', 'b3'), ('a3', 'b4'), ('a4', 'b6'), ('a5', None)]
+    assert joined('full') == joined('outer') + [(None, 'b5'), (None, 'b7')]  # then keys not on the first sheet
+
+    # inner hash join: only rows with keys on the smaller sheet are kept, either way; rows of the first sheet in order
+    c = mksheet('c', ['1', '2', '1'])
+    vd.clearCaches()
+    js = c.openJoin([b], jointype='inner')
+    vd.sync(js.ensureLoaded())
+    assert [(r[c][1], r[b][1]) for r in js.rows] == [('c0', 'b2'), ('c1', 'b1'), ('c2', 'b2')]
+    js = b.openJoin([c], jointype='inner')
+    vd.sync(js.ensureLoaded())
+    assert [(r[b][1], r[c][1]) for r in js.rows] == [('b1', 'c1'), ('b2', 'c0'), ('b2', 'c2')]
+
+    # sort-merge join, if all sheets are sorted by their key columns: in order of the typed keys, errors and nulls first
+    a.addRow(['10', 'a6'])
+    b.addRow(['10', 'b8'])
+    def sortkeys(reverse=False):
+        for vs in (a, b):
+            vs._ordering = [(vs.columns[0], reverse)]
+            vd.clearCaches()
+            vd.sync(vs.sort())
+
+    sortkeys()
+    full = [('a5', None), (None, 'b7'), ('a4', 'b6'), ('a1', 'b2'), ('a2', 'b1'), ('a0', None), ('a3', 'b0'), ('a3', 'b3'), ('a3', 'b4'), (None, 'b5'), ('a6', 'b8')]
+    assert joined('full') == full
+    assert joined('outer') == [r for r in full if r[0]]
+    assert joined('inner') == [r for r in full if all(r)]
+    assert joined('diff') == [r for r in full if not all(r)]
+
+    ext = a.openJoin([b], jointype='extend')
+    vd.sync(ext.reload())
+    assert [(r[1], ext.column('b_v').getValue(r)) for r in ext.rows] == [(ra, rb and rb.replace('b3', 'b0').replace('b4', 'b0')) for ra, rb in full if ra]
+
+    sortkeys(reverse=True)
+    assert joined('outer') == [('a6', 'b8'), ('a3', 'b0'), ('a3', 'b3'), ('a3', 'b4'), ('a0', None), ('a2', 'b1'), ('a1', 'b2'), ('a4', 'b6'), ('a5', None)]
+
+    # rows out of order after sorting: hash join instead
+    a.rows.reverse()
+    merged = joined('full')
+    a._ordering = []
+    assert merged == joined('full')
+
+
 IndexSheet.addCommand('&', 'join-selected', 'left, rights = someSelectedRows[0], someSelectedRows[1:]; vd.push(left.openJoin(rights, jointype=chooseJointype()))', 'merge selected sheets with visible columns from all, keeping rows according to jointype')
 IndexSheet.bindkey('g&', 'join-selected')
 Sheet.addCommand('&', 'join-sheets-top2', 'vd.push(openJoin(vd.sheets[1:2], jointype=chooseJointype()))', 'concatenate top two sheets in Sheets Stack')
@@ -2,10 +2,7 @@ from visidata import VisiData, vd, Column, Sheet, Fanout, asyncthread
 
 @Column.api
 def setWidth(self, w):
-    if self.width != w:
-        if self.width == 0 or w == 0:  # hide/unhide
-            vd.addUndo(setattr, self, '_width', self.width)
-    self._width = w
+    self.width = w  # property setter adds undo for hide/unhide
 
 
 @Column.api
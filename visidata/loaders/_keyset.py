@@ -0,0 +1,291 @@
+import collections
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+from visidata import vd
+
+vd.option('window_page_rows', 1000, 'number of rows fetched together by windowed database sheets')
+vd.option('window_max_pages', 64, 'maximum number of pages of rows kept in memory by each windowed database sheet')
+
+
+class KeysetRows(collections.abc.Sequence):
+    '''Read-only sequence of the rows of a database table in order of a unique key, fetched a page at a time by keyset pagination, with a bounded LRU of pages.
+       - *fetchPage(afterkey, n)* returns up to *n* rows with key greater than *afterkey* (or from the start, if *afterkey* is None), in key order.
+       - *skipKey(afterkey, n)* returns the key of the *n*-th row after *afterkey* (or from the start, if None), or None if there are fewer rows.
+       - *skipKeyBack(beforekey, n)*, if given, returns the key of the *n*-th row before *beforekey* (or from the end, if None), or None if there are fewer rows.
+       - *keyfunc(row)* returns the key of *row*.
+       *nrows* is the (possibly estimated, unless *exact*) number of rows; it is corrected as pages are fetched.  Pages far from the start are found by skipping back from the end only if *nrows* is *exact*.
+       While drawing (see drawing()), *placeholder* is returned for rows of pages not in memory, which are fetched in the background instead.
+       Rows cannot be added, removed or reordered.'''
+    maxPageKeys = 4096  # starting keys kept for pages not in memory, so returning to a page does not skip from the start again
+    def __init__(self, nrows, fetchPage, skipKey, keyfunc, pageRows=1000, maxPages=64, skipKeyBack=None, exact=False, placeholder=None):
+        self.nrows = nrows
+        self.fetchPage = fetchPage
+        self.skipKey = skipKey
+        self.skipKeyBack = skipKeyBack
+        self.keyfunc = keyfunc
+        self.exact = exact
+        self.placeholder = placeholder
+        self.pageRows = pageRows
+        self.maxPages = max(maxPages, 3)  # at least the current page and its neighbors
+        self._pages = OrderedDict()  # pagenum -> list of rows
+        self._pageKeys = OrderedDict()  # pagenum -> key of last row of previous page, LRU; page 0 starts at None
+        self._lock = threading.RLock()  # for _pages, held only briefly, so drawing does not wait for the database
+        self._fetchLock = threading.RLock()  # for queries and _pageKeys, one page fetched at a time
+        self._drawing = threading.local()
+        self._lastPage = None
+        self._queue = collections.deque()  # pagenums to prefetch
+        self._qlock = threading.Lock()
+        self._prefetcher = None
+
+    def __len__(self):
+        return self.nrows
+
+    @contextmanager
+    def drawing(self):
+        'Within this context, in this thread only, return placeholder for rows of pages not in memory, and fetch those pages in the background.'
+        self._drawing.active = True
+        try:
+            yield
+        finally:
+            self._drawing.active = False
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            ret = []
+            while True:
+                indices = range(*i.indices(self.nrows))  # again after each row, as fetching a page can correct nrows
+                if len(ret) >= len(indices):
+                    return ret
+                try:
+                    ret.append(self[indices[len(ret)]])
+                except IndexError:  # estimated nrows was too high
+                    return ret
+
+        if i < 0:
+            i += self.nrows
+        if not 0 <= i < self.nrows:
+            raise IndexError('row index out of range')
+
+        pagenum, offset = divmod(i, self.pageRows)
+        if getattr(self._drawing, 'active', False):
+            with self._lock:
+                page = self._pages.get(pagenum)
+            if page is None:
+                self.prefetch(pagenum, first=True)
+                return self.placeholder
+        else:
+            page = self.page(pagenum)
+
+        if pagenum != self._lastPage:
+            self._lastPage = pagenum
+            self.prefetch(pagenum+1, pagenum-1)
+        if offset >= len(page):
+            raise IndexError('row index out of range')
+        return page[offset]
+
+    def _readonly(self, *args, **kwargs):
+        vd.fail('rows of windowed sheets cannot be added, removed or reordered; reload without the window option to load all rows')
+
+    __setitem__ = __delitem__ = insert = append = extend = pop = remove = clear = sort = reverse = _readonly
+
+    def __iter__(self):
+        'Generate all rows in key order, a page at a time.'
+        pagenum = 0
+        while True:
+            page = self.page(pagenum)
+            yield from page
+            if len(page) < self.pageRows:
+                return
+            pagenum += 1
+
+    def pageKey(self, pagenum):
+        '''Return key of the last row before page *pagenum* (None for the first page), skipping from the nearest known page before or after it, or back from the end of the table.  Raise IndexError if the table ends before *pagenum*.
+           Call with _fetchLock held.'''
+        if pagenum == 0:
+            return None
+        if pagenum in self._pageKeys:
+            self._pageKeys.move_to_end(pagenum)
+            return self._pageKeys[pagenum]
+
+        # skipping costs about as much as the number of rows skipped
+        known = max((p for p in self._pageKeys if p < pagenum), default=0)
+        skips = [((pagenum-known)*self.pageRows, lambda: self.skipKey(self.pageKey(known), (pagenum-known)*self.pageRows))]
+        if self.skipKeyBack:
+            later = min((p for p in self._pageKeys if p > pagenum), default=None)
+            if later is not None:
+                skips.append(((later-pagenum)*self.pageRows, lambda: self.skipKeyBack(self._pageKeys[later], (later-pagenum)*self.pageRows)))
+            if self.exact and pagenum*self.pageRows <= self.nrows:
+                nback = self.nrows - pagenum*self.pageRows + 1
+                skips.append((nback, lambda: self.skipKeyBack(None, nback)))
+
+        key = min(skips, key=lambda s: s[0])[1]()
+        if key is None:
+            raise IndexError('page %d beyond end of table' % pagenum)
+        self.setPageKey(pagenum, key)
+        return key
+
+    def setPageKey(self, pagenum, key):
+        'Remember *key* as the key of the last row before page *pagenum*, forgetting the least recently used if there are more than maxPageKeys.'
+        self._pageKeys[pagenum] = key
+        self._pageKeys.move_to_end(pagenum)
+        if len(self._pageKeys) > self.maxPageKeys:
+            self._pageKeys.popitem(last=False)
+
+    def _cached(self, pagenum):
+        'Return rows of page *pagenum* if in memory, or None.'
+        with self._lock:
+            page = self._pages.get(pagenum)
+            if page is not None:
+                self._pages.move_to_end(pagenum)
+            return page
+
+    def _fetch(self, pagenum) -> list:
+        'Return rows of page *pagenum*, fetched from the database if not in memory.  Call with _fetchLock held.'
+        page = self._cached(pagenum)
+        if page is not None:
+            return page
+
+        try:
+            page = self.fetchPage(self.pageKey(pagenum), self.pageRows)
+        except IndexError:
+            page = []
+
+        with self._lock:
+            self._pages[pagenum] = page
+            if len(self._pages) > self.maxPages:
+                self._pages.popitem(last=False)
+        if page:
+            self.setPageKey(pagenum+1, self.keyfunc(page[-1]))
+        return page
+
+    def page(self, pagenum) -> list:
+        'Return rows of page *pagenum*, and correct nrows if the end of the table is found.'
+        start = pagenum*self.pageRows
+        page = self._cached(pagenum)
+        if page is None or (len(page) == self.pageRows and self.nrows <= start + len(page)):
+            with self._fetchLock:
+                page = self._fetch(pagenum)
+                if len(page) == self.pageRows and self.nrows <= start + len(page):  # estimate was too low
+                    self.nrows = start + len(page) + len(self._fetch(pagenum+1))
+        if len(page) < self.pageRows:
+            self.nrows = start + len(page)
+        return page
+
+    def prefetch(self, *pagenums, first=False):
+        'Fetch pages *pagenums* in a background thread, if not already in memory; before other pages waiting to be fetched, if *first*.'
+        with self._qlock:
+            for p in pagenums:
+                if 0 <= p and p*self.pageRows < self.nrows and p not in self._pages:
+                    if p in self._queue:
+                        if not first:
+                            continue
+                        self._queue.remove(p)
+                    if first:
+                        self._queue.appendleft(p)
+                    else:
+                        self._queue.append(p)
+            if self._queue and not self._prefetcher:
+                # a vd thread, so the screen is redrawn until it finishes; but vd.sync does not wait for it
+                self._prefetcher = vd.execAsync(self._prefetchPages, sheet=None)
+                self._prefetcher.noblock = True
+
+    def _prefetchPages(self):
+        while True:
+            with self._qlock:
+                if not self._queue:
+                    self._prefetcher = None
+                    return
+                p = self._queue.popleft()
+            try:
+                self.page(p)
+            except Exception as e:  # page will be fetched again when needed
+                vd.debug(f'prefetch page {p}: {e}')
+
+
+def test_keyset_estimate(vd):
+    import bisect
+    keys = list(range(0, 2000, 2))  # 1000 rows
+
+    def fetchPage(afterkey, n):
+        i = 0 if afterkey is None else bisect.bisect_right(keys, afterkey)
+        return [(k,) for k in keys[i:i+n]]
+
+    def skipKey(afterkey, n):
+        i = 0 if afterkey is None else bisect.bisect_right(keys, afterkey)
+        return keys[i+n-1] if i+n-1 < len(keys) else None
+
+    for estimate in [10, 1000, 5000]:
+        rows = KeysetRows(estimate, fetchPage, skipKey, lambda r: r[0], pageRows=64, maxPages=4)
+        assert list(rows) == [(k,) for k in keys]
+        assert len(rows) == 1000
+        assert rows[999] == (1998,)
+
+    rows = KeysetRows(5000, fetchPage, skipKey, lambda r: r[0], pageRows=64, maxPages=4)
+    assert rows[900:1100] == [(k,) for k in keys[900:]]
+    assert len(rows) == 1000
+
+    rows = KeysetRows(100, fetchPage, skipKey, lambda r: r[0], pageRows=64, maxPages=4)
+    assert rows[50:] == [(k,) for k in keys[50:]]  # slice continues as nrows grows
+    assert len(rows) == 1000
+
+    rows = KeysetRows(10, fetchPage, skipKey, lambda r: r[0], pageRows=64, maxPages=4)
+    assert rows[9] == (18,)
+    assert len(rows) == 128  # grows past a low estimate a page at a time
+
+    rows = KeysetRows(1000, fetchPage, skipKey, lambda r: r[0], pageRows=10, maxPages=4)
+    rows.maxPageKeys = 5
+    assert [rows[i] for i in range(0, 1000, 10)] == [(k,) for k in keys[::10]]
+    assert len(rows._pageKeys) == 5
+    assert rows[55] == (110,) and rows[995] == (1990,)  # forgotten pages found again by skipping from a known page
+
+    import pytest
+    from visidata import ExpectedException
+    with pytest.raises(ExpectedException):
+        rows.append((2000,))
+
+
+def test_keyset_skip_back(vd):
+    import bisect
+    import time
+    keys = list(range(0, 2000, 2))  # 1000 rows
+    skipped = []  # number of rows skipped by each query
+
+    def fetchPage(afterkey, n):
+        i = 0 if afterkey is None else bisect.bisect_right(keys, afterkey)
+        return [(k,) for k in keys[i:i+n]]
+
+    def skipKey(afterkey, n):
+        skipped.append(n)
+        i = 0 if afterkey is None else bisect.bisect_right(keys, afterkey)
+        return keys[i+n-1] if i+n-1 < len(keys) else None
+
+    def skipKeyBack(beforekey, n):
+        skipped.append(n)
+        i = len(keys) if beforekey is None else bisect.bisect_left(keys, beforekey)
+        return keys[i-n] if i-n >= 0 else None
+
+    def maxSkipped(rows, i):
+        'Return row *i* of *rows*, and the most rows skipped to find it and prefetch its neighbors.'
+        skipped.clear()
+        r = rows[i]
+        while rows._prefetcher:
+            time.sleep(0.01)
+        return r, max(skipped, default=0)
+
+    rows = KeysetRows(1000, fetchPage, skipKey, lambda r: r[0], pageRows=10, maxPages=4, skipKeyBack=skipKeyBack, exact=True)
+    assert maxSkipped(rows, 995) == ((1990,), 11)  # back from the end
+    assert maxSkipped(rows, 905) == ((1810,), 80)  # back from the known page after it
+    assert maxSkipped(rows, 25) == ((50,), 20)  # forward from the start
+    assert list(rows) == [(k,) for k in keys]
+
+    # drawing does not wait for pages to be fetched
+    rows = KeysetRows(1000, fetchPage, skipKey, lambda r: r[0], pageRows=10, maxPages=4, skipKeyBack=skipKeyBack, exact=True, placeholder=())
+    with rows.drawing():
+        assert rows[500:502] == [(), ()]
+        for i in range(100):
+            if rows[500] != ():
+                break
+            time.sleep(0.01)
+        assert rows[500:502] == [(1000,), (1002,)]
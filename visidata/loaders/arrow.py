@@ -1,6 +1,8 @@
+import ast
+import re
 from collections import defaultdict
 
-from visidata import Sheet, VisiData, TypedWrapper, anytype, date, vlen, Column, vd
+from visidata import Sheet, VisiData, TypedWrapper, anytype, date, vlen, Column, Progress, asyncthread, vd
 
 
 
@@ -56,28 +58,236 @@ def arrow_to_vdtype(t):
     }
     return arrow_to_vd_typemap.get(t.id, anytype)
 
+## filter pushdown: translate simple selections into pyarrow.dataset expressions.
+# Each arrowFilter function returns (expression, list of field names it uses),
+# or None if the selection cannot be translated exactly.
+
+def _arrowField(col):
+    'Return name of the arrow field with the values of *col*, or None if its values are not exactly the values in that field.'
+    arrowtype = getattr(col, 'arrowType', None)
+    if arrowtype is None or col.type is not arrow_to_vdtype(arrowtype):
+        return None
+    return col.arrowField
+
+
+def _isArrowString(t):
+    pa = vd.importExternal('pyarrow')
+    return pa.types.is_string(t) or pa.types.is_large_string(t)
+
+
+def _isArrowNumeric(t):
+    pa = vd.importExternal('pyarrow')
+    return pa.types.is_integer(t) or pa.types.is_floating(t)
+
+
+def _arrowCompare(col, op:str, v):
+    'Return dataset expression for ``typedval <op> v`` for each value of *col*, or None.  Null values are selected by ``!=``, ``<``, and ``<=``, as null TypedWrappers are least.'
+    ds = vd.importExternal('pyarrow.dataset', 'pyarrow')
+    fieldname = _arrowField(col)
+    if fieldname is None or type(v) is bool:
+        return None
+    if isinstance(v, str):
+        if not _isArrowString(col.arrowType):
+            return None
+    elif isinstance(v, (int, float)):
+        if not _isArrowNumeric(col.arrowType):
+            return None
+    else:
+        return None
+
+    f = ds.field(fieldname)
+    if op == '==': return f.is_valid() & (f == v)
+    if op == '!=': return f.is_null() | (f != v)
+    if op == '<':  return f.is_null() | (f < v)
+    if op == '<=': return f.is_null() | (f <= v)
+    if op == '>':  return f.is_valid() & (f > v)
+    if op == '>=': return f.is_valid() & (f >= v)
+
+
+@VisiData.api
+def arrowFilterEqual(vd, col, v, display=False):
+    'Return filter to select rows with typed value (or display value, if *display*) of *col* equal to *v*, or None.'
+    if display:
+        # display values are the values themselves only for strings
+        if _arrowField(col) is None or not _isArrowString(col.arrowType) or col.fmtstr or not isinstance(v, str):
+            return None
+        if v == '':
+            ds = vd.importExternal('pyarrow.dataset', 'pyarrow')
+            f = ds.field(col.arrowField)
+            return f.is_null() | (f == ''), [col.arrowField]
+    e = _arrowCompare(col, '==', v)
+    return None if e is None else (e, [col.arrowField])
+
+
+# regex syntax that means something else (or nothing) in RE2: escapes (\d \w \b are ASCII-only in RE2), (? groups (lookarounds, backrefs, inline flags),
+# [: (POSIX classes in RE2), $ (which in Python also matches before a final newline), and {,n} (a literal in RE2)
+_re2Differs = re.compile(r'\\|\(\?|\[:|\$|\{,')
+
+@VisiData.api
+def arrowFilterRegex(vd, col, regex:str, flags:str=''):
+    '''Return filter to select rows with display value of *col* matching *regex*, or None.
+       Only regexes that match the same strings in RE2 (used by pyarrow) as in Python are pushed down.'''
+    pc = vd.importExternal('pyarrow.compute', 'pyarrow')
+    ds = vd.importExternal('pyarrow.dataset', 'pyarrow')
+    if _arrowField(col) is None or not _isArrowString(col.arrowType) or col.fmtstr:
+        return None
+    if set(flags.upper()) - set('I'):
+        return None
+    if _re2Differs.search(regex):
+        vd.debug('no pushdown for regex: may differ in RE2')
+        return None
+    ignore_case = 'I' in flags.upper()
+    try:
+        if re.search(regex, '', re.IGNORECASE if ignore_case else 0):  # would also match nulls, displayed as ''
+            return None
+        pc.match_substring_regex(vd.importExternal('pyarrow').array([''], type='string'), pattern=regex)  # fails if not valid in RE2
+        f = ds.field(col.arrowField)
+        return f.is_valid() & pc.match_substring_regex(f, pattern=regex, ignore_case=ignore_case), [col.arrowField]
+    except Exception as e:  # not valid in Python or in RE2
+        vd.debug(f'no pushdown for regex: {e}')
+        return None
+
+
+_astops = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+_astflipped = {'==': '==', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+@VisiData.api
+def arrowFilterExpr(vd, sheet, expr:str):
+    '''Return filter to select rows for which Python *expr* is true, or None.
+       *expr* must only compare column names with constants, combined with ``and``, ``or``, and ``not``.'''
+    fieldnames = []
+
+    def _convert(node):
+        if isinstance(node, ast.BoolOp):
+            exprs = [_convert(v) for v in node.values]
+            ret = exprs[0]
+            for e in exprs[1:]:
+                ret = (ret & e) if isinstance(node.op, ast.And) else (ret | e)
+            return ret
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return ~_convert(node.operand)
+        if isinstance(node, ast.Compare):
+            ret = None
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                e = _convertCompare(left, _astops.get(type(op)), right)
+                ret = e if ret is None else (ret & e)
+                left = right
+            return ret
+        raise ValueError('not a comparison')
+
+    def _convertCompare(left, op, right):
+        if op is None:
+            raise ValueError('unsupported comparison')
+        if isinstance(right, ast.Name) and isinstance(left, ast.Constant):
+            left, right, op = right, left, _astflipped[op]
+        if not isinstance(left, ast.Name) or not isinstance(right, ast.Constant):
+            raise ValueError('not a column compared to a constant')
+        cols = sheet.availColsByName.get(left.id, [])
+        if len(cols) != 1:
+            raise ValueError('not exactly one column named ' + left.id)
+        e = _arrowCompare(cols[0], op, right.value)
+        if e is None:
+            raise ValueError('cannot compare ' + left.id)
+        fieldnames.append(cols[0].arrowField)
+        return e
+
+    try:
+        return _convert(ast.parse(expr.strip(), mode='eval').body), sorted(set(fieldnames))
+    except Exception as e:
+        vd.debug(f'no pushdown for expr: {e}')
+        return None
+
+
+def arrow_filter_rownums(tbl, expr, start=0) -> list:
+    'Return row numbers (counting from *start*) of rows in pyarrow table *tbl* matching dataset *expr*.'
+    pa = vd.importExternal('pyarrow')
+    ds = vd.importExternal('pyarrow.dataset', 'pyarrow')
+    tbl = tbl.append_column('__rownum__', pa.array(range(start, start+tbl.num_rows), type=pa.int64()))
+    return ds.dataset(tbl).to_table(columns=['__rownum__'], filter=expr).column(0).to_pylist()
+
+
+@Sheet.api
+@asyncthread
+def selectFiltered(sheet, filt, gatherRows, unselect=False):
+    '''Select (or unselect) rows matching *filt* from an arrowFilter function, as found by ``sheet.filteredRows``.  Async.
+       If *filt* is None or cannot be pushed down, select the rows from ``gatherRows()`` instead.'''
+    rows = None
+    if filt is not None:
+        try:
+            rows = sheet.filteredRows(*filt)
+        except Exception as e:
+            vd.debug(f'no pushdown: {e}')
+    if rows is None:
+        rows = list(gatherRows())
+    if unselect:
+        vd.sync(sheet.unselect(rows, progress=False))
+    else:
+        vd.sync(sheet.select(rows, progress=False))
+
+
+@Sheet.api
+def selectWhere(sheet, filt, func, unselect=False):
+    '''Select (or unselect) rows matching *filt* from an arrowFilter function, as found by ``sheet.filteredRows``.  Async.
+       If *filt* is None, select rows for which ``func(row)`` is true, as usual.'''
+    return sheet.selectFiltered(filt, lambda: sheet.gatherBy(func), unselect=unselect)
+
+
+@Sheet.api
+def selectInputRegexWhere(sheet, action:str, unselect=False):
+    'Select (or unselect) rows with values in the current column matching an input regex, with filter pushdown if possible.  Async.'
+    r = vd.inputMultiple(regex=dict(prompt=f"{action} regex: ", type="regex", defaultLast=True, help=vd.help_regex),
+                         flags=dict(prompt="regex flags: ", type="regex_flags", value=sheet.options.regex_flags, help=vd.help_regex_flags))
+    filt = vd.arrowFilterRegex(sheet.cursorCol, r['regex'], r['flags'])
+    col = sheet.cursorCol
+    def _gatherRows():
+        return [sheet.rows[i] for i in vd.searchRegex(sheet, regex=r['regex'], regex_flags=r['flags'], columns=col)]
+    return sheet.selectFiltered(filt, _gatherRows, unselect=unselect)
+
+
+def addFilterCommands(cls):
+    'Add selection commands to sheet type *cls*, which push filters down to ``cls.filteredRows(expr, fieldnames)`` when possible.'
+    cls.addCommand(',', 'select-equal-cell', 'selectWhere(arrowFilterEqual(cursorCol, cursorDisplay, display=True), lambda r,c=cursorCol,v=cursorDisplay: c.getDisplayValue(r) == v)', 'select rows matching current cell in current column')
+    cls.addCommand('z,', 'select-exact-cell', 'selectWhere(arrowFilterEqual(cursorCol, cursorTypedValue), lambda r,c=cursorCol,v=cursorTypedValue: c.getTypedValue(r) == v)', 'select rows matching current cell in current column')
+    cls.addCommand('|', 'select-col-regex', 'selectInputRegexWhere("select")', 'select rows matching regex in current column')
+    cls.addCommand('\\', 'unselect-col-regex', 'selectInputRegexWhere("unselect", unselect=True)', 'unselect rows matching regex in current column')
+    cls.addCommand('z|', 'select-expr', 'expr=inputExpr("select by expr: "); selectWhere(arrowFilterExpr(sheet, expr), lambda r, sheet=sheet, expr=expr, curcol=cursorCol: sheet.evalExpr(expr, r, curcol=curcol))', 'select rows matching Python expression in any visible column')
+    cls.addCommand('z\\', 'unselect-expr', 'expr=inputExpr("unselect by expr: "); selectWhere(arrowFilterExpr(sheet, expr), lambda r, sheet=sheet, expr=expr, curcol=cursorCol: sheet.evalExpr(expr, r, curcol=curcol), unselect=True)', 'unselect rows matching Python expression in any visible column')
+
+
 class ArrowSheet(Sheet):
+    # rowdef: [rownum]
     def iterload(self):
         pa = vd.importExternal('pyarrow')
 
+        # memory-mapped, so that only the columns used are read
         try:
-            with pa.OSFile(str(self.source), 'rb') as fp:
-                self.coldata = pa.ipc.open_file(fp).read_all()
+            self.coldata = pa.ipc.open_file(pa.memory_map(str(self.source), 'r')).read_all()
         except pa.lib.ArrowInvalid as e:
             with pa.OSFile(str(self.source), 'rb') as fp:
                 self.coldata = pa.ipc.open_stream(fp).read_all()
 
         self.columns = []
         for colnum, col in enumerate(self.coldata):
-            coltype = arrow_to_vdtype(self.coldata.schema.types[colnum])
+            arrowtype = self.coldata.schema.types[colnum]
             colname = self.coldata.schema.names[colnum]
 
-            self.addColumn(Column(colname, type=coltype, expr=colnum,
+            self.addColumn(Column(colname, type=arrow_to_vdtype(arrowtype), expr=colnum,
+                                  arrowType=arrowtype, arrowField=colname,
                                   getter=lambda c,r: c.sheet.coldata[c.expr][r[0]].as_py()))
 
         for rownum in range(max(len(c) for c in self.coldata)):
             yield [rownum]
 
+    def filteredRows(self, expr, fieldnames):
+        'Return rows matching dataset *expr* on *fieldnames*.'
+        with Progress(gerund='filtering'):
+            matches = set(arrow_filter_rownums(self.coldata.select(fieldnames), expr))
+            return [r for r in self.rows if r[0] in matches]
+
+
+addFilterCommands(ArrowSheet)
+
 
 @VisiData.api
 def save_arrow(vd, p, sheet, streaming=False):
@@ -124,3 +334,80 @@ def save_arrow(vd, p, sheet, streaming=False):
 @VisiData.api
 def save_arrows(vd, p, sheet):
     return vd.save_arrow(p, sheet, streaming=True)
+
+
+def test_arrow_filter_pushdown(vd):
+    'Each pushed-down selection command selects the same rows as the generic command on a plain Sheet.'
+    import os
+    import tempfile
+    from visidata import Path, ItemColumn
+    from visidata.loaders.parquet import ParquetSheet
+    import pytest
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    data = {
+        's': ['a', 'b', None, 'ab', 'b', 'c', '', 'A', 'é\n'],
+        'n': [1, 2, 3, 2, None, 5, 2, 0, 7],
+        'f': [1.5, 2.0, None, 2.5, 3.0, 0.5, 2.0, 1.0, 4.0],
+    }
+    tests = [  # (longname, column, cursor row, input, select all rows first)
+        ('select-equal-cell', 's', 1, None, False),
+        ('select-equal-cell', 's', 6, None, False),
+        ('select-exact-cell', 'n', 1, None, False),
+        ('select-exact-cell', 'f', 1, None, False),
+        ('select-col-regex', 's', 0, dict(regex='a', flags=''), False),
+        ('select-col-regex', 's', 0, dict(regex='a', flags='I'), False),
+        ('unselect-col-regex', 's', 0, dict(regex='^b', flags=''), True),
+        ('select-expr', 's', 0, 'n >= 2 and s != "b"', False),
+        ('select-expr', 's', 0, 'not (f < 2 or s == "c")', False),
+        ('select-expr', 's', 0, 's != "b" or n < 2', False),
+        ('select-expr', 's', 0, '2 > n or s <= "a"', False),
+        ('select-expr', 's', 0, 'f >= 2 and not n <= 1', False),
+        ('unselect-expr', 's', 0, 'f > 1.5', True),
+    ]
+    unpushed = [  # regexes which would match differently in RE2
+        ('select-col-regex', 's', 0, dict(regex=r'\w', flags=''), False),
+        ('select-col-regex', 's', 0, dict(regex='é$', flags=''), False),
+        ('select-col-regex', 's', 0, dict(regex='a{,1}b', flags=''), False),
+        ('select-col-regex', 's', 0, dict(regex='[:b]', flags=''), False),
+        ('select-col-regex', 's', 0, dict(regex='(?=a)', flags=''), False),
+    ]
+
+    def selected(vs, longname, colname, rowidx, input, selectAll):
+        vd.push(vs)  # commands evaluate `sheet` as the active sheet
+        vs.clearSelected()
+        if selectAll:
+            vd.sync(vs.select(vs.rows, progress=False))
+        vs.cursorVisibleColIndex = [c.name for c in vs.visibleCols].index(colname)
+        vs.cursorRowIndex = rowidx
+        if input is not None:
+            vd.injectInput(input)
+        vs.execCommand(longname)
+        vd.sync()
+        return [i for i, r in enumerate(vs.rows) if vs.isSelected(r)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tbl = pa.table(data)
+        pq.write_table(tbl, os.path.join(tmpdir, 't.parquet'), row_group_size=3)
+        with pa.ipc.new_file(os.path.join(tmpdir, 't.arrow'), tbl.schema) as writer:
+            writer.write_table(tbl)
+
+        for vs in [ParquetSheet('t', source=Path(os.path.join(tmpdir, 't.parquet'))),
+                   ArrowSheet('t', source=Path(os.path.join(tmpdir, 't.arrow')))]:
+            vd.sync(vs.ensureLoaded())
+            generic = Sheet('generic', rows=[list(r) for r in zip(*data.values())],
+                            columns=[ItemColumn(c.name, i, type=c.type) for i, c in enumerate(vs.columns)])
+
+            npushed = 0
+            filteredRows = vs.filteredRows
+            def _filteredRows(*args):
+                nonlocal npushed
+                rows = filteredRows(*args)
+                npushed += 1
+                return rows
+            vs.filteredRows = _filteredRows
+
+            for t in tests+unpushed:
+                assert selected(vs, *t) == selected(generic, *t), (type(vs).__name__, t)
+            assert npushed == len(tests), npushed  # every command was pushed down, except the unpushed regexes
@@ -1,5 +1,9 @@
+import io
+import os
+import codecs
+
 from visidata import vd, VisiData, SequenceSheet, options, stacktrace
-from visidata import TypedExceptionWrapper, Progress
+from visidata import TypedExceptionWrapper, Progress, Path, ascii_compatible_encodings
 
 vd.option('csv_dialect', 'excel', 'dialect passed to csv.reader', replay=True)
 vd.option('csv_delimiter', ',', 'delimiter passed to csv.reader', replay=True)
@@ -10,6 +14,8 @@ vd.option('csv_skipinitialspace', True, 'skipinitialspace passed to csv.reader',
 vd.option('csv_escapechar', None, 'escapechar passed to csv.reader', replay=True)
 vd.option('csv_lineterminator', '\r\n', 'lineterminator passed to csv.writer', replay=True)
 vd.option('safety_first', False, 'sanitize input/output to handle edge cases, with a performance cost', replay=True)
+vd.option('load_workers', 0, 'number of worker processes for parsing large csv files in parallel (0 or 1 to parse serially)', replay=True)
+vd.option('load_chunk_size', 16*1024*1024, 'size in bytes of each chunk of a csv file parsed in parallel', replay=True)
 
 
 @VisiData.api
@@ -38,6 +44,73 @@ def removeNulls(fp):
     for line in fp:
         yield line.replace('\0', '')
 
+def _iter_csv_chunks(path, chunksize, quotechar:bytes):
+    '''Generate (start, end) byte offsets which divide file at *path* into chunks of about *chunksize*.
+    Each chunk ends just after a newline which is outside of any quoted field, as determined by the parity of the number of *quotechar* before it.'''
+    size = os.path.getsize(path)
+    nquotes = 0  # number of quotechar in file before pos
+    start = pos = 0
+    with open(path, 'rb') as fp:
+        while start+chunksize < size:
+            fp.seek(pos)
+            buf = fp.read(start+chunksize-pos)
+            if quotechar:
+                nquotes += buf.count(quotechar)
+            pos += len(buf)
+
+            while True:  # find next newline with an even number of quotes before it
+                buf = fp.read(65536)
+                if not buf:
+                    break
+                i = buf.find(b'\n')
+                while i >= 0 and quotechar and (nquotes + buf.count(quotechar, 0, i)) % 2:
+                    i = buf.find(b'\n', i+1)
+                if i >= 0:
+                    if quotechar:
+                        nquotes += buf.count(quotechar, 0, i+1)
+                    pos += i+1
+                    break
+                if quotechar:
+                    nquotes += buf.count(quotechar)
+                pos += len(buf)
+
+            if pos >= size:
+                break
+            yield start, pos
+            start = pos
+
+    yield start, size
+
+
+def _parse_csv_chunk(path, start, end, encoding, encoding_errors, csvopts):
+    '''Return (rows, complete) for rows parsed from bytes [*start*:*end*] of file at *path*.  Runs in a worker process.
+    *complete* is False if the last record ran past *end*, so the chunk boundary was not at the end of a record (like after a quotechar inside an unquoted field).'''
+    import csv
+    csv.field_size_limit(2**31-1)  #288 Windows has max 32-bit
+
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        text = fp.read(end-start).decode(encoding, encoding_errors)
+
+    eof = False
+    def _lines():
+        nonlocal eof
+        yield from io.StringIO(text, newline='')
+        eof = True  # reader asked for more lines
+
+    rows = []
+    rdr = csv.reader(_lines(), **csvopts)
+    while True:
+        try:
+            rows.append(next(rdr))
+        except csv.Error as e:
+            rows.append(e)
+        except StopIteration:
+            return rows, True
+        if eof:
+            return [], False
+
+
 class CsvSheet(SequenceSheet):
     _rowtype = list  # rowdef: list of values
 
@@ -46,20 +119,106 @@ class CsvSheet(SequenceSheet):
         import csv
         csv.field_size_limit(2**31-1)  #288 Windows has max 32-bit
 
+        if self.options.load_workers > 1 and self.canParseParallel():
+            yield from self.iterload_parallel()
+            return
+
         with self.open_text_source(newline='') as fp:
             if options.safety_first:
                 rdr = csv.reader(removeNulls(fp), **options.getall('csv_'))
             else:
                 rdr = csv.reader(fp, **options.getall('csv_'))
 
-            while True:
-                try:
-                    yield next(rdr)
-                except csv.Error as e:
-                    e.stacktrace=stacktrace()
-                    yield [TypedExceptionWrapper(None, exception=e)]
-                except StopIteration:
-                    return
+            yield from self.iterCsvRows(rdr)
+
+    def iterCsvRows(self, rdr):
+        import csv
+        while True:
+            try:
+                yield next(rdr)
+            except csv.Error as e:
+                e.stacktrace=stacktrace()
+                yield [TypedExceptionWrapper(None, exception=e)]
+            except StopIteration:
+                return
+
+    def canParseParallel(self):
+        'Return True if the source file can be split into chunks at record boundaries without parsing it.'
+        import csv
+        p = self.source
+        if not isinstance(p, Path) or not p.is_local() or not p.is_file() or p.compression:
+            return False
+        if self.options.safety_first or self.options.regex_skip:
+            return False
+        if os.path.getsize(p) <= self.options.load_chunk_size:
+            return False
+        if codecs.lookup(self.options.encoding).name not in ascii_compatible_encodings:
+            return False
+        csvopts = self.options.getall('csv_')
+        if csvopts['quoting'] != csv.QUOTE_NONE and (csvopts['escapechar'] or not csvopts['doublequote']):
+            return False  # escaped quotes would throw off the quote parity
+        return True
+
+    def iterload_parallel(self):
+        '''Parse chunks of the source file in parallel worker processes, yielding rows in order.
+           If a chunk boundary turns out not to be at the end of a record, parse serially from the start of that chunk.'''
+        import csv
+
+        csvopts = self.options.getall('csv_')
+        enc = self.options.encoding
+        nobom = 'utf-8' if codecs.lookup(enc).name == 'utf-8-sig' else enc  # only the first chunk can start with a BOM
+        nworkers = self.options.load_workers
+        quotechar = b'' if csvopts['quoting'] == csv.QUOTE_NONE else (csvopts['quotechar'] or '').encode(nobom)
+        path = os.path.abspath(self.source)
+
+        chunks = _iter_csv_chunks(path, self.options.load_chunk_size, quotechar)
+        serialStart = None  # byte offset to parse serially from
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor = vd.sessionPool('load', nworkers)
+        with Progress(gerund='parsing', total=os.path.getsize(path)) as prog:
+            pending = []  # (start, end, future) in order of chunks
+
+            def _parsedChunks():
+                for start, end in chunks:
+                    pending.append((start, end, executor.submit(_parse_csv_chunk, path, start, end, enc if start == 0 else nobom, self.options.encoding_errors, csvopts)))
+                    if len(pending) >= nworkers*2:
+                        yield pending.pop(0)
+                while pending:
+                    yield pending.pop(0)
+
+            try:
+                for start, end, fut in _parsedChunks():
+                    if not (yield from self._iterParsedChunk(prog, start, end, fut)):
+                        serialStart = start
+                        break
+            except BrokenProcessPool:  # a worker died; start a new pool for the next load
+                vd.brokenPool('load', executor)
+                raise
+            finally:
+                for start, end, fut in pending:
+                    fut.cancel()
+
+        if serialStart is not None:
+            vd.warning('csv chunk split a record; parsing rest of file serially')
+            with open(path, 'rb') as bfp:
+                bfp.seek(serialStart)
+                fp = io.TextIOWrapper(bfp, encoding=enc if serialStart == 0 else nobom, errors=self.options.encoding_errors, newline='')
+                yield from self.iterCsvRows(csv.reader(fp, **csvopts))
+
+    def _iterParsedChunk(self, prog, start, end, fut):
+        'Yield rows parsed from chunk [*start*:*end*].  Return False (without yielding any) if the chunk did not end at the end of a record.'
+        rows, complete = fut.result()
+        if not complete:
+            return False
+        for row in rows:
+            if isinstance(row, Exception):
+                row.stacktrace = [str(row)]
+                yield [TypedExceptionWrapper(None, exception=row)]
+            else:
+                yield row
+        prog.addProgress(end-start)
+        return complete
 
 
 @VisiData.api
@@ -74,11 +233,57 @@ def save_csv(vd, p, sheet):
         if ''.join(colnames):
             cw.writerow(colnames)
 
-        with Progress(gerund='saving', total=sheet.nRows) as prog:
-            for dispvals in sheet.iterdispvals(format=True):
-                cw.writerow(dispvals.values())
-                prog.addProgress(1)
+        for chunk in sheet.iterdispvalChunks(format=True):  # progress is counted by iterdispvalChunks
+            cw.writerows(chunk)
 
 vd.addGlobals({
     'CsvSheet': CsvSheet
 })
+
+
+def test_csv_chunks(vd):
+    import csv
+    import tempfile
+
+    rows = [[str(i), 'a "quoted"\nvalue,' * (i%3), 'x'] for i in range(200)]
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', newline='', delete=False) as fp:
+        csv.writer(fp).writerows(rows)
+
+    try:
+        chunks = list(_iter_csv_chunks(fp.name, 100, b'"'))
+        assert len(chunks) > 10
+        assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+        results = [_parse_csv_chunk(fp.name, start, end, 'utf-8', 'strict', {}) for start, end in chunks]
+        assert all(complete for rows, complete in results)
+        assert [r for rows, complete in results for r in rows] == rows
+    finally:
+        os.unlink(fp.name)
+
+
+def test_csv_parallel_stray_quote(vd):
+    import tempfile
+
+    # a quote inside an unquoted field is literal, but flips the quote parity used to find chunk boundaries
+    lines = ['%d,5" screen,x\n' % i if i == 3 else '%d,"multi\nline",y\n' % i for i in range(300)]
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', newline='', delete=False) as fp:
+        fp.write('a,b,c\n' + ''.join(lines))
+
+    def load(nworkers):
+        vd.options.load_workers = nworkers
+        vs = CsvSheet('stray', source=Path(fp.name))
+        vs.reload()
+        vd.sync()
+        return [list(r) for r in vs.rows]
+
+    try:
+        vd.options.load_chunk_size = 200
+        serial = load(0)
+        assert len(serial) == 300 and serial[3] == ['3', '5" screen', 'x']
+        assert load(2) == serial
+        executor = vd.sessionPool('load', 2)
+        assert load(2) == serial
+        assert vd.sessionPool('load', 2) is executor  # workers are kept for the next load
+    finally:
+        vd.options.load_workers = 0
+        vd.options.load_chunk_size = 16*1024*1024
+        os.unlink(fp.name)
@@ -105,8 +105,7 @@ def save_fixed(vd, p, *vsheets):
             fp.write('\n')
 
             # rows
+            fmtstrs = ['{0:%s%s.%s} ' % ('>' if vd.isNumeric(col) else '<', widths[col], widths[col]) for col in sheet.visibleCols]
             with Progress(gerund='saving'):
-                for dispvals in sheet.iterdispvals(format=True):
-                    for col, val in dispvals.items():
-                        fp.write(('{0:%s%s.%s} ' % ('>' if vd.isNumeric(col) else '<', widths[col], widths[col])).format(val))
-                    fp.write('\n')
+                for chunk in sheet.iterdispvalChunks(format=True):
+                    fp.write(''.join([''.join([fmt.format(val) for fmt, val in zip(fmtstrs, dispvals)]) + '\n' for dispvals in chunk]))
@@ -1,4 +1,5 @@
 import json
+import itertools
 from collections import Counter
 
 from visidata import vd, date, anytype, VisiData, PyobjSheet, AttrDict, stacktrace, TypedExceptionWrapper, AlwaysDict, ItemColumn, wrapply, TypedWrapper, Progress, Sheet
@@ -105,9 +106,8 @@ class _vjsonEncoder(json.JSONEncoder):
         return str(obj)
 
 
-@VisiData.api
-def get_json_value(vd, col, row):
-    o = wrapply(col.getTypedValue, row)
+def _jsonvalue(col, row, o):
+    'Return json value for *row* in *col*, given its typed value *o*.'
     if isinstance(o, TypedExceptionWrapper):
         o = col.sheet.options.safe_error or str(o.exception)
     elif isinstance(o, TypedWrapper):
@@ -117,6 +117,19 @@ def get_json_value(vd, col, row):
     return o
 
 
+@VisiData.api
+def get_json_value(vd, col, row):
+    return _jsonvalue(col, row, wrapply(col.getTypedValue, row))
+
+
+@VisiData.api
+def get_json_values(vd, col, rows) -> list:
+    'Return list of json values of *col* for each of *rows*, as from get_json_value, with the typed values computed together.'
+    if VisiData.get_json_value is not get_json_value:  # overridden by a plugin or user
+        return [vd.get_json_value(col, row) for row in rows]
+    return [_jsonvalue(col, row, o) for row, o in zip(rows, col.getTypedValues(rows))]
+
+
 def _rowdict(cols, row, keep_nulls=False):
     ret = {}
     for col in cols:
@@ -175,10 +188,20 @@ def write_jsonl(vs, fp):
         dupnames = find_duplicates([c.name for c in vcols])
         for name in dupnames:
             vd.warning('json cannot save column with duplicated name: ' + name)
+        names = [c.name for c in vcols]
+        keep_nulls = True  # for first row only
+        it = vs.iterrows()
         with Progress(gerund='saving'):
-            for i, row in enumerate(vs.iterrows()):
-                rowdict = _rowdict(vcols, row, keep_nulls=(i==0))
-                fp.write(jsonenc.encode(rowdict) + '\n')
+            while True:
+                rows = list(itertools.islice(it, vs.saveChunkRows))
+                if not rows:
+                    break
+                lines = []
+                for vals in zip(*[vd.get_json_values(col, rows) for col in vcols]) if vcols else [()]*len(rows):
+                    rowdict = {k: v for k, v in zip(names, vals) if keep_nulls or v is not None}
+                    lines.append(jsonenc.encode(rowdict) + '\n')
+                    keep_nulls = False
+                fp.write(''.join(lines))
 
         if len(vs) == 0:
             vd.warning(
@@ -215,3 +238,20 @@ vd.addGlobals({
     'JsonSheet': JsonSheet,
     'JsonLinesSheet': JsonSheet,
 })
+
+
+def test_jsonl_get_json_value(vd):
+    import io
+    vs = Sheet('nums', columns=[ItemColumn('n', 0, type=int)], rows=[[i] for i in range(3)] + [[None]])
+    fp = io.StringIO()
+    vs.write_jsonl(fp)
+    assert fp.getvalue() == '{"n": 0}\n{"n": 1}\n{"n": 2}\n{}\n'
+
+    get_json_value = VisiData.get_json_value
+    VisiData.get_json_value = lambda vd, col, row: str(get_json_value(vd, col, row))  # as overridden by a plugin
+    try:
+        fp = io.StringIO()
+        vs.write_jsonl(fp)
+        assert fp.getvalue() == '{"n": "0"}\n{"n": "1"}\n{"n": "2"}\n{"n": "None"}\n'
+    finally:
+        VisiData.get_json_value = get_json_value
@@ -48,18 +48,28 @@ def write_md(p, *vsheets, md_style='orgmode'):
             if md_style == 'orgmode':
                 fp.write('|' + '|'.join(markdown_colhdr(col) for col in vs.visibleCols if not col.name.endswith('_href')) + '|\n')
 
+            # (index of column, index of its _href column or None, width) for each column written
+            vcols = vs.visibleCols
+            colidx = {col: i for i, col in enumerate(vcols)}
+            outcols = []
+            for i, col in enumerate(vcols):
+                if col.name.endswith('_href'):
+                    continue
+                linkcol = vs.colsByName.get(col.name + '_href')
+                outcols.append((i, colidx.get(linkcol), col.width or options.default_width))
+
             with Progress(gerund='saving'):
-                for dispvals in vs.iterdispvals(format=True):
-                    vals = []
-                    for col, val in dispvals.items():
-                        if col.name.endswith('_href'):
-                            continue
-                        val = markdown_escape(val, md_style)
-                        linkcol = vs.colsByName.get(col.name + '_href')
-                        if linkcol:
-                            val = markdown_link(val, dispvals.get(linkcol))
-                        vals.append('%-*s' % (col.width or options.default_width, val))
-                    fp.write('|' + '|'.join(vals) + '|\n')
+                for chunk in vs.iterdispvalChunks(format=True):
+                    lines = []
+                    for dispvals in chunk:
+                        vals = []
+                        for i, linki, w in outcols:
+                            val = markdown_escape(dispvals[i], md_style)
+                            if linki is not None:
+                                val = markdown_link(val, dispvals[linki])
+                            vals.append('%-*s' % (w, val))
+                        lines.append('|' + '|'.join(vals) + '|\n')
+                    fp.write(''.join(lines))
 
             fp.write('\n')
 
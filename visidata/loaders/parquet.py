@@ -1,5 +1,9 @@
-from visidata import Sheet, VisiData, TypedWrapper, anytype, date, vlen, Column, vd
-from collections import defaultdict
+import bisect
+import threading
+from collections import defaultdict, OrderedDict
+
+from visidata import Sheet, VisiData, TypedWrapper, anytype, date, vlen, Column, Progress, RowBitmap, wrapply, vd
+from visidata.loaders.arrow import arrow_to_vdtype, arrow_filter_rownums, addFilterCommands
 
 
 @VisiData.api
@@ -9,36 +13,190 @@ def open_parquet(vd, p):
 
 class ParquetColumn(Column):
     def calcValue(self, row):
-        val = self.source[row["__rownum__"]]
-        if val.type == 'large_string':
+        rownum = row-1
+        if self.large_string:
+            val = self.sheet.arrowValues(self, rownum)[self.sheet.groupOffset(rownum)]
             return memoryview(val.as_buffer())[:2**20].tobytes().decode('utf-8')
-        else:
-            return val.as_py()
+        return self.sheet.pyValues(self, rownum)[rownum % self.sheet.blockRows]
+
+    def getTypedValues(self, rows, prog=None) -> list:
+        'Return list of typed values for each of *rows*, looking up the block of Python values only when the block changes.'
+        if self.large_string or self._cachedValues is not None or self.defer or type(self).getValue is not Column.getValue:
+            return super().getTypedValues(rows, prog)
+
+        ret = []
+        sheet = self.sheet
+        blockRows = sheet.blockRows
+        typefunc = self.type
+        curblock = None
+        for r in rows:
+            try:
+                rownum = r-1
+                blocknum = rownum // blockRows
+                if blocknum != curblock:
+                    vals = sheet.pyValues(self, rownum)
+                    curblock = blocknum
+                v = vals[rownum - blocknum*blockRows]
+                v = wrapply(typefunc, v) if v is None else typefunc(v)
+            except Exception:
+                v = self.getTypedValue(r)  # calculate again to wrap the exception
+            ret.append(v)
+            if prog:
+                prog.addProgress(1)
+        return ret
 
 
 class ParquetSheet(Sheet):
-    # rowdef: {'__rownum__':int, parquet_col:overridden_value, ...}
-    def iterload(self):
+    '''Rows are read from the parquet file only when their values are needed, one row group and column at a time, and converted to Python values a block of rows at a time.'''
+    # rowdef: int row number in the parquet file, plus 1 so that every row is truthy
+    blockRows = 4096         # rows converted to Python values together
+    maxArrowGroups = 64      # (column, row group) arrays kept in memory
+    maxPyBlocks = 256        # (column, block) lists of Python values kept in memory
+
+    def rowid(self, row):
+        'Return the row itself (its row number in the parquet file plus 1), which is stable and small enough for RowBitmap.'
+        return row if type(row) is int else id(row)
+
+    def loader(self):
         pa = vd.importExternal("pyarrow", "pyarrow")
         pq = vd.importExternal("pyarrow.parquet", "pyarrow")
-        from visidata.loaders.arrow import arrow_to_vdtype
 
+        self._cacheLock = threading.Lock()  # values are read in several threads; held only to look up, add or evict
+        self._readLock = threading.Lock()   # ParquetFile is not safe to read in several threads at once
+        self._arrowGroups = OrderedDict()  # (fieldname, groupnum) -> pyarrow array
+        self._pyBlocks = OrderedDict()     # (fieldname, blocknum) -> list of Python values
+
+        if getattr(self, 'fp', None) is not None:  # reloading; ParquetFile.close() does not close a file object it was given
+            self.fp.close()
+            self.fp = None
+
+        self.groupStarts = []  # first row number of each row group
+        nrows = 0
         if self.source.is_dir():
-            self.tbl = pq.read_table(str(self.source))
-        else: 
-            with self.source.open('rb') as f:
-                self.tbl = pq.read_table(f)
+            # each row group of each file (in the same order as pq.read_table), with the hive partition fields of its file
+            ds = vd.importExternal("pyarrow.dataset", "pyarrow")
+            self.pqfile = None
+            self.dataset = ds.dataset(str(self.source), format='parquet', partitioning='hive')
+            schema = self.dataset.schema
+            self.groups = [rg for frag in self.dataset.get_fragments() for rg in frag.split_by_row_group()]
+            self.groupnums = {}  # (path, row group id) -> groupnum
+            for i, rg in enumerate(self.groups):
+                self.groupnums[(rg.path, rg.row_groups[0].id)] = i
+                self.groupStarts.append(nrows)
+                nrows += rg.row_groups[0].num_rows
+        else:
+            self.dataset = None
+            self.fp = self.source.open('rb')
+            self.pqfile = pq.ParquetFile(self.fp)
+            schema = self.pqfile.schema_arrow
+            md = self.pqfile.metadata
+            for i in range(md.num_row_groups):
+                self.groupStarts.append(nrows)
+                nrows += md.row_group(i).num_rows
 
         self.columns = []
-        for colname, col in zip(self.tbl.column_names, self.tbl.columns):
-            c = ParquetColumn(colname,
-                              type=arrow_to_vdtype(col.type),
-                              source=col,
-                              cache=(col.type.id == pa.lib.Type_LARGE_STRING))
+        for field in schema:
+            c = ParquetColumn(field.name,
+                              type=arrow_to_vdtype(field.type),
+                              arrowType=field.type,
+                              arrowField=field.name,
+                              large_string=(field.type.id == pa.lib.Type_LARGE_STRING),
+                              cache=(field.type.id == pa.lib.Type_LARGE_STRING))
             self.addColumn(c)
 
-        for i in range(self.tbl.num_rows):
-            yield dict(__rownum__=i)
+        if self.precious and self.options.max_rows < nrows:
+            nrows = self.options.max_rows + 1
+        self.nFileRows = nrows
+        self._selectedRows = RowBitmap(self, lambda: range(1, self.nFileRows+1))
+
+        self.rows = []
+        with Progress(gerund='loading', total=nrows) as prog:
+            for i in range(0, nrows, 1024*1024):
+                n = min(nrows-i, 1024*1024)
+                self.rows.extend(range(i+1, i+n+1))
+                prog.addProgress(n)
+
+    def groupOffset(self, rownum) -> int:
+        'Return index of row number *rownum* in its row group.'
+        return rownum - self.groupStarts[bisect.bisect_right(self.groupStarts, rownum)-1]
+
+    def arrowValues(self, col, rownum):
+        'Return pyarrow array of values of *col* for the row group containing row number *rownum*.'
+        groupnum = bisect.bisect_right(self.groupStarts, rownum)-1
+        k = (col.arrowField, groupnum)
+        with self._cacheLock:
+            arr = self._arrowGroups.get(k)
+            if arr is not None:
+                self._arrowGroups.move_to_end(k)
+                return arr
+
+        if self.pqfile is None:
+            arr = self.groups[groupnum].to_table(schema=self.dataset.schema, columns=[col.arrowField]).column(0)
+        else:
+            with self._readLock:
+                arr = self.pqfile.read_row_group(groupnum, columns=[col.arrowField]).column(0)
+
+        with self._cacheLock:
+            self._arrowGroups[k] = arr
+            if len(self._arrowGroups) > self.maxArrowGroups:
+                self._arrowGroups.popitem(last=False)
+        return arr
+
+    def pyValues(self, col, rownum) -> list:
+        'Return list of Python values of *col* for the block of blockRows rows containing row number *rownum*.'
+        blocknum = rownum // self.blockRows
+        k = (col.arrowField, blocknum)
+        with self._cacheLock:
+            vals = self._pyBlocks.get(k)
+            if vals is not None:
+                self._pyBlocks.move_to_end(k)
+                return vals
+
+        vals = []
+        start = blocknum*self.blockRows
+        end = min(start+self.blockRows, self.nFileRows)
+        while start < end:  # the block may span row groups
+            arr = self.arrowValues(col, start)
+            offset = self.groupOffset(start)
+            n = min(end-start, len(arr)-offset)
+            if n <= 0:
+                break
+            vals.extend(arr.slice(offset, n).to_pylist())
+            start += n
+
+        with self._cacheLock:
+            self._pyBlocks[k] = vals
+            if len(self._pyBlocks) > self.maxPyBlocks:
+                self._pyBlocks.popitem(last=False)
+        return vals
+
+    def filteredRows(self, expr, fieldnames):
+        '''Return rows matching pyarrow.dataset *expr* on *fieldnames*.
+           Reads only *fieldnames*, from only the files and row groups whose partition values and statistics could match.'''
+        ds = vd.importExternal("pyarrow.dataset", "pyarrow")
+
+        if self.dataset is not None:
+            dataset = self.dataset
+            groupnum = lambda path, rgid: self.groupnums[(path, rgid)]
+        else:
+            dataset = ds.dataset(str(self.source), format='parquet')
+            groupnum = lambda path, rgid: rgid
+
+        rownums = []
+        for frag in Progress(list(dataset.get_fragments(filter=expr)), gerund='filtering'):
+            for rg in frag.split_by_row_group(filter=expr, schema=dataset.schema):
+                start = self.groupStarts[groupnum(frag.path, rg.row_groups[0].id)]
+                tbl = rg.to_table(schema=dataset.schema, columns=fieldnames)
+                rownums.extend(arrow_filter_rownums(tbl, expr, start))
+
+        rows = [r+1 for r in rownums if r < self.nFileRows]
+        if len(self.rows) != self.nFileRows:  # some rows deleted or added
+            present = set(self.rows)
+            rows = [r for r in rows if r in present]
+        return rows
+
+
+addFilterCommands(ParquetSheet)
 
 
 @VisiData.api
@@ -82,3 +240,46 @@ def save_parquet(vd, p, sheet):
             writer.write_batch(
                 pa.record_batch(data, names=[c.name for c in sheet.visibleCols])
             )
+
+
+def test_parquet_rows(vd):
+    import os
+    import tempfile
+    from visidata import Path, ItemColumn
+    import pytest
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, 'nums.parquet')
+        pq.write_table(pa.table({'k': [0, 1, 2, 3, 4], 's': list('abcde')}), fn, row_group_size=2)
+        vs = ParquetSheet('nums', source=Path(fn))
+        vs.blockRows = 3  # blocks across row groups
+        vd.sync(vs.ensureLoaded())
+
+        assert all(vs.rows)  # the first row is not falsy
+        assert [vs.column('s').getValue(r) for r in vs.rows] == list('abcde')
+        assert vs.column('k').getTypedValues(vs.rows[::-1]) == [4, 3, 2, 1, 0]
+
+        vs.selectRow(vs.rows[0])
+        assert vs.isSelected(vs.rows[0]) and vs.nSelectedRows == 1
+
+        other = Sheet('other', rows=[[0, 'x'], [3, 'y']], columns=[ItemColumn('k', 0, type=int), ItemColumn('v', 1)])
+        vs.setKeys([vs.column('k')])
+        other.setKeys(other.columns[:1])
+        vd.clearCaches()
+        js = vs.openJoin([other], jointype='outer')
+        vd.sync(js.ensureLoaded())
+        assert [r[other] and r[other][1] for r in js.rows] == ['x', None, None, 'y', None]
+
+        fp = vs.fp
+        vs.blockRows = 1
+        vd.sync(vs.reload())
+        assert fp.closed and not vs.fp.closed
+
+        # values read in several threads at once, evicting each other
+        import concurrent.futures
+        vs.maxArrowGroups = vs.maxPyBlocks = 1
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda i: vs.column('s').getValue(vs.rows[i % 5]), range(1000)))
+        assert results == [list('abcde')[i % 5] for i in range(1000)]
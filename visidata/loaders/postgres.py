@@ -1,11 +1,26 @@
+import io
+import os
 import random
+import threading
 from urllib.parse import urlparse
 
-from visidata import VisiData, vd, Sheet, options, anytype, asyncthread, ColumnItem
+from visidata import VisiData, vd, Sheet, options, anytype, asyncthread, ColumnItem, Progress, date, vlen, TypedWrapper, TypedExceptionWrapper
+from visidata.loaders._keyset import KeysetRows
 
-__all__ = ['openurl_postgres', 'openurl_postgresql', 'openurl_rds', 'PgTable', 'PgTablesSheet']
+__all__ = ['openurl_postgres', 'openurl_postgresql', 'openurl_rds', 'save_postgres', 'save_postgresql', 'PgTable', 'PgTablesSheet']
 
 vd.option('postgres_schema', 'public', 'The desired schema for the Postgres database')
+vd.option('postgres_window', False, 'fetch rows of postgres tables a page at a time by primary key, only as needed, instead of loading all rows')
+vd.option('postgres_copy', False, 'load postgres tables with COPY TO STDOUT in CSV format, instead of a row at a time from a cursor')
+vd.option('postgres_copy_rows', 100000, 'number of rows sent in each COPY FROM STDIN when saving to postgres')
+
+# COPY TO writes NULL as an unquoted \N, and quotes any text value of \N; csv.reader drops the quotes, so copyRows checks the raw field
+COPY_NULL = '\\N'
+
+
+def quoteName(name):
+    'Return *name* as a quoted SQL identifier.'
+    return '"%s"' % str(name).replace('"', '""')
 
 def codeToType(type_code, colname):
     psycopg2 = vd.importExternal('psycopg2', 'psycopg2-binary')
@@ -15,6 +30,10 @@ def codeToType(type_code, colname):
             return int
         if 'STRING' in tname:
             return str
+        if tname == 'FLOAT':
+            return float
+        if tname in ('DATE', 'DATETIME', 'DATETIMETZ'):
+            return date
     except KeyError:
         vd.status('unknown postgres type_code %s for %s' % (type_code, colname))
     return anytype
@@ -29,20 +48,21 @@ def openurl_rds(vd, url, filetype=None):
     url = urlparse(url.given)
 
     _, region, dbname = url.path.split('/')
-    token = rds.generate_db_auth_token(url.hostname, url.port, url.username, region)
 
-    conn = psycopg2.connect(
-                user=url.username,
-                dbname=dbname,
-                host=url.hostname,
-                port=url.port,
-                password=token)
+    def _connect():
+        token = rds.generate_db_auth_token(url.hostname, url.port, url.username, region)
+        return psycopg2.connect(
+                    user=url.username,
+                    dbname=dbname,
+                    host=url.hostname,
+                    port=url.port,
+                    password=token)
 
-    return PgTablesSheet(dbname+"_tables", sql=SQL(conn))
+    return PgTablesSheet(dbname+"_tables", sql=SQL(_connect(), connect=_connect))
 
 
-@VisiData.api
-def openurl_postgres(vd, url, filetype=None):
+def connect(url):
+    'Return (dbname, connection) for postgres *url*.'
     psycopg2 = vd.importExternal('psycopg2', 'psycopg2-binary')
 
     url = urlparse(url.given)
@@ -53,16 +73,66 @@ def openurl_postgres(vd, url, filetype=None):
                 host=url.hostname,
                 port=url.port,
                 password=url.password)
+    return dbname, conn
+
 
-    return PgTablesSheet(dbname+"_tables", sql=SQL(conn))
+@VisiData.api
+def openurl_postgres(vd, url, filetype=None):
+    dbname, conn = connect(url)
+    return PgTablesSheet(dbname+"_tables", sql=SQL(conn, connect=lambda: connect(url)[1]))
 
 
 VisiData.openurl_postgresql=VisiData.openurl_postgres
 
 
+def quotedFields(record) -> list:
+    'Return list of bool for each field in raw csv *record*, True if that field was quoted.'
+    ret = []
+    inquote = False
+    fieldstart = True
+    for ch in record:
+        if fieldstart:
+            ret.append(ch == '"')
+            fieldstart = False
+        if ch == '"':
+            inquote = not inquote
+        elif ch == ',' and not inquote:
+            fieldstart = True
+    if fieldstart:
+        ret.append(False)
+    return ret
+
+
+def copyRows(fp):
+    'Generate rows as lists of str (or None for NULL) from COPY csv in *fp*, with NULL as an unquoted COPY_NULL.'
+    import csv
+    csv.field_size_limit(2**31-1)
+    lines = []
+    def readlines():
+        for line in fp:
+            lines.append(line)
+            yield line
+
+    for row in csv.reader(readlines(), quoting=csv.QUOTE_MINIMAL):
+        if COPY_NULL in row:  # only NULL if not quoted
+            quoted = quotedFields(''.join(lines))
+            row = [None if v == COPY_NULL and not q else v for v, q in zip(row, quoted)]
+        lines.clear()
+        yield row
+
+
 class SQL:
-    def __init__(self, conn):
+    def __init__(self, conn, connect=None):
         self.conn = conn
+        self.connect = connect  # returns another connection to the same database, or None if not possible
+
+    def newConn(self):
+        'Return another connection to the same database, in autocommit mode, or None if not possible.'
+        if not self.connect:
+            return None
+        conn = self.connect()
+        conn.autocommit = True
+        return conn
 
     def cur(self, qstr):
         import string
@@ -71,6 +141,43 @@ class SQL:
         cur.execute(qstr)
         return cur
 
+    def copy_to(self, qstr):
+        'Generate rows as lists of str (or None for NULL) from *qstr*, streamed by COPY TO STDOUT in CSV format.'
+        psycopg2 = vd.importExternal('psycopg2', 'psycopg2-binary')
+
+        rfd, wfd = os.pipe()
+        errors = []
+
+        def _copy():
+            try:
+                with open(wfd, 'wb') as wfp, self.conn.cursor() as cur:
+                    cur.copy_expert(f"COPY ({qstr}) TO STDOUT WITH (FORMAT csv, NULL '{COPY_NULL}')", wfp)
+            except Exception as e:
+                errors.append(e)
+
+        t = threading.Thread(target=_copy, daemon=True)
+        t.start()
+        encoding = psycopg2.extensions.encodings.get(self.conn.encoding, 'utf-8')
+        finished = False
+        try:
+            with open(rfd, encoding=encoding, newline='') as fp:
+                yield from copyRows(fp)
+            finished = True
+        finally:
+            if not finished:  # stop the query on the server, if not all rows were read
+                self.conn.cancel()
+                t.join()
+                self.conn.rollback()
+        t.join()
+        if errors:
+            raise errors[0]
+
+    def query(self, qstr, params=None) -> list:
+        'Return all rows from *qstr* with *params*, using a client-side cursor.'
+        with self.conn.cursor() as cur:
+            cur.execute(qstr, params)
+            return cur.fetchall()
+
     @asyncthread
     def query_async(self, qstr, callback=None):
         with self.cur(qstr) as cur:
@@ -120,12 +227,126 @@ class PgTablesSheet(Sheet):
 
 # rowdef: tuple of values as returned by fetchone()
 class PgTable(Sheet):
+    _pageConn = None  # connection used by the KeysetRows of this sheet
+
+    def rowid(self, row):
+        'Return the primary key for rows of windowed sheets, which may be fetched again as different objects.'
+        if isinstance(self.rows, KeysetRows):
+            return self.rows.keyfunc(row)
+        return id(row)
+
+    def orderBy(self, *cols, reverse=False):
+        if isinstance(self.rows, KeysetRows):
+            vd.fail('windowed sheets are in primary key order and cannot be sorted; unset postgres_window and reload')
+        return super().orderBy(*cols, reverse=reverse)
+
+    def newRow(self):
+        if isinstance(self.rows, KeysetRows):
+            vd.fail('adding rows to windowed sheets is not supported; unset postgres_window and reload')
+        return super().newRow()
+
+    def keysetRows(self, source):
+        '''Set columns and return sequence of the rows of table *source*, in primary key order, fetched a page at a time only as needed; or None if the table has no primary key.
+           The rows are fetched on another connection in autocommit mode, so the session is not left idle in a transaction between pages.'''
+        if self._pageConn is not None:
+            self._pageConn.close()
+        self._pageConn = pageconn = self.sql.newConn()
+        if pageconn is None:
+            vd.warning('cannot open another connection to fetch pages; loading all rows')
+            return None
+
+        def query(qstr, params=None) -> list:
+            with pageconn.cursor() as cur:
+                cur.execute(qstr, params)
+                return cur.fetchall()
+
+        keynames = [r[0] for r in query('''
+            SELECT a.attname FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                WHERE i.indrelid = %s::regclass AND i.indisprimary
+                ORDER BY array_position(i.indkey::int2[], a.attnum)''', (source,))]
+        if not keynames:
+            vd.warning(f'{source} has no primary key; loading all rows')
+            return None
+
+        with pageconn.cursor() as cur:
+            cur.execute(f'SELECT * FROM {source} LIMIT 0')
+            self.columns = []
+            for c in vd.postgresGetColumns(cur):
+                self.addColumn(c)
+            colnames = [desc.name for desc in cur.description]
+
+        keyidxs = [colnames.index(k) for k in keynames]
+        self.setKeys([self.columns[i] for i in keyidxs])
+        keys = ', '.join(quoteName(k) for k in keynames)
+        keysdesc = ', '.join(quoteName(k)+' DESC' for k in keynames)
+        placeholders = ', '.join('%s' for k in keynames)
+
+        def where(key, op='>'):
+            if key is None:
+                return '', ()
+            return f' WHERE ({keys}) {op} ({placeholders})', key
+
+        def fetchPage(afterkey, n):
+            wheresql, params = where(afterkey)
+            return query(f'SELECT * FROM {source}{wheresql} ORDER BY {keys} LIMIT {n}', params)
+
+        def skipKey(afterkey, n):
+            wheresql, params = where(afterkey)
+            r = query(f'SELECT {keys} FROM {source}{wheresql} ORDER BY {keys} LIMIT 1 OFFSET {n-1}', params)
+            return tuple(r[0]) if r else None
+
+        def skipKeyBack(beforekey, n):
+            wheresql, params = where(beforekey, '<')
+            r = query(f'SELECT {keys} FROM {source}{wheresql} ORDER BY {keysdesc} LIMIT 1 OFFSET {n-1}', params)
+            return tuple(r[0]) if r else None
+
+        # estimated count, from the last VACUUM or ANALYZE
+        nrows = query('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', (source,))[0][0]
+        exact = nrows <= 0
+        if exact:
+            nrows = query(f'SELECT COUNT(*) FROM {source}')[0][0]
+
+        return KeysetRows(nrows, fetchPage, skipKey, lambda row: tuple(row[i] for i in keyidxs),
+                          pageRows=self.options.window_page_rows,
+                          maxPages=self.options.window_max_pages,
+                          skipKeyBack=skipKeyBack, exact=exact,
+                          placeholder=(None,)*len(colnames))
+
+    def draw(self, scr):
+        if isinstance(self.rows, KeysetRows):
+            with self.rows.drawing():  # do not wait for pages not yet fetched
+                return super().draw(scr)
+        return super().draw(scr)
+
     @asyncthread
     def reload(self):
         if self.options.postgres_schema:
             source = f'"{self.options.postgres_schema}"."{self.source}"'
         else:
             source = f'"{self.source}"'
+
+        if self.options.postgres_window:
+            rows = self.keysetRows(source)
+            if rows is not None:
+                self.rows = rows
+                return
+
+        if self.options.postgres_copy:
+            psycopg2 = vd.importExternal('psycopg2', 'psycopg2-binary')
+            with self.sql.conn.cursor() as cur:
+                cur.execute(f'SELECT * FROM {source} LIMIT 0')
+                self.columns = []
+                for c in vd.postgresGetColumns(cur):
+                    self.addColumn(c)
+
+                # parse COPY text with the typecasters the cursor would use, for the same values (bool, Decimal, datetime, json)
+                casters = [psycopg2.extensions.string_types.get(desc.type_code) for desc in cur.description]
+                self.rows = []
+                for r in Progress(self.sql.copy_to(f'SELECT * FROM {source}'), gerund='loading'):
+                    self.addRow(tuple(v if v is None or cast is None else cast(v, cur) for cast, v in zip(casters, r)))
+            return
+
         with self.sql.cur(f"SELECT * FROM {source}") as cur:
             self.rows = []
             r = cur.fetchone()
@@ -136,3 +357,116 @@ class PgTable(Sheet):
                 self.addColumn(c)
             for r in cur:
                 self.addRow(r)
+
+
+def copyvals(col, rows, sqltype) -> list:
+    'Return list of values of *col* for each of *rows* (None for NULL), for writing as COPY csv into a column of *sqltype*.'
+    import json
+    safe_error = col.sheet.options.safe_error
+    ret = []
+    for v in col.getTypedValues(rows):
+        if isinstance(v, TypedWrapper):
+            if isinstance(v, TypedExceptionWrapper) and sqltype == 'TEXT':
+                v = safe_error
+            else:
+                v = None
+        elif isinstance(v, date):
+            v = v.isoformat()
+        elif isinstance(v, (list, tuple, dict)):
+            v = json.dumps(v)
+        ret.append(v)
+    return ret
+
+
+def copyField(v) -> str:
+    'Return *v* as a COPY csv field: NULL is unquoted and empty, and every other value is quoted.'
+    if v is None:
+        return ''
+    return '"%s"' % str(v).replace('"', '""')
+
+
+def copyBatches(vs, sqltypes, nrows):
+    'Generate str of COPY csv for each batch of *nrows* rows of sheet *vs*, with visible columns of *sqltypes*.'
+    import itertools
+    cols = vs.visibleCols
+    it = iter(vs.rows)
+    while True:
+        rows = list(itertools.islice(it, nrows))
+        if not rows:
+            return
+        buf = io.StringIO()
+        for i in range(0, len(rows), vs.saveChunkRows):
+            chunk = rows[i:i+vs.saveChunkRows]
+            for vals in zip(*[copyvals(col, chunk, sqltype) for col, sqltype in zip(cols, sqltypes)]):
+                buf.write(','.join(map(copyField, vals)) + '\n')
+        yield len(rows), buf.getvalue()
+
+
+@VisiData.api
+def save_postgres(vd, p, *vsheets):
+    'Save each of *vsheets* to a table of the same name in the postgres database at url *p*, creating the table if needed, with COPY FROM STDIN.'
+    dbname, conn = connect(p)
+
+    sqltypes = {
+        int: 'BIGINT',
+        vlen: 'BIGINT',
+        float: 'DOUBLE PRECISION',
+        date: 'TIMESTAMP',
+    }
+
+    for t in vd.numericTypes:
+        if t not in sqltypes:
+            sqltypes[t] = 'DOUBLE PRECISION'
+
+    for vs in vsheets:
+        vs.ensureLoaded()
+    vd.sync()
+
+    schema = vsheets[0].options.postgres_schema
+    try:
+        with conn.cursor() as cur:
+            for vs in vsheets:
+                tblname = quoteName(vd.cleanName(vs.name))
+                if schema:
+                    tblname = quoteName(schema) + '.' + tblname
+                cols = vs.visibleCols
+                coltypes = [sqltypes.get(col.type, 'TEXT') for col in cols]
+                colnames = ', '.join(quoteName(col.name) for col in cols)
+                cur.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (tblname, ', '.join(f'{quoteName(col.name)} {t}' for col, t in zip(cols, coltypes))))
+
+                sql = f"COPY {tblname} ({colnames}) FROM STDIN WITH (FORMAT csv)"  # NULL is an unquoted empty field
+                with Progress(gerund='saving', total=len(vs.rows)) as prog:
+                    for n, batch in copyBatches(vs, coltypes, vs.options.postgres_copy_rows):
+                        cur.copy_expert(sql, io.StringIO(batch))
+                        prog.addProgress(n)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+VisiData.save_postgresql = VisiData.save_postgres
+
+
+def test_postgres_copy_batches(vd):
+    from visidata import ItemColumn
+
+    vs = Sheet('pg', rows=[[1, 'a,b', 1.5], [None, 'say "hi"', 'x'], [3, None, None], [4, '', 0.0], [5, '\\N', 2.0]])
+    vs.addColumn(ItemColumn('n', 0, type=int))
+    vs.addColumn(ItemColumn('s', 1))
+    vs.addColumn(ItemColumn('f', 2, type=float))
+    batches = list(copyBatches(vs, ['BIGINT', 'TEXT', 'DOUBLE PRECISION'], 2))
+    assert [n for n, _ in batches] == [2, 2, 1]
+    assert ''.join(batch for _, batch in batches) == '\n'.join([
+        '"1","a,b","1.5"',
+        ',"say ""hi""",',
+        '"3",,',
+        '"4","","0.0"',
+        '"5","\\N","2.0"']) + '\n'
+
+    # as from COPY TO with NULL '\N': only an unquoted \N is NULL
+    rows = list(copyRows(io.StringIO('1,"",\\N\n"\\N",0,"a\n\\N,b"\n\\N,"x""\\N",\n')))
+    assert rows == [['1', '', None], ['\\N', '0', 'a\n\\N,b'], [None, 'x"\\N', '']]
+    assert quotedFields('1,"a,""b",\\N,\n') == [False, True, False, False]
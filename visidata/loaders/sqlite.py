@@ -1,10 +1,20 @@
 from copy import copy
+from contextlib import contextmanager
+import itertools
+import json
 import re
 
 from visidata import VisiData, vd, Sheet, options, Column, Progress, anytype, ColumnItem, asyncthread, TypedExceptionWrapper, TypedWrapper, IndexSheet, vlen
 from visidata.type_date import date
+from visidata.loaders._keyset import KeysetRows
 
 vd.option('sqlite_onconnect', '', 'sqlite statement to execute after opening a connection')
+vd.option('sqlite_save_journal_mode', '', 'sqlite journal_mode during save and commit of changes (empty to leave unchanged)')
+vd.option('sqlite_save_synchronous', '', 'sqlite synchronous setting during save and commit of changes (empty to leave unchanged)')
+vd.option('sqlite_save_cache_size', -65536, 'sqlite cache_size during save and commit of changes (negative for KiB; 0 to leave unchanged)')
+vd.option('sqlite_save_index', False, 'create an index on the key columns of each table saved to sqlite')
+vd.option('sqlite_window', False, 'fetch rows of sqlite tables a page at a time, in order of rowid (or of the sort columns and then rowid), only as needed, instead of loading all rows')
+vd.option('sqlite_pushdown', False, 'on sqlite tables, sort, select-cell, select-regex and freq open a new sheet with the results of an SQL query')
 
 
 def requery(url, **kwargs):
@@ -36,6 +46,103 @@ def openurl_sqlite(vd, p, filetype=None):
 VisiData.open_sqlite3 = VisiData.open_sqlite
 VisiData.open_db = VisiData.open_sqlite
 
+
+def chunks(it, n):
+    'Generate lists of up to *n* items from iterable *it*.'
+    it = iter(it)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def sqlvals(col, rows, jsonenc=json.JSONEncoder()) -> list:
+    'Return list of sqlite parameter values of *col* for each of *rows*.'
+    safe_error = col.sheet.options.safe_error
+    ret = []
+    for row, v in zip(rows, col.getTypedValues(rows)):
+        if type(v) in (int, float, str):
+            pass
+        elif isinstance(v, TypedWrapper):
+            if isinstance(v, TypedExceptionWrapper):
+                v = safe_error
+            else:
+                v = None
+        elif isinstance(v, (list, tuple, dict)):
+            v = jsonenc.encode(v)  #1589: list/dict values as json
+        elif not isinstance(v, (int, float, str)):
+            v = col.getDisplayValue(row)
+        ret.append(v)
+    return ret
+
+
+def sqlrows(cols, rows) -> list:
+    'Return list of tuples of sqlite parameter values of *cols*, one for each of *rows*, computed a column at a time.'
+    if not cols:
+        return [()]*len(rows)
+    return list(zip(*[sqlvals(col, rows) for col in cols]))
+
+
+def sqlite_regexp(regex, flags, v):
+    'Return True if str of *v* matches *regex* with *flags* (from regex_flags); registered as the vd_regexp() SQL function.'
+    if v is None:
+        return False
+    return re.search(regex, str(v), sum(getattr(re, f.upper()) for f in flags or '')) is not None
+
+
+@contextmanager
+def sqlite_write(conn, opts):
+    'Run the enclosed writes to *conn* in a single transaction, with the sqlite_save_ PRAGMAs from *opts* in effect.'
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manage the transaction explicitly
+    journal_mode = None
+    if opts.sqlite_save_journal_mode:
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        conn.execute('PRAGMA journal_mode=%s' % opts.sqlite_save_journal_mode)
+    if opts.sqlite_save_synchronous:
+        conn.execute('PRAGMA synchronous=%s' % opts.sqlite_save_synchronous)
+    if opts.sqlite_save_cache_size:
+        conn.execute('PRAGMA cache_size=%d' % int(opts.sqlite_save_cache_size))
+
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+    finally:
+        if journal_mode:
+            # journal_mode can persist in the database file, and cannot be changed while other connections have it open
+            restored = conn.execute('PRAGMA journal_mode=%s' % journal_mode).fetchone()[0]
+            if restored.lower() != journal_mode.lower():
+                vd.warning(f'could not restore sqlite journal_mode={journal_mode} (still {restored})')
+        conn.isolation_level = isolation_level
+
+
+def keysetWhere(order, key, before=False):
+    '''Return (clause, parms) for rows after *key* (or before, if *before*) in *order*, a list of (sqlname, reverse) ending with a unique column.
+       Nulls are before other values, as in ORDER BY in sqlite.'''
+    terms = []
+    for i, ((name, reverse), v) in enumerate(zip(order, key)):
+        if reverse != before:  # rows after have smaller values, or nulls
+            if v is None:
+                continue
+            cmp, cmpparms = '("%s" < ? OR "%s" IS NULL)' % (name, name), [v]
+        elif v is None:  # rows after have larger values, which is any but null
+            cmp, cmpparms = '"%s" IS NOT NULL' % name, []
+        else:
+            cmp, cmpparms = '"%s" > ?' % name, [v]
+        eqs = ['"%s" IS ?' % prevname for prevname, _ in order[:i]]
+        terms.append((' AND '.join(eqs + [cmp]), list(key[:i]) + cmpparms))
+
+    if not terms:
+        return '0', []
+    return ' OR '.join('(%s)' % clause for clause, _ in terms), [p for _, parms in terms for p in parms]
+
+
 # rowdef: list of values
 class SqliteSheet(Sheet):
     'Provide functionality for importing SQLite databases.'
@@ -43,16 +150,20 @@ class SqliteSheet(Sheet):
     defer = True
     query = ''
     tableName = ''
+    sqlWhere = []   # list of (clause, parms) for pushdown sheets
+    sqlOrder = []   # list of (sqlname, reverse) for pushdown sheets
+    _pageConn = None  # connection used by the KeysetRows of this sheet
 
-    def conn(self):
+    def conn(self, **kwargs):
         import sqlite3
         localpath = self.rootSheet().source
 
         url = localpath if localpath.is_url() else f'file:{localpath.resolve()}'
         url = requery(url, **self.options.getall('sqlite_param_'))
 
-        con = sqlite3.connect(url, uri=True, **self.options.getall('sqlite_connect_'))
+        con = sqlite3.connect(url, uri=True, **dict(self.options.getall('sqlite_connect_'), **kwargs))
         con.text_factory = lambda s, enc=self.options.encoding, encerrs=self.options.encoding_errors: s.decode(enc, encerrs)
+        con.create_function('vd_regexp', 3, sqlite_regexp)
         if self.options.sqlite_onconnect:
             con.execute(self.options.sqlite_onconnect)
         return con
@@ -94,7 +205,7 @@ class SqliteSheet(Sheet):
                 self.columns = []
                 for r in self.execute(conn, 'PRAGMA TABLE_XINFO("%s")' % tblname):
                     colnum, colname, coltype, nullable, defvalue, colkey, *_ = r
-                    c = ColumnItem(colname, colnum+1, type=parse_sqlite_type(coltype))
+                    c = ColumnItem(colname, colnum+1, type=parse_sqlite_type(coltype), sqlName=colname)
                     self.addColumn(c)
 
                     if colkey:
@@ -102,13 +213,24 @@ class SqliteSheet(Sheet):
 
                 sql = self.row[5]  # SQL used to create table
                 if 'WITHOUT ROWID' not in sql and 'CREATE VIEW' not in sql:
-                    self.rowidColumn = ColumnItem('rowid', 0, type=int, width=0)
+                    self.rowidColumn = ColumnItem('rowid', 0, type=int, width=0, sqlName='rowid')
                     self.addColumn(self.rowidColumn, index=0)
 
-            if self.rowidColumn:
-                r = self.execute(conn, 'SELECT rowid, * FROM "%s"' % tblname)
-            else:
-                r = self.execute(conn, 'SELECT NULL, * FROM "%s"' % tblname)
+            where, parms = self.whereSql()
+            if self.options.sqlite_window and self.rowidColumn:
+                # rows are fetched as needed instead of loaded here
+                self.rows = self.keysetRows(conn, tblname)
+                if self.sqlWhere or self.sqlOrder:
+                    self.query = 'SELECT rowid, * FROM "%s"%s ORDER BY %s' % (tblname, where, ', '.join(['"%s"%s' % (name, ' DESC' if reverse else '') for name, reverse in self.sqlOrder] + ['rowid']))
+                return
+
+            sql = 'SELECT %s, * FROM "%s"%s' % ('rowid' if self.rowidColumn else 'NULL', tblname, where)
+            if self.sqlOrder:
+                sql += ' ORDER BY ' + ', '.join('"%s"%s' % (name, ' DESC' if reverse else '') for name, reverse in self.sqlOrder)
+            if self.sqlWhere or self.sqlOrder:
+                self.query = sql
+
+            r = self.execute(conn, sql, parms=parms)
             yield from Progress(r, total=r.rowcount-1)
 
     def iterload_query(self, query:str):
@@ -129,6 +251,125 @@ class SqliteSheet(Sheet):
             for row in self.result:
                 yield row
 
+    def keysetRows(self, conn, tblname) -> KeysetRows:
+        'Return sequence of the rows of *tblname* matching the WHERE clauses of this sheet, in order of sqlOrder and then rowid, fetched a page at a time only as needed.'
+        order = list(self.sqlOrder) + [('rowid', False)]  # rowid makes the key unique
+        exprs = {c.sqlName: c.expr for c in self.columns if getattr(c, 'sqlName', None)}
+        keyidxs = [exprs[name] for name, _ in order]
+        keys = ', '.join('"%s"' % name for name, _ in order)
+
+        def orderSql(backward=False):
+            return ' ORDER BY ' + ', '.join('"%s"%s' % (name, ' DESC' if reverse != backward else '') for name, reverse in order)
+
+        def where(key, before=False):
+            return self.whereSql(keysetWhere(order, key, before)) if key is not None else self.whereSql()
+
+        # KeysetRows fetches one page at a time, from either the main thread or its prefetch thread
+        if self._pageConn is not None:
+            self._pageConn.close()
+        self._pageConn = pageconn = self.conn(check_same_thread=False)
+
+        def fetchPage(afterkey, n):
+            wheresql, parms = where(afterkey)
+            sql = 'SELECT rowid, * FROM "%s"%s%s LIMIT %d' % (tblname, wheresql, orderSql(), n)
+            return self.execute(pageconn, sql, parms=parms).fetchall()
+
+        def skipKey(afterkey, n):
+            wheresql, parms = where(afterkey)
+            sql = 'SELECT %s FROM "%s"%s%s LIMIT 1 OFFSET %d' % (keys, tblname, wheresql, orderSql(), n-1)
+            r = self.execute(pageconn, sql, parms=parms).fetchone()
+            return tuple(r) if r else None
+
+        def skipKeyBack(beforekey, n):
+            wheresql, parms = where(beforekey, before=True)
+            sql = 'SELECT %s FROM "%s"%s%s LIMIT 1 OFFSET %d' % (keys, tblname, wheresql, orderSql(backward=True), n-1)
+            r = self.execute(pageconn, sql, parms=parms).fetchone()
+            return tuple(r) if r else None
+
+        wheresql, parms = self.whereSql()
+        nrows = self.execute(conn, 'SELECT COUNT(*) FROM "%s"%s' % (tblname, wheresql), parms=parms).fetchone()[0]
+        return KeysetRows(nrows, fetchPage, skipKey, lambda row: tuple(row[i] for i in keyidxs),
+                          pageRows=self.options.window_page_rows,
+                          maxPages=self.options.window_max_pages,
+                          skipKeyBack=skipKeyBack, exact=True,
+                          placeholder=(None,)*(max(exprs.values())+1))
+
+    def draw(self, scr):
+        if isinstance(self.rows, KeysetRows):
+            with self.rows.drawing():  # do not wait for pages not yet fetched
+                return super().draw(scr)
+        return super().draw(scr)
+
+    def newRow(self):
+        if isinstance(self.rows, KeysetRows):
+            vd.fail('adding rows to windowed sheets is not supported; unset sqlite_window and reload')
+        return super().newRow()
+
+    def rowid(self, row):
+        'Return the rowid in the database for rows of windowed sheets, which may be fetched again as different objects.'
+        if isinstance(self.rows, KeysetRows):
+            return row[0]
+        return id(row)
+
+    def whereSql(self, *extra):
+        'Return (sql, parms) for the WHERE clause of this pushdown sheet with *extra* (clause, parms) also, or ("", []) if none.'
+        clauses = self.sqlWhere + list(extra)
+        if not clauses:
+            return '', []
+        parms = []
+        for _, p in clauses:
+            parms.extend(p)
+        return ' WHERE ' + ' AND '.join('(%s)' % clause for clause, _ in clauses), parms
+
+    def pushdown(self, name, where=[], order=None) -> 'SqliteSheet':
+        'Return new sheet with rows of this table from the database, also matching *where* (list of (clause, parms)), and ordered by *order* (list of (sqlname, reverse)) instead if given.'
+        return SqliteSheet(name, source=self.source, tableName=self.tableName, row=self.row,
+                           sqlWhere=self.sqlWhere+list(where),
+                           sqlOrder=self.sqlOrder if order is None else order)
+
+    def canPushdown(self, *cols) -> bool:
+        'Return True if *cols* can be used in SQL on this table.'
+        return bool(self.tableName and self.options.sqlite_pushdown and cols and all(getattr(c, 'sqlName', None) for c in cols))
+
+    def orderBy(self, *cols, reverse=False):
+        'Open new sheet ordered by *cols* in SQL if sqlite_pushdown is set, or if this sheet is windowed; otherwise sort this sheet in memory as usual.'
+        newcols = cols[1:] if cols and cols[0] is None else cols
+        if isinstance(self.rows, KeysetRows):
+            if not all(getattr(c, 'sqlName', None) for c in newcols):
+                vd.fail('windowed sheets can only be sorted by table columns, in SQL')
+        elif not self.canPushdown(*newcols):
+            return super().orderBy(*cols, reverse=reverse)
+
+        order = [] if cols[0] is None else list(self.sqlOrder)
+        order += [(c.sqlName, reverse) for c in newcols]
+        vd.push(self.pushdown(self.name+'_sorted', order=order))
+
+    def whereEqual(self, col, row) -> 'SqliteSheet':
+        'Return new sheet with the rows of this table having the same database value in *col* as *row*, filtered in SQL.'
+        v = Column.calcValue(col, row)  # value in the database, before any deferred change
+        if v is None:
+            where = ('"%s" IS NULL' % col.sqlName, [])
+        else:
+            where = ('"%s" = ?' % col.sqlName, [v])
+        return self.pushdown(self.name+'_where', where=[where])
+
+    def whereInputRegex(self, action:str, unselect=False) -> 'SqliteSheet':
+        'Return new sheet with the rows of this table with values in the current column matching (or not matching, if *unselect*) an input regex, filtered in SQL.'
+        r = vd.inputMultiple(regex=dict(prompt=f"{action} regex: ", type="regex", defaultLast=True, help=vd.help_regex),
+                             flags=dict(prompt="regex flags: ", type="regex_flags", value=self.options.regex_flags, help=vd.help_regex_flags))
+        where = ('%svd_regexp(?, ?, "%s")' % ('NOT ' if unselect else '', self.cursorCol.sqlName), [r['regex'], r['flags']])
+        return self.pushdown(self.name+'_where', where=[where])
+
+    def freqSql(self, *cols) -> 'SqliteSheet':
+        'Return new sheet with the number of rows of this table for each distinct value of *cols*, counted by GROUP BY in SQL.'
+        names = ', '.join('"%s"' % c.sqlName for c in cols)
+        where, parms = self.whereSql()
+        sql = 'SELECT %s, COUNT(*) AS count FROM "%s"%s GROUP BY %s ORDER BY count DESC' % (names, self.tableName, where, names)
+        vs = self.rawSql(sql)
+        vs.name = '%s_%s_freq' % (self.name, '-'.join(c.name for c in cols))
+        vs.parms = parms
+        return vs
+
     def iterload(self):
         if self.tableName:
             yield from self.iterload_table(self.tableName)
@@ -140,67 +381,59 @@ class SqliteSheet(Sheet):
     @asyncthread
     def putChanges(self):
         adds, mods, dels = self.getDeferredChanges()
-        options_safe_error = options.safe_error
-        def value(row, col):
-            v = col.getTypedValue(row)
-            if isinstance(v, TypedWrapper):
-                if isinstance(v, TypedExceptionWrapper):
-                    return options_safe_error
-                else:
-                    return None
-            elif not isinstance(v, (int, float, str)):
-                v = col.getDisplayValue(r)
-            return v
-
-        def values(row, cols):
-            vals = []
-            for c in cols:
-                vals.append(value(row, c))
-            return vals
-
-        with self.conn() as conn:
-            for r in adds.values():
-                cols = self.visibleCols
-                sql = 'INSERT INTO "%s" ' % self.tableName
-                sql += '(%s)' % ','.join(c.name for c in cols)
-                sql += ' VALUES (%s)' % ','.join('?' for c in cols)
-                res = self.execute(conn, sql, parms=values(r, cols))
-                if res.rowcount != res.arraysize:
-                    vd.warning('not all rows inserted') # f'{res.rowcount}/{res.arraysize} rows inserted'
 
+        with self.conn() as conn, sqlite_write(conn, self.options):
+            cols = self.visibleCols
+            sql = 'INSERT INTO "%s" ' % self.tableName
+            sql += '(%s)' % ','.join(c.name for c in cols)
+            sql += ' VALUES (%s)' % ','.join('?' for c in cols)
+            for rows in chunks(adds.values(), self.saveChunkRows):
+                res = self.executemany(conn, sql, sqlrows(cols, rows))
+                if res.rowcount != len(rows):
+                    vd.warning('not all rows inserted') # f'{res.rowcount}/{len(rows)} rows inserted'
+
+            if mods and not self.rowidColumn:
+                vd.warning('cannot modify rows in tables without rowid')
+                mods = {}
+
+            wherecols = [self.rowidColumn]
+            modsbycols = {}  # tuple of modified cols -> list of rows; rows with the same modified cols share one UPDATE statement
             for row, rowmods in mods.values():
-                if not self.rowidColumn:
-                    vd.warning('cannot modify rows in tables without rowid')
-                    break
-                wherecols = [self.rowidColumn]
+                if rowmods:
+                    modsbycols.setdefault(tuple(rowmods.keys()), []).append(row)
+
+            for modcols, rows in modsbycols.items():
                 sql = 'UPDATE "%s" SET ' % self.tableName
-                sql += ', '.join('%s=?' % c.name for c, _ in rowmods.items())
+                sql += ', '.join('%s=?' % c.name for c in modcols)
                 sql += ' WHERE %s' % ' AND '.join('"%s"=?' % c.name for c in wherecols)
-                newvals=values(row, [c for c, _ in rowmods.items()])
-                # calcValue gets the 'previous' value (before update)
-                wherevals=list(Column.calcValue(c, row) or '' for c in wherecols)
-                res = self.execute(conn, sql, parms=newvals+wherevals)
-                if res.rowcount != res.arraysize:
-                    vd.warning('not all rows updated') # f'{res.rowcount}/{res.arraysize} rows updated'
-
-            for row in dels.values():
-                if not self.rowidColumn:
-                    vd.warning('cannot delete rows in tables without rowid')
-                    break
-
-                wherecols = [self.rowidColumn]
+                for chunk in chunks(rows, self.saveChunkRows):
+                    # calcValue gets the 'previous' value (before update)
+                    parms = [newvals+tuple(Column.calcValue(c, row) or '' for c in wherecols)
+                                for row, newvals in zip(chunk, sqlrows(modcols, chunk))]
+                    res = self.executemany(conn, sql, parms)
+                    if res.rowcount != len(chunk):
+                        vd.warning('not all rows updated') # f'{res.rowcount}/{len(chunk)} rows updated'
+
+            if dels and not self.rowidColumn:
+                vd.warning('cannot delete rows in tables without rowid')
+                dels = {}
+
+            if dels:
                 sql = 'DELETE FROM "%s" ' % self.tableName
                 sql += ' WHERE %s' % ' AND '.join('"%s"=?' % c.name for c in wherecols)
-                wherevals=list(Column.calcValue(c, row) for c in wherecols)
-                res = self.execute(conn, sql, parms=wherevals)
-                if res.rowcount != res.arraysize:
-                    vd.warning('not all rows deleted') # f'{res.rowcount}/{res.arraysize} rows deleted'
-
-            conn.commit()
+                for rows in chunks(dels.values(), self.saveChunkRows):
+                    parms = [tuple(Column.calcValue(c, row) for c in wherecols) for row in rows]
+                    res = self.executemany(conn, sql, parms)
+                    if res.rowcount != len(rows):
+                        vd.warning('not all rows deleted') # f'{res.rowcount}/{len(rows)} rows deleted'
 
         self.preloadHook()
         self.reload()
 
+    def executemany(self, conn, sql, parms):
+        vd.debug(sql)
+        return conn.executemany(sql, parms)
+
 
 class SqliteIndexSheet(SqliteSheet, IndexSheet):
     rowtype = 'tables'
@@ -242,13 +475,10 @@ class SqliteIndexSheet(SqliteSheet, IndexSheet):
 @VisiData.api
 def save_sqlite(vd, p, *vsheets):
     import sqlite3
-    import json
-    jsonenc = json.JSONEncoder()  #1589: list/dict values as json
 
     conn = sqlite3.connect(str(p))
     conn.text_factory = lambda s, enc=vsheets[0].options.encoding: s.decode(enc)
     conn.row_factory = sqlite3.Row
-    c = conn.cursor()
 
     sqltypes = {
         int: 'INTEGER',
@@ -265,34 +495,36 @@ def save_sqlite(vd, p, *vsheets):
         vs.ensureLoaded()
     vd.sync()
 
-    for vs in vsheets:
-        tblname = vd.cleanName(vs.name)
-        sqlcols = []
-        for col in vs.visibleCols:
-            sqlcols.append('"%s" %s' % (col.name, sqltypes.get(col.type, 'TEXT')))
-        sql = 'CREATE TABLE IF NOT EXISTS "%s" (%s)' % (tblname, ', '.join(sqlcols))
-        c.execute(sql)
-
-        for r in Progress(vs.rows, 'saving'):
-            sqlvals = []
-            for col in vs.visibleCols:
-                v = col.getTypedValue(r)
-                if isinstance(v, TypedWrapper):
-                    if isinstance(v, TypedExceptionWrapper):
-                        v = options.safe_error
-                    else:
-                        v = None
-                elif isinstance(v, (list, tuple, dict)):
-                    v = jsonenc.encode(v)
-                elif not isinstance(v, (int, float, str)):
-                    v = col.getDisplayValue(r)
-                sqlvals.append(v)
-            sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (tblname, ','.join(f'"{c.name}"' for c in vs.visibleCols), ','.join('?' for v in sqlvals))
-            c.execute(sql, sqlvals)
-
-    conn.commit()
-
-
+    with sqlite_write(conn, vsheets[0].options):
+        for vs in vsheets:
+            tblname = vd.cleanName(vs.name)
+            cols = vs.visibleCols
+            sqlcols = []
+            for col in cols:
+                sqlcols.append('"%s" %s' % (col.name, sqltypes.get(col.type, 'TEXT')))
+            sql = 'CREATE TABLE IF NOT EXISTS "%s" (%s)' % (tblname, ', '.join(sqlcols))
+            conn.execute(sql)
+
+            sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (tblname, ','.join(f'"{c.name}"' for c in cols), ','.join('?' for c in cols))
+            with Progress(gerund='saving', total=len(vs.rows)) as prog:
+                for rows in chunks(vs.rows, vs.saveChunkRows):
+                    conn.executemany(sql, sqlrows(cols, rows))
+                    prog.addProgress(len(rows))
+
+            keycols = [c for c in vs.keyCols if c in cols]
+            if keycols and vs.options.sqlite_save_index:
+                sql = 'CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)' % (vd.cleanName(tblname+'_keys'), tblname, ','.join(f'"{c.name}"' for c in keycols))
+                conn.execute(sql)
+
+    conn.close()
+
+
+SqliteSheet.addCommand(',', 'select-equal-cell', 'vd.push(whereEqual(cursorCol, cursorRow)) if canPushdown(cursorCol) else select(gatherBy(lambda r,c=cursorCol,v=cursorDisplay: c.getDisplayValue(r) == v), progress=False)', 'select rows matching current cell in current column (with sqlite_pushdown, open sheet of them instead)')
+SqliteSheet.addCommand('z,', 'select-exact-cell', 'vd.push(whereEqual(cursorCol, cursorRow)) if canPushdown(cursorCol) else select(gatherBy(lambda r,c=cursorCol,v=cursorTypedValue: c.getTypedValue(r) == v), progress=False)', 'select rows matching current cell in current column (with sqlite_pushdown, open sheet of them instead)')
+SqliteSheet.addCommand('|', 'select-col-regex', 'vd.push(whereInputRegex("select")) if canPushdown(cursorCol) else selectByIdx(searchInputRegex("select", columns="cursorCol"))', 'select rows matching regex in current column (with sqlite_pushdown, open sheet of them instead)')
+SqliteSheet.addCommand('\\', 'unselect-col-regex', 'vd.push(whereInputRegex("unselect", unselect=True)) if canPushdown(cursorCol) else unselectByIdx(searchInputRegex("unselect", columns="cursorCol"))', 'unselect rows matching regex in current column (with sqlite_pushdown, open sheet of the other rows instead)')
+SqliteSheet.addCommand('F', 'freq-col', 'vd.push(freqSql(cursorCol) if canPushdown(cursorCol) else makeFreqTable(sheet, cursorCol))', 'open Frequency Table grouped on current column (with sqlite_pushdown, counted in SQL)')
+SqliteSheet.addCommand('gF', 'freq-keys', '(vd.push(freqSql(*keyCols) if canPushdown(*keyCols) else makeFreqTable(sheet, *keyCols))) if keyCols else vd.fail("there are no key columns to group by")', 'open Frequency Table grouped by all key columns on source sheet (with sqlite_pushdown, counted in SQL)')
 SqliteSheet.addCommand('', 'exec-sql', 'vd.push(rawSql(input("execute SQL: ", type="sql")))', 'execute raw SQL statement')
 
 SqliteIndexSheet.addCommand('a', 'add-table', 'fail("create a new table by saving a sheet to this database file")', 'stub; add table by saving a sheet to the db file instead')
@@ -308,3 +540,190 @@ vd.addGlobals({
     'SqliteIndexSheet': SqliteIndexSheet,
     'SqliteSheet': SqliteSheet,
 })
+
+
+def test_save_sqlite(vd):
+    import os
+    import sqlite3
+    import tempfile
+    from visidata import ItemColumn, Path
+
+    vs = Sheet('nums', rows=[[i, i*i, [i]] for i in range(2500)] + [['x', None, None]])
+    vs.addColumn(ItemColumn('n', 0, type=int))
+    vs.addColumn(ItemColumn('sq', 1, type=int))
+    vs.addColumn(ItemColumn('l', 2))
+    vs.setKeys(vs.columns[:1])
+    vd.clearCaches()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        p = Path(os.path.join(tmpdir, 'nums.sqlite'))
+        vd.options.sqlite_save_index = True
+        vd.options.sqlite_save_journal_mode = 'MEMORY'
+        vd.options.sqlite_save_synchronous = 'OFF'
+        try:
+            vd.save_sqlite(p, vs)
+        finally:
+            vd.options.unset('sqlite_save_index')
+            vd.options.unset('sqlite_save_journal_mode')
+            vd.options.unset('sqlite_save_synchronous')
+
+        conn = sqlite3.connect(str(p))
+        assert conn.execute('SELECT COUNT(*), SUM(sq) FROM nums').fetchone() == (2501, sum(i*i for i in range(2500)))
+        assert conn.execute('SELECT * FROM nums WHERE n=7').fetchone() == (7, 49, '[7]')
+        assert conn.execute('SELECT * FROM nums WHERE sq IS NULL').fetchone() == (vd.options.safe_error, None, None)
+        assert conn.execute('SELECT name FROM sqlite_master WHERE type="index"').fetchone() == ('nums_keys',)
+        assert conn.execute('PRAGMA journal_mode').fetchone() == ('delete',)
+
+        idx = vd.openSource(p)
+        idx.ensureLoaded()
+        vd.sync()
+        tbl = idx.getSheet('nums')
+        tbl.ensureLoaded()
+        vd.sync()
+        tbl.column('sq').setValues(tbl.rows[:1000], 0)
+        vd.sync()
+        tbl.deleteBy(lambda r: r[1] in range(10))  # rowid, n, sq, l
+        tbl.putChanges()
+        vd.sync()
+        assert conn.execute('SELECT COUNT(*), SUM(sq) FROM nums').fetchone() == (2491, sum(i*i for i in range(1000, 2500)))
+        conn.close()
+
+
+def test_sqlite_pushdown(vd):
+    import os
+    import tempfile
+    from visidata import ItemColumn, Path
+
+    vs = Sheet('nums', rows=[[i, i%7, 'x%d' % i] for i in range(1000)])
+    vs.addColumn(ItemColumn('n', 0, type=int))
+    vs.addColumn(ItemColumn('mod', 1, type=int))
+    vs.addColumn(ItemColumn('s', 2))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        p = Path(os.path.join(tmpdir, 'nums.sqlite'))
+        vd.save_sqlite(p, vs)
+
+        idx = vd.openSource(p)
+        idx.ensureLoaded()
+        vd.sync()
+        tbl = idx.getSheet('nums')
+        tbl.ensureLoaded()
+        vd.sync()
+
+        vd.options.sqlite_pushdown = True
+        try:
+            where = tbl.whereEqual(tbl.column('mod'), tbl.rows[3])
+            where.ensureLoaded()
+            vd.sync()
+            assert [r[1] for r in where.rows] == list(range(3, 1000, 7))
+
+            where.orderBy(None, where.column('n'), reverse=True)
+            assert vd.activeSheet.name == 'nums_where_sorted'
+            vd.activeSheet.ensureLoaded()
+            vd.sync()
+            assert [r[1] for r in vd.activeSheet.rows] == list(range(997, 0, -7))
+            assert ' WHERE ' in vd.activeSheet.query and ' ORDER BY "n" DESC' in vd.activeSheet.query
+
+            regex = tbl.pushdown('regex', where=[('vd_regexp(?, ?, "s")', ['X.99$', 'I'])])
+            regex.ensureLoaded()
+            vd.sync()
+            assert [r[3] for r in regex.rows] == ['x199', 'x299', 'x399', 'x499', 'x599', 'x699', 'x799', 'x899', 'x999']
+
+            freq = where.freqSql(where.column('mod'))
+            freq.ensureLoaded()
+            vd.sync()
+            assert freq.rows == [(3, 143)]
+        finally:
+            vd.options.unset('sqlite_pushdown')
+
+
+def test_sqlite_window(vd):
+    import os
+    import tempfile
+    import pytest
+    from visidata import ItemColumn, ExprColumn, ExpectedException, Path
+
+    vs = Sheet('nums', rows=[[i, 'x%d' % i] for i in range(1000)])
+    vs.addColumn(ItemColumn('n', 0, type=int))
+    vs.addColumn(ItemColumn('s', 1))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        p = Path(os.path.join(tmpdir, 'nums.sqlite'))
+        vd.save_sqlite(p, vs)
+
+        vd.options.sqlite_window = True
+        vd.options.window_page_rows = 100
+        vd.options.window_max_pages = 3
+        try:
+            idx = vd.openSource(p)
+            idx.ensureLoaded()
+            vd.sync()
+            tbl = idx.getSheet('nums')
+            tbl.ensureLoaded()
+            vd.sync()
+
+            assert isinstance(tbl.rows, KeysetRows)
+            assert len(tbl.rows) == 1000
+            assert tbl.rows[567] == (568, 567, 'x567')
+            assert tbl.rows[-1] == (1000, 999, 'x999')
+            assert tbl.rows[98:102] == [(99, 98, 'x98'), (100, 99, 'x99'), (101, 100, 'x100'), (102, 101, 'x101')]
+            assert [r[1] for r in tbl.rows] == list(range(1000))
+            assert len(tbl.rows._pages) <= 3
+
+            row = tbl.rows[5]
+            tbl.column('s').setValue(row, 'five')
+            tbl.rows[900]  # evict the page with row 5
+            assert tbl.column('s').getValue(tbl.rows[5]) == 'five'
+            tbl.putChanges()
+            vd.sync()
+            assert tbl.rows[5] == (6, 5, 'five')
+
+            # sort is done in SQL, into a new windowed sheet paged by the sort columns and rowid
+            tbl.orderBy(None, tbl.column('n'), reverse=True)
+            assert vd.activeSheet.name == 'nums_sorted'
+            vd.activeSheet.ensureLoaded()
+            vd.sync()
+            assert isinstance(vd.activeSheet.rows, KeysetRows)
+            assert vd.activeSheet.rows[-1][1] == 0
+            assert [r[1] for r in vd.activeSheet.rows] == list(range(999, -1, -1))
+            with pytest.raises(ExpectedException):
+                tbl.orderBy(None, tbl.addColumn(ExprColumn('n2', 'n*2')))
+
+            with pytest.raises(ExpectedException):
+                tbl.addRows([tbl.newRow()], index=0)
+            with pytest.raises(ExpectedException):
+                tbl.addRow((0, -1, 'x-1'), index=0)  # as by paste
+            assert len(tbl.rows) == 1000
+
+            vd.options.sqlite_pushdown = True
+            where = tbl.pushdown('odd', where=[('n % 2 = 1', [])])
+            where.ensureLoaded()
+            vd.sync()
+            assert len(where.rows) == 500
+            assert where.rows[499] == (1000, 999, 'x999')
+
+            # nulls and duplicate values in the sort columns
+            dups = Sheet('dups', rows=[[None if i % 7 == 0 else i % 5, None if i % 3 == 0 else 'x%d' % (i % 4)] for i in range(450)])
+            dups.addColumn(ItemColumn('a', 0, type=int))
+            dups.addColumn(ItemColumn('b', 1))
+            p2 = Path(os.path.join(tmpdir, 'dups.sqlite'))
+            vd.save_sqlite(p2, dups)
+            idx = vd.openSource(p2)
+            idx.ensureLoaded()
+            vd.sync()
+            tbl = idx.getSheet('dups')
+            tbl.ensureLoaded()
+            vd.sync()
+            nullsfirst = lambda v: (v is not None, v)
+            for rev_a, rev_b in [(False, False), (True, False), (False, True), (True, True)]:
+                tbl.orderBy(None, tbl.column('a'), reverse=rev_a)
+                vd.activeSheet.orderBy(tbl.column('b'), reverse=rev_b)
+                sorted_ = vd.activeSheet
+                sorted_.ensureLoaded()
+                vd.sync()
+                assert isinstance(sorted_.rows, KeysetRows)
+                expected = sorted(tbl.rows, key=lambda r: r[0])  # ties by rowid
+                expected.sort(key=lambda r: nullsfirst(r[2]), reverse=rev_b)
+                expected.sort(key=lambda r: nullsfirst(r[1]), reverse=rev_a)
+                assert list(sorted_.rows) == expected, (rev_a, rev_b)
+                assert sorted_.rows[449] == expected[449] and sorted_.rows[120:130] == expected[120:130]
+        finally:
+            for opt in 'sqlite_window window_page_rows window_max_pages sqlite_pushdown'.split():
+                vd.options.unset(opt)
@@ -1,17 +1,22 @@
 import os
+import codecs
 import contextlib
 import itertools
 import collections
 import math
+import mmap
+import threading
 import time
+from array import array
 
-from visidata import vd, asyncthread, options, Progress, ColumnItem, SequenceSheet, Sheet, VisiData
-from visidata import namedlist, filesize
+from visidata import vd, asyncthread, options, Progress, ColumnItem, SequenceSheet, Sheet, VisiData, Path
+from visidata import namedlist, filesize, ascii_compatible_encodings
 
 vd.option('delimiter', '\t', 'field delimiter to use for tsv/usv filetype', replay=True)
 vd.option('row_delimiter', '\n', 'row delimiter to use for tsv/usv filetype', replay=True)
 vd.option('tsv_safe_newline', '\u001e', 'replacement for newline character when saving to tsv', replay=True)
 vd.option('tsv_safe_tab', '\u001f', 'replacement for tab character when saving to tsv', replay=True)
+vd.option('tsv_mmap', False, 'index local tsv files with a memory map, reading and splitting fields only for rows that are accessed', replay=True)
 
 
 @VisiData.api
@@ -67,12 +72,159 @@ def splitter(stream, delim='\n'):
         yield from buf.rstrip(delim).split(delim)
 
 
+def _delimEncoding(encoding):
+    'Return *encoding* without any BOM handling, for encoding delimiters and decoding individual rows.'
+    return 'utf-8' if codecs.lookup(encoding).name == 'utf-8-sig' else encoding
+
+
+class TsvLineIndex:
+    '''Byte offsets of each row in a tsv file, found with a memory map *mm* of the file while it is loaded.
+       After loading, rows are read from the open file *fp* with os.pread, not from the map: a read from a map of a file that has since been truncated crashes the process with SIGBUS, but a short read can be caught.'''
+    checkSeconds = 1.0  # the file is checked for changes at most this often
+    def __init__(self, fp, mm, delim:bytes, rowdelim:bytes, encoding, errors, path=None, filestat=None):
+        self.fp = fp
+        self.mm = mm    # None after loading
+        self._lock = threading.Lock()  # for seek and read, without os.pread
+        self.path = path
+        self.filestat = filestat  # (size, mtime_ns) of file when mapped
+        self.lastcheck = time.monotonic()
+        self.delim = delim
+        self.rowdelim = rowdelim
+        self.encoding = encoding
+        self.errors = errors
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.fieldnames = []  # column names, for attribute access on rows
+        self.maxfields = 0    # most fields in any row
+        self.cached = False   # True if starts/ends/maxfields were loaded from sidecar cache
+
+    def iterlines(self, pos=0):
+        'Generate line number of each nonempty row, indexing as needed.'
+        mm, rowdelim = self.mm, self.rowdelim
+        n = len(mm)
+        with Progress(gerund='indexing', total=n) as prog:
+            while pos < n:
+                end = mm.find(rowdelim, pos)
+                if end < 0:
+                    end = n
+                if end > pos:
+                    self.starts.append(pos)
+                    self.ends.append(end)
+                    yield len(self.starts)-1
+                prog.addProgress(end+len(rowdelim)-pos)
+                pos = end+len(rowdelim)
+
+    def loaded(self):
+        'Close the map; rows are read from the file from now on.'
+        self.mm.close()
+        self.mm = None
+
+    def close(self):
+        self.fp.close()
+
+    def checkFile(self):
+        '''Raise if the file was rewritten since it was loaded.
+           The file is stat'ed at most once every checkSeconds, so that scanning a column does not stat it for every row; a truncation within that time is found by the short read.'''
+        if self.fp.closed:
+            raise ValueError(f'{self.path} changed since it was loaded')
+        if self.path:
+            now = time.monotonic()
+            if now - self.lastcheck < self.checkSeconds:
+                return
+            self.lastcheck = now
+            st = os.stat(self.path)
+            if (st.st_size, st.st_mtime_ns) != self.filestat:
+                self.close()
+                raise ValueError(f'{self.path} changed since it was loaded')
+
+    def read(self, pos, n) -> bytes:
+        'Return *n* bytes of the file at offset *pos*, or fewer at the end of the file.'
+        if hasattr(os, 'pread'):
+            return os.pread(self.fp.fileno(), n, pos)
+        with self._lock:
+            self.fp.seek(pos)
+            return self.fp.read(n)
+
+    def line(self, linenum, check=True) -> bytes:
+        start, end = self.starts[linenum], self.ends[linenum]
+        if self.mm is not None:  # still loading
+            return self.mm[start:end]
+        if check:
+            self.checkFile()
+        ret = self.read(start, end-start)
+        if len(ret) < end-start:
+            self.close()
+            raise ValueError(f'{self.path} changed since it was loaded')
+        return ret
+
+    def nfields(self, linenum, check=True):
+        return self.line(linenum, check).count(self.delim)+1
+
+    def split(self, linenum):
+        line = self.line(linenum)
+        if self.rowdelim == b'\n' and line.endswith(b'\r'):
+            line = line[:-1]  # text mode would have translated CRLF
+        return line.decode(self.encoding, self.errors).split(self.delim.decode(self.encoding))
+
+
+class LazyTsvRow:
+    'Row in a memory-mapped tsv file.  Values are decoded and split on first access.'
+    __slots__ = ('_index', '_linenum', '_values')
+
+    def __init__(self, index, linenum):
+        self._index = index
+        self._linenum = linenum
+        self._values = None
+
+    def values(self):
+        if self._values is None:
+            self._values = self._index.split(self._linenum)
+        return self._values
+
+    def __len__(self):
+        if self._values is None:
+            return self._index.nfields(self._linenum)
+        return len(self._values)
+
+    def __getitem__(self, k):
+        return self.values()[k]
+
+    def __setitem__(self, k, v):
+        values = self.values()
+        if isinstance(k, int) and k >= len(values):
+            values.extend([None]*(k-len(values)+1))
+        values[k] = v
+
+    def __getattr__(self, k):
+        'to enable .fieldname'
+        try:
+            return self[self._index.fieldnames.index(k)]
+        except (ValueError, IndexError) as e:
+            raise AttributeError(k) from e
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __repr__(self):
+        return repr(self.values())
+
+    def __copy__(self):
+        return list(self.values())
+
+    def __deepcopy__(self, memo):
+        return list(self.values())
+
+    def __reduce__(self):
+        return (list, (list(self.values()),))
+
+
 # rowdef: list
 class TsvSheet(SequenceSheet):
     delimiter = ''
     row_delimiter = ''
 
     def iterload(self):
+        # the map of a previous load stays open while any of its rows are still referenced, like by derived sheets
         delim = self.delimiter or self.options.delimiter
         rowdelim = self.row_delimiter or self.options.row_delimiter
         if delim == '':
@@ -86,6 +238,10 @@ class TsvSheet(SequenceSheet):
         if delim == rowdelim:
             vd.fail('field delimiter and row delimiter cannot be the same')
 
+        if self.options.tsv_mmap and self.canMmap(delim, rowdelim):
+            yield from self.iterload_mmap(delim, rowdelim)
+            return
+
         with self.open_text_source() as fp:
                 regex_skip = getattr(fp, '_regex_skip', None)
                 for line in splitter(adaptive_bufferer(fp), rowdelim):
@@ -100,6 +256,76 @@ class TsvSheet(SequenceSheet):
 
                     yield row
 
+    def canMmap(self, delim, rowdelim):
+        'Return True if source is a local uncompressed file whose rows can be found without decoding.'
+        p = self.source
+        if not isinstance(p, Path) or not p.is_local() or not p.is_file() or p.compression or not filesize(p):
+            return False
+        if self.options.regex_skip:
+            return False
+        if codecs.lookup(self.options.encoding).name not in ascii_compatible_encodings:
+            return False
+        return all(len(d.encode(_delimEncoding(self.options.encoding))) == len(d) for d in (delim, rowdelim))
+
+    def iterload_mmap(self, delim, rowdelim):
+        fp = open(self.source, 'rb')
+        st = os.fstat(fp.fileno())
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        enc = self.options.encoding
+        delimenc = _delimEncoding(enc)
+        index = TsvLineIndex(fp, mm, delim.encode(delimenc), rowdelim.encode(delimenc), delimenc, self.options.encoding_errors,
+                             path=str(self.source), filestat=(st.st_size, st.st_mtime_ns))
+        try:
+            yield from self.iterindex(index)
+        finally:
+            index.loaded()
+
+    def iterindex(self, index):
+        'Generate a LazyTsvRow for each row in *index*, indexing the file if its offsets are not cached.'
+        mm = index.mm
+        start = 0
+        if codecs.lookup(self.options.encoding).name == 'utf-8-sig' and mm[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+            start = len(codecs.BOM_UTF8)
+
+        sc = self.sidecar()
+        cached = sc.loadIndex() if sc else None
+        if cached:
+            index.starts, index.ends = cached
+            index.maxfields = sc.get('maxfields', 0)
+            index.cached = True
+            for linenum in range(len(index.starts)):
+                yield LazyTsvRow(index, linenum)
+            return
+
+        for linenum in index.iterlines(start):
+            yield LazyTsvRow(index, linenum)
+
+        if sc:
+            sc.set('maxfields', index.maxfields)
+            sc.saveIndex(index.starts, index.ends)
+            sc.save()
+
+    def addRow(self, row, index=None):
+        if not isinstance(row, LazyTsvRow):
+            return super().addRow(row, index=index)
+
+        # only count fields, to keep the row unsplit until it is accessed
+        rowidx = row._index
+        if rowidx.cached:
+            nfields = rowidx.maxfields
+        else:
+            nfields = rowidx.nfields(row._linenum, check=False)  # file was just mapped
+            if nfields > rowidx.maxfields:
+                rowidx.maxfields = nfields
+
+        for i in range(len(self.columns), nfields):
+            self.addColumn(ColumnItem('', i))
+            self._rowtype = namedlist('tsvobj', [(c.name or '_') for c in self.columns])
+        if rowidx.fieldnames is not self._rowtype._fields:
+            rowidx.fieldnames = self._rowtype._fields
+        return Sheet.addRow(self, row, index=index)
+
 
 @VisiData.api
 def save_tsv(vd, p, vs, delimiter='', row_delimiter=''):
@@ -120,9 +346,8 @@ def save_tsv(vd, p, vs, delimiter='', row_delimiter=''):
         colhdr = unitsep.join(col.name.translate(trdict) for col in vs.visibleCols) + rowsep
         fp.write(colhdr)
 
-        for dispvals in vs.iterdispvals(format=True):
-            fp.write(unitsep.join(dispvals.values()))
-            fp.write(rowsep)
+        for chunk in vs.iterdispvalChunks(format=True):
+            fp.write(''.join([unitsep.join(dispvals) + rowsep for dispvals in chunk]))
 
 
 @Sheet.api
@@ -158,3 +383,71 @@ def append_tsv_row(vs, row):
 vd.addGlobals({
     'TsvSheet': TsvSheet,
 })
+
+
+def test_tsv_mmap(vd):
+    import visidata
+    vd.options.tsv_mmap = True
+    try:
+        vs = vd.openSource(Path(str(vd.pkg_resources_files(visidata) / 'tests/sample.tsv')))
+        vd.sync(vs.ensureLoaded())
+    finally:
+        vd.options.tsv_mmap = False
+
+    assert isinstance(vs.rows[0], LazyTsvRow)
+    assert vs.nRows == 43
+    assert all(r._values is None for r in vs.rows)
+    assert vs.rows[0].Rep == 'Jones'
+    assert [c.getValue(vs.rows[-1]) for c in vs.columns] == '2017-12-21 Central Andrews Binder 28 4.99 139.72'.split()
+
+    vs.columns[1].setValue(vs.rows[0], 'West')
+    assert vs.rows[0][1] == 'West'
+
+
+def test_tsv_mmap_changed(vd):
+    import tempfile
+    import pathlib
+    tmpdir = tempfile.TemporaryDirectory()
+    p = pathlib.Path(tmpdir.name) / 'changed.tsv'
+    p.write_text('a\tb\n1\t2\n3\t4\n')
+    vd.options.tsv_mmap = True
+    checkSeconds = TsvLineIndex.checkSeconds
+    TsvLineIndex.checkSeconds = 0  # check the file before every read
+    try:
+        vs = TsvSheet('changed', source=Path(str(p)))
+        vs.reload()
+        vd.sync()
+        oldrow = vs.rows[1]
+        assert vs.columns[1].getValue(vs.rows[0]) == '2'
+
+        vs.reload()  # rows still held from the previous load, like by derived sheets, can still be read
+        vd.sync()
+        assert oldrow[1] == '4' and vs.rows[1] is not oldrow
+
+        oldrow = vs.rows[1]
+        p.write_text('a\n')  # truncated in place
+        try:
+            oldrow[0]
+            assert False, 'read from changed file'
+        except ValueError:
+            pass
+
+        vs.reload()
+        vd.sync()
+        assert vs.nRows == 0 and oldrow._index.fp.closed
+
+        TsvLineIndex.checkSeconds = 3600  # truncation between checks: the read is short, instead of SIGBUS from a map
+        p.write_text('a\tb\n1\t2\n3\t4\n')
+        vs.reload()
+        vd.sync()
+        oldrow = vs.rows[1]
+        p.write_text('a\n')
+        try:
+            oldrow[0]
+            assert False, 'read from truncated file'
+        except ValueError:
+            pass
+    finally:
+        vd.options.tsv_mmap = False
+        TsvLineIndex.checkSeconds = checkSeconds
+        tmpdir.cleanup()
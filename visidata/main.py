@@ -367,7 +367,7 @@ def main_vd():
         outpath = Path(args.output or '-')
         vd.saveSheets(outpath, vd.activeSheet, confirm_overwrite=False)
 
-    saver_threads = [t for t in vd.unfinishedThreads if t.name.startswith('save_')]
+    saver_threads = [t for t in vd.unfinishedThreads if t.name.startswith('save')]  # save_* savers, saveAtomic, saveFiles, saveSheet
     if saver_threads:
         vd.printout('finishing %d savers' % len(saver_threads))
         vd.sync(*saver_threads)
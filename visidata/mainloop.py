@@ -328,7 +328,7 @@ def run(vd, *sheetlist):
         if scr:
             curses.endwin()
 
-    vd.cancelThread(*[t for t in vd.unfinishedThreads if not t.name.startswith('save_')])
+    vd.cancelThread(*[t for t in vd.unfinishedThreads if not t.name.startswith('save')])
 
     if ret:
         builtins.print(ret)
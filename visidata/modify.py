@@ -176,6 +176,7 @@ def deleteBy(sheet, func, commit=False, undo=True):
         sheet.setModified()
 
     if ndeleted:
+        sheet.clearSearchCaches()  # rowids of deleted rows may be reused by new rows
         vd.status('deleted %s %s' % (ndeleted, sheet.rowtype))
 
     return ndeleted
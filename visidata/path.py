@@ -36,6 +36,9 @@ See [:onclick https://docs.python.org/3/library/codecs.html#error-handlers]https
 vd.option('encoding', 'utf-8-sig', 'encoding passed to codecs.open when reading a file', replay=True, help=vd.help_encoding)
 vd.option('encoding_errors', 'surrogateescape', 'encoding_errors passed to codecs.open', replay=True, help=vd.help_encoding_errors)
 
+# encodings in which ASCII delimiters and quotes can never appear inside another character
+ascii_compatible_encodings = ('utf-8', 'utf-8-sig', 'ascii', 'iso8859-1', 'cp1252')
+
 @VisiData.api
 def pkg_resources_files(vd, package):
     '''
@@ -510,4 +513,5 @@ vd.addGlobals(RepeatFile=RepeatFile,
               Path=Path,
               modtime=modtime,
               filesize=filesize,
-              vstat=vstat)
+              vstat=vstat,
+              ascii_compatible_encodings=ascii_compatible_encodings)
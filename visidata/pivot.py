@@ -1,15 +1,86 @@
 import collections
+import threading
 from copy import copy
-from visidata import ScopedSetattr, Column, Sheet, asyncthread, Progress, forward, wrapply, INPROGRESS
-from visidata import vlen, vd, date, setitem, anytype
+from operator import itemgetter
+from visidata import ScopedSetattr, Column, ItemColumn, Sheet, asyncthread, Progress, forward, wrapply, INPROGRESS
+from visidata import vlen, vd, VisiData, date, setitem, anytype, getitemdeep
 import visidata
 
 
+vd.option('group_workers', 0, 'number of worker processes for grouping rows of large frequency tables in parallel (0 or 1 to group serially)', replay=True)
+vd.option('group_lazy_rows', False, 'keep only the number of source rows in each group of a frequency table whose aggregates are all accumulated; the rows are found again in the source, as it is then, to open or select them', replay=True)
+
+Sheet.init('nValueChanges', int)  # number of cells changed by setValue, to tell when aggregates accumulated from the rows are stale
+
+
+@Column.after
+def setValue(col, row, val, setModified=True):
+    col.sheet.nValueChanges += 1
+
+
 # discrete_keys = tuple of formatted discrete keys that group the row
 # numeric_key is a range
-# sourcerows is list(all source.rows in group)
+# sourcerows is list(all source.rows in group), or LazySourceRows if only accumulated aggregators are used and options.group_lazy_rows is set
 # pivotrows is { pivot_values: list(source.rows in group with pivot_values) }
-PivotGroupRow = collections.namedtuple('PivotGroupRow', 'discrete_keys numeric_key sourcerows pivotrows'.split())
+# aggstate is { (aggcol,) or (aggcol, pivot_value): { aggregator: Accumulator } }, filled while grouping; stale once the source has been edited, or aggcol changed (see aggSignature)
+PivotGroupRow = collections.namedtuple('PivotGroupRow', 'discrete_keys numeric_key sourcerows pivotrows aggstate'.split(), defaults=[None])
+
+class LazySourceRows(collections.abc.Sequence):
+    '''Source rows in one group of a PivotSheet, when they are not kept while grouping because every aggregate is accumulated.
+       Only the number of rows is known, until the rows themselves are needed (like to select or open them).
+       Then the source rows are grouped again, to find the rows of all groups at once.'''
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.n = 0
+        self._rows = None
+
+    @property
+    def rows(self) -> list:
+        if self._rows is None:
+            self.sheet.findSourceRows()
+            if self._rows is None:  # not a group of the sheet as last grouped
+                self._rows = []
+        return self._rows
+
+    def __len__(self):
+        return self.n if self._rows is None else len(self._rows)
+
+    def __getitem__(self, i):
+        return self.rows[i]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __copy__(self):
+        return list(self.rows)
+
+
+def aggSignature(col):
+    'Return what the aggregated values of *col* depend on besides its cells; aggregates accumulated while grouping are stale once this changes.'
+    return (col.type, getattr(col, 'expr', None), col.aggstr)
+
+
+def _rawValues(rows, expr) -> list:
+    'Return list of the raw value at *expr* in each of *rows*, as getitemdeep (None if missing).'
+    if not isinstance(expr, str) or '.' not in expr:
+        try:
+            return list(map(itemgetter(expr), rows))
+        except Exception:  # missing in some rows
+            pass
+    return [getitemdeep(row, expr, None) for row in rows]
+
+
+def _group_chunk(keycols, start):
+    'Return dict of [tuple of raw key values] -> list of indexes of rows with those values, counting from *start*, given *keycols*, a list of raw values for each key column.  Run in worker process.'
+    groups = {}
+    for i, k in enumerate(zip(*keycols), start):
+        idxs = groups.get(k)
+        if idxs is None:
+            groups[k] = [i]
+        else:
+            idxs.append(i)
+    return groups
+
 
 def makePivot(source, groupByCols, pivotCols):
     return PivotSheet('',
@@ -53,7 +124,7 @@ class AggrColumn(Column):
     def calcValue(col, row):
         if col.sheet.loading:
             return visidata.INPROGRESS
-        return col.aggregator.aggregate(col.origCol, row.sourcerows)
+        return col.sheet.aggregateGroup(row, col.origCol, col.aggregator)
 
 
 def makeAggrColumn(aggcol, aggregator):
@@ -69,6 +140,11 @@ def makeAggrColumn(aggcol, aggregator):
 class PivotSheet(Sheet):
     'Summarize key columns in pivot table and display as new sheet.'
     rowtype = 'grouped rows'  # rowdef: PivotGroupRow
+    groupChunkRows = 10000  # minimum number of source rows sent to each worker process at a time
+    groupedValueChanges = 0  # source.nValueChanges when the rows were grouped
+    groupedNRows = 0  # source.nRows when the rows were grouped
+    groupedSignatures = {}  # [aggcol] -> aggSignature(aggcol) when the rows were grouped
+    _lazyGroups = None  # [formattedDiscreteKeys] -> PivotGroupRow with LazySourceRows; None if source rows are kept while grouping
 
     def __init__(self, *names, groupByCols=[], pivotCols=[], **kwargs):
         super().__init__(*names,
@@ -119,10 +195,9 @@ class PivotSheet(Sheet):
         vd.sync(self.addAggregateCols(),
                 self.groupRows())
 
-    @asyncthread
-    def addAggregateCols(self):
-        # add aggregated columns
-        aggcols = {  # [Column] -> list(aggregators)
+    def aggregatedCols(self):
+        'Return dict of [source Column] -> list(aggregators) to add as columns.'
+        return {
             sourcecol: sourcecol.aggregators
                 for sourcecol in self.source.visibleCols
                     if sourcecol.aggregators
@@ -131,6 +206,22 @@ class PivotSheet(Sheet):
                 for sourcecol in self.pivotCols
         }
 
+    def aggregateGroup(self, row, aggcol, aggregator, *pivotvalue):
+        '''Return result of *aggregator* over values of *aggcol* in the source rows grouped in *row*, or only those with *pivotvalue* if given.
+           Use the accumulated result from grouping if available and the source has not been edited since; otherwise aggregate the source rows.'''
+        accs = None
+        if row.aggstate and self.groupedValueChanges == self.source.nValueChanges and self.groupedSignatures.get(aggcol) == aggSignature(aggcol):
+            accs = row.aggstate.get((aggcol, *pivotvalue))
+        if accs and aggregator in accs:
+            return accs[aggregator].value()
+        rows = row.pivotrows.get(pivotvalue[0], []) if pivotvalue else row.sourcerows
+        return aggregator.aggregate(aggcol, rows)
+
+    @asyncthread
+    def addAggregateCols(self):
+        # add aggregated columns
+        aggcols = self.aggregatedCols()  # [Column] -> list(aggregators)
+
         if not aggcols:
 #            self.addColumn(ColumnAttr('count', 'sourcerows', type=vlen))
             return
@@ -175,7 +266,7 @@ class PivotSheet(Sheet):
                         c = Column(colname,
                                     type=aggregator.type or aggcol.type,
                                     aggvalue=value,
-                                    getter=lambda col,row,aggcol=aggcol,agg=aggregator: agg.aggregate(aggcol, row.pivotrows.get(col.aggvalue, [])))
+                                    getter=lambda col,row,aggcol=aggcol,agg=aggregator: col.sheet.aggregateGroup(row, aggcol, agg, col.aggvalue))
                         self.addColumn(c)
 
 #                    if aggregator.name != 'count':  # already have count above
@@ -188,6 +279,9 @@ class PivotSheet(Sheet):
     def groupRows(self, rowfunc=None):
       with ScopedSetattr(self, 'loading', True):
         self.rows = []
+        self.groupedValueChanges = self.source.nValueChanges
+        self.groupedNRows = self.source.nRows
+        self.groupedSignatures = {aggcol: aggSignature(aggcol) for aggcol in self.aggregatedCols()}
 
         discreteCols = [c for c in self.groupByCols if not self.isNumericRange(c)]
 
@@ -219,6 +313,21 @@ class PivotSheet(Sheet):
             else:
                 numericBins = [(minval+width*i, minval+width*(i+1)) for i in range(nbins)]
 
+        # aggregators which can be computed while grouping, in one pass over the values of each aggregated column
+        accumulated = []  # list of (aggcol, isNull, list(aggregators))
+        for aggcol, aggregators in self.aggregatedCols().items():
+            aggregators = [agg for agg in aggregators if agg.accumulator]
+            if aggregators:
+                accumulated.append((aggcol, aggcol.sheet.isNullFunc(), aggregators))
+
+        # keep only the number of source rows in each group, if no aggregate needs the rows themselves
+        aggregators = [agg for aggs in self.aggregatedCols().values() for agg in aggs]
+        lazy = self.options.group_lazy_rows and not self.pivotCols and not numericCols and all(agg.accumulator for agg in aggregators)
+        self._lazyGroups = {} if lazy else None
+
+        if self.canGroupParallel(discreteCols, numericCols) and self.groupRowsParallel(discreteCols, accumulated, rowfunc):
+            return
+
         # group rows by their keys (groupByCols), and separate by their pivot values (pivotCols)
         groups = {}  # [formattedDiscreteKeys] -> (numericGroupRows:dict(formattedNumericKeyRange -> PivotGroupRow), groupRow:PivotGroupRow)  # groupRow is main/error row
 
@@ -231,7 +340,7 @@ class PivotSheet(Sheet):
             numericGroupRows, groupRow = groups.get(formattedDiscreteKeys, (None, None))
             if numericGroupRows is None:
                 # add new group rows
-                numericGroupRows = {formatRange(numericCols[0], numRange): PivotGroupRow(discreteKeys, numRange, [], {}) for numRange in numericBins}
+                numericGroupRows = {formatRange(numericCols[0], numRange): PivotGroupRow(discreteKeys, numRange, [], {}, {}) for numRange in numericBins}
                 groups[formattedDiscreteKeys] = (numericGroupRows, None)
                 for r in numericGroupRows.values():
                     self.addRow(r)
@@ -258,27 +367,161 @@ class PivotSheet(Sheet):
             # add the main bin if no numeric bin (error, or no numeric cols)
             if groupRow is None:
                 if numericCols:
-                    groupRow = PivotGroupRow(discreteKeys, val, [], {})
+                    groupRow = PivotGroupRow(discreteKeys, val, [], {}, {})
                     numericGroupRows[str(val)] = groupRow
                 else:
-                    groupRow = PivotGroupRow(discreteKeys, (0, 0), [], {})
+                    groupRow = PivotGroupRow(discreteKeys, (0, 0), self.newSourceRows(), {}, {})
                     groups[formattedDiscreteKeys] = (numericGroupRows, groupRow)
+                    if lazy:
+                        self._lazyGroups[formattedDiscreteKeys] = groupRow
                 self.addRow(groupRow)
 
             # add the sourcerow to its all bin
-            groupRow.sourcerows.append(sourcerow)
+            if lazy:
+                groupRow.sourcerows.n += 1
+            else:
+                groupRow.sourcerows.append(sourcerow)
 
             # separate by pivot value
+            varvals = []
             for col in self.pivotCols:
                 varval = col.getTypedValue(sourcerow)
+                varvals.append(varval)
                 matchingRows = groupRow.pivotrows.get(varval)
                 if matchingRows is None:
                     matchingRows = groupRow.pivotrows[varval] = []
                 matchingRows.append(sourcerow)
 
+            for aggcol, isNull, aggregators in accumulated:
+                self.accumulate(groupRow.aggstate, aggcol, isNull, aggregators, sourcerow, varvals)
+
+            if rowfunc:
+                rowfunc(groupRow)
+
+    def canGroupParallel(self, discreteCols, numericCols):
+        'Return True if rows can be grouped by *discreteCols* in worker processes: plain item columns only, with no pivot or numeric binning.'
+        if self.options.group_workers <= 1 or self.pivotCols or numericCols:
+            return False
+        if not isinstance(self.source.rows, list) or len(self.source.rows) < 2*self.groupChunkRows:
+            return False
+        return all(type(c) is ItemColumn and not c.defer for c in discreteCols)
+
+    def groupRowsParallel(self, discreteCols, accumulated, rowfunc=None) -> bool:
+        '''Group source rows by the raw values of *discreteCols* in worker processes, in chunks of rows.
+           Then type and format the key of only the first row of each distinct raw key, to merge them into groups in the main process.
+           Return False if the rows could not be grouped (like unhashable or unpicklable values).'''
+        rows = self.source.rows
+        nworkers = self.options.group_workers
+        chunksize = max(self.groupChunkRows, -(-len(rows)//(nworkers*4)))
+        exprs = [c.expr for c in discreteCols]
+
+        groups = {}   # [formattedDiscreteKeys] -> PivotGroupRow
+        rawkeys = {}  # [raw key values] -> PivotGroupRow
+        groupidxs = collections.defaultdict(list)  # [id(PivotGroupRow)] -> list of indexes into rows
+        merged = set()  # id(PivotGroupRow) with rows from more than one raw key
+
+        def _mergeChunk(chunkgroups):
+            for k, idxs in chunkgroups.items():
+                groupRow = rawkeys.get(k)
+                if groupRow is None:
+                    sourcerow = rows[idxs[0]]
+                    discreteKeys = list(forward(origcol.getTypedValue(sourcerow)) for origcol in discreteCols)
+                    formattedDiscreteKeys = tuple(wrapply(c.format, v) for v, c in zip(discreteKeys, discreteCols))
+                    groupRow = groups.get(formattedDiscreteKeys)
+                    if groupRow is None:
+                        groupRow = groups[formattedDiscreteKeys] = PivotGroupRow(discreteKeys, (0, 0), self.newSourceRows(), {}, {})
+                        self.addRow(groupRow)
+                    else:
+                        merged.add(id(groupRow))
+                    rawkeys[k] = groupRow
+
+                groupidxs[id(groupRow)].extend(idxs)
+                prog.addProgress(len(idxs))
+
+        from concurrent.futures.process import BrokenProcessPool
+
+        executor = vd.sessionPool('group', nworkers)
+        pending = []
+        try:
+            with Progress(gerund='grouping', total=len(rows)) as prog:
+                for start in range(0, len(rows), chunksize):
+                    # only the key values are sent to the workers, not the whole rows
+                    chunk = rows[start:start+chunksize]
+                    pending.append(executor.submit(_group_chunk, [_rawValues(chunk, expr) for expr in exprs], start))
+                    if len(pending) >= nworkers*2:
+                        _mergeChunk(pending.pop(0).result())
+
+                while pending:
+                    _mergeChunk(pending.pop(0).result())
+        except Exception as e:
+            for fut in pending:
+                fut.cancel()
+            if isinstance(e, BrokenProcessPool):  # a worker died; start a new pool next time
+                vd.brokenPool('group', executor)
+            vd.exceptionCaught(e, status=False)
+            vd.warning('could not group in parallel; grouping serially')
+            self.rows = []
+            return False
+
+        if self._lazyGroups is not None:
+            self._lazyGroups = groups
+
+        for groupRow in self.rows:
+            idxs = groupidxs.pop(id(groupRow))
+            if id(groupRow) in merged:
+                idxs.sort()
+            if self._lazyGroups is not None:
+                groupRow.sourcerows.n = len(idxs)
+            else:
+                groupRow.sourcerows.extend(map(rows.__getitem__, idxs))
+
+            for aggcol, isNull, aggregators in accumulated:
+                for sourcerow in map(rows.__getitem__, idxs):
+                    self.accumulate(groupRow.aggstate, aggcol, isNull, aggregators, sourcerow, [])
+
             if rowfunc:
                 rowfunc(groupRow)
 
+        return True
+
+    def newSourceRows(self):
+        'Return empty sourcerows for a new PivotGroupRow.'
+        return [] if self._lazyGroups is None else LazySourceRows(self)
+
+    def findSourceRows(self):
+        'Fill the LazySourceRows of each group with its source rows, by grouping the source rows again.'
+        with self._findLock:
+            if not self._lazyGroups:
+                return
+            found = {k: [] for k, groupRow in self._lazyGroups.items() if groupRow.sourcerows._rows is None}
+            if found:
+                if (self.source.nValueChanges, self.source.nRows) != (self.groupedValueChanges, self.groupedNRows):
+                    vd.warning(f'{self.source.name} changed since grouping; rows found may not match the counts (reload to regroup)')
+                discreteCols = self.groupByCols
+                for sourcerow in Progress(self.source.iterrows(), 'finding', total=self.source.nRows):
+                    k = tuple(wrapply(c.format, forward(c.getTypedValue(sourcerow))) for c in discreteCols)
+                    rows = found.get(k)
+                    if rows is not None:
+                        rows.append(sourcerow)
+                for k, rows in found.items():
+                    self._lazyGroups[k].sourcerows._rows = rows
+
+    def accumulate(self, aggstate, aggcol, isNull, aggregators, sourcerow, pivotvalues):
+        'Add the value of *aggcol* for *sourcerow* to the accumulators for *aggregators* in *aggstate*, for all rows and for each of *pivotvalues*.'
+        try:
+            v = aggcol.getTypedValue(sourcerow)
+            isnull = isNull(v)
+        except Exception:
+            isnull = True  # excluded like nulls, as by getValues
+
+        for k in [(aggcol,)] + [(aggcol, varval) for varval in pivotvalues]:
+            accs = aggstate.get(k)
+            if accs is None:
+                accs = aggstate[k] = {agg:agg.accumulator() for agg in aggregators}
+            if not isnull:
+                for acc in accs.values():
+                    acc.update(v)
+
     def afterLoad(self):
         super().afterLoad()
 
@@ -288,6 +531,9 @@ class PivotSheet(Sheet):
                 c.setCache(True)
 
 
+PivotSheet.init('_findLock', threading.Lock)
+
+
 @PivotSheet.api
 def addcol_aggr(sheet, col):
     hasattr(col, 'origCol') or vd.fail('not an aggregation column')
@@ -312,3 +558,80 @@ vd.addMenuItems('''
     Column > Add column > aggregator > addcol-aggr
     Data > Pivot > pivot
 ''')
+
+
+def test_group_parallel(vd):
+    from visidata import ColumnItem, makeFreqTable
+    vs = Sheet('test_group', rows=[[str(i%7), '1.0' if i%3 else '1'] for i in range(100)],
+               columns=[ColumnItem('a', 0), ColumnItem('b', 1, type=float)])
+
+    def freqrows(col, nworkers):
+        vd.options.group_workers = nworkers
+        fq = makeFreqTable(vs, col)
+        vd.sync(fq.ensureLoaded())
+        return [(r.discrete_keys, list(r.sourcerows)) for r in fq.rows]
+
+    try:
+        PivotSheet.groupChunkRows = 10
+        for col in vs.columns:
+            assert freqrows(col, 2) == freqrows(col, 0)
+        pool = vd.sessionPool('group', 2)
+        assert freqrows(vs.columns[0], 2) and vd.sessionPool('group', 2) is pool  # same worker processes for every frequency table
+
+        assert _rawValues([[1], [2, 3]], 1) == [None, 3]
+        assert _rawValues([{'a': {'b': 1}}, {}], 'a.b') == [1, None]
+    finally:
+        PivotSheet.groupChunkRows = 10000
+        vd.options.group_workers = 0
+
+
+def test_pivot_source_edited(vd):
+    from visidata import ColumnItem
+    vs = Sheet('test_pivot', rows=[['a', 1], ['a', 2], ['b', 3]],
+               columns=[ColumnItem('k', 0), ColumnItem('n', 1, type=int, aggstr='sum')])
+    vs.setKeys(vs.columns[:1])
+    pvt = makePivot(vs, [vs.columns[0]], [])
+    vd.sync(pvt.ensureLoaded())
+    sumcol = pvt.column('n_sum')
+    assert [sumcol.getValue(r) for r in pvt.rows] == [3, 3]
+
+    vs.columns[1].setValue(vs.rows[0], 10)
+    sumcol.recalc()
+    assert [sumcol.getValue(r) for r in pvt.rows] == [12, 3]
+
+    vs = Sheet('test_pivot', rows=[['a', '10'], ['a', '9']],
+               columns=[ColumnItem('k', 0), ColumnItem('n', 1, type=int, aggstr='min')])
+    pvt = makePivot(vs, [vs.columns[0]], [])
+    vd.sync(pvt.ensureLoaded())
+    mincol = pvt.column('n_min')
+    assert mincol.getValue(pvt.rows[0]) == 9
+    vs.columns[1].type = str  # not an edit to any cell
+    mincol.recalc()
+    assert mincol.getValue(pvt.rows[0]) == '10'
+
+
+def test_freq_lazy_sourcerows(vd):
+    from visidata import ColumnItem, makeFreqTable
+    vs = Sheet('test_freq', rows=[[str(i%3), i] for i in range(10)],
+               columns=[ColumnItem('k', 0), ColumnItem('n', 1, type=int, aggstr='sum')])
+    fq = makeFreqTable(vs, vs.columns[0])
+    vd.sync(fq.ensureLoaded())
+    assert all(type(r.sourcerows) is list for r in fq.rows)  # only with options.group_lazy_rows
+
+    vd.options.group_lazy_rows = True
+    try:
+        fq = makeFreqTable(vs, vs.columns[0])
+        vd.sync(fq.ensureLoaded())
+    finally:
+        vd.options.unset('group_lazy_rows')
+    assert all(isinstance(r.sourcerows, LazySourceRows) and r.sourcerows._rows is None for r in fq.rows)
+    assert [(r.discrete_keys, fq.column('count').getTypedValue(r), fq.column('n_sum').getValue(r)) for r in fq.rows] == \
+           [(['0'], 4, 18), (['1'], 3, 12), (['2'], 3, 15)]
+
+    assert fq.openRow(fq.rows[1]).rows == [vs.rows[1], vs.rows[4], vs.rows[7]]
+    assert all(r.sourcerows._rows is not None for r in fq.rows)  # all groups found at once
+
+    vs.columns[1].aggstr = 'median'  # needs the source rows
+    fq = makeFreqTable(vs, vs.columns[0])
+    vd.sync(fq.ensureLoaded())
+    assert [r.sourcerows for r in fq.rows][2] == [vs.rows[2], vs.rows[5], vs.rows[8]]
@@ -1,12 +1,22 @@
-import collections
+import itertools
 import os
+import secrets
+import shutil
+import threading
+import time
 from copy import copy
 
 from visidata import vd
-from visidata import Sheet, BaseSheet, VisiData, IndexSheet, Path, Progress, TypedExceptionWrapper, TypedWrapper, UNLOADED
+from visidata import Sheet, BaseSheet, Column, VisiData, IndexSheet, Path, Progress, TypedExceptionWrapper, TypedWrapper, UNLOADED
 
 vd.option('safe_error', '#ERR', 'error string to use while saving', replay=True)
 vd.option('save_encoding', 'utf-8', 'encoding passed to codecs.open when saving a file', replay=True, help=vd.help_encoding)
+vd.option('save_atomic', False, 'save into a temporary file next to the destination, and rename it over the destination only when complete')
+vd.option('save_workers', 1, 'number of sheets to save at the same time, when saving multiple sheets into a directory or zip')
+
+# filetypes whose savers write a whole new file, which can be saved atomically; others (like sqlite) may add to an existing file
+vd.save_atomic_filetypes = '''tsv csv txt usv lsv fixed json jsonl ndjson jsonla md jira html org rec xml
+                              xlsx xls parquet arrow arrows npy png svg dot geojson vdj vds vdx zip'''.split()
 
 @Sheet.api
 def safe_trdict(vs):
@@ -25,59 +35,102 @@ def safe_trdict(vs):
     return {}
 
 
+Sheet.saveChunkRows = 1000  # rows formatted together by iterdispvalChunks
+
+
 @Sheet.api
-def iterdispvals(sheet, *cols, format=False):
-    'For each row in sheet, yield OrderedDict of values for given cols.  Values are typed if format=False, or a formatted display string if format=True.'
+def saveTransforms(sheet, col, format=False, trdict=None) -> list:
+    'Return list of functions to apply in order to the value of *col* for saving.'
+    transforms = [ col.type ]
+    if format:
+        formatter = col.formatter or sheet.options.disp_formatter
+        if formatter == 'generic' and type(col).formatter_generic is Column.formatter_generic:
+            transforms.append(col.make_formatValue())
+        else:
+            formatMaker = getattr(col, 'formatter_'+formatter)
+            transforms.append(formatMaker(col._formatdict))
+    if trdict:
+        transforms.append(lambda v,trdict=trdict: v.translate(trdict))
+    return transforms
+
+
+def _savevals(col, rows, transforms, format, safe_error) -> list:
+    'Return list of values for *rows* in *col*, each with *transforms* applied in order.'
+    ret = []
+    getValue = col.getValue
+    if type(col).getValue is Column.getValue and col._cachedValues is None and not col.defer:
+        getValue = col.calcValue  # same as getValue for uncached columns
+    for r in rows:
+        try:
+            dispval = getValue(r)
+        except Exception as e:
+            dispval = safe_error or str(e)
+
+        try:
+            for t in transforms:
+                if dispval is None:
+                    break
+                elif isinstance(dispval, TypedWrapper):
+                    if isinstance(dispval, TypedExceptionWrapper):
+                        dispval = safe_error or str(dispval)
+                    else:
+                        dispval = ''
+                    break
+                else:
+                    dispval = t(dispval)
+
+            if dispval is None and format:
+                dispval = ''
+        except Exception as e:
+            dispval = str(dispval)
+
+        ret.append(dispval)
+    return ret
+
+
+@Sheet.api
+def iterdispvalChunks(sheet, *cols, format=False):
+    'For each chunk of rows in sheet, yield list of tuples of values for given cols, one tuple for each row.  Values are typed if format=False, or a formatted display string if format=True.  Values are computed a column at a time.'
     if not cols:
         cols = sheet.visibleCols
 
-    transformers = collections.OrderedDict()  # list of transformers for each column in order
     trdict = sheet.safe_trdict()
-    for col in cols:
-        transformers[col] = [ col.type ]
-        if format:
-            formatMaker = getattr(col, 'formatter_'+(col.formatter or sheet.options.disp_formatter))
-            transformers[col].append(formatMaker(col._formatdict))
-        if trdict:
-            transformers[col].append(lambda v,trdict=trdict: v.translate(trdict))
+    transformers = [(col, sheet.saveTransforms(col, format=format, trdict=trdict)) for col in cols]
 
     options_safe_error = sheet.options.safe_error
-    for r in Progress(sheet.rows):
-        dispvals = collections.OrderedDict()  # [col] -> value
-        for col, transforms in transformers.items():
-            try:
-                dispval = col.getValue(r)
-
-            except Exception as e:
-                dispval = options_safe_error or str(e)
-
-            try:
-                for t in transforms:
-                    if dispval is None:
-                        break
-                    elif isinstance(dispval, TypedExceptionWrapper):
-                        dispval = options_safe_error or str(dispval)
-                        break
-                    elif isinstance(dispval, TypedWrapper):
-                        dispval = ''
-                        break
-                    else:
-                        dispval = t(dispval)
+    prog = Progress(sheet.rows, gerund='saving')
+    it = iter(prog)
+    t0 = time.perf_counter()
+    while True:
+        rows = list(itertools.islice(it, sheet.saveChunkRows))
+        if not rows:
+            break
+        if not transformers:
+            yield [()]*len(rows)
+        else:
+            yield list(zip(*[_savevals(col, rows, transforms, format, options_safe_error) for col, transforms in transformers]))
+        elapsed = time.perf_counter() - t0
+        if elapsed > 0:
+            prog.gerund = 'saving %d rows/s' % (prog.made/elapsed)
 
-                if dispval is None and format:
-                    dispval = ''
-            except Exception as e:
-                dispval = str(dispval)
 
-            dispvals[col] = dispval
+@Sheet.api
+def iterdispvals(sheet, *cols, format=False):
+    'For each row in sheet, yield dict of values for given cols.  Values are typed if format=False, or a formatted display string if format=True.'
+    if not cols:
+        cols = sheet.visibleCols
 
-        yield dispvals
+    for chunk in sheet.iterdispvalChunks(*cols, format=format):
+        for vals in chunk:
+            yield dict(zip(cols, vals))
 
 
 @Sheet.api
 def itervals(sheet, *cols, format=False):
-    for row in sheet.iterdispvals(*cols, format=format):
-        yield [row[c] for c in cols]
+    for chunk in sheet.iterdispvalChunks(*cols, format=format):
+        for vals in chunk:
+            yield list(vals) if cols else []
+
 
 @BaseSheet.api
 def getDefaultSaveName(sheet):
@@ -142,7 +195,7 @@ def saveSheets(vd, givenpath, *vsheets, confirm_overwrite=True):
         # savefuncs(vd, p, vs) will have 3 argcount (vs counts as an arg, along with vd, path)
         if savefunc.__code__.co_argcount == 3 and len(vsheets) > 1:
             vd.fail(f'cannot save multiple {filetype} sheets to non-dir')
-        return vd.execAsync(savefunc, givenpath, *vsheets)
+        return vd.execAsync(vd.saveAtomic, savefunc, givenpath, *vsheets, filetype=filetype)
 
     # path is a dir
 
@@ -155,15 +208,85 @@ def saveSheets(vd, givenpath, *vsheets, confirm_overwrite=True):
     if not givenpath.is_dir():
         vd.fail(f'cannot save multiple {filetype} sheets to non-dir')
 
-    def _savefiles(vsheets, givenpath, savefunc, filetype):
-        for vs in vsheets:
+    def saveFiles(vsheets, givenpath, savefunc, filetype):
+        def _savefile(vs):
             p = Path((givenpath / vs.name).with_suffix('.'+filetype))
-            savefunc(p, vs)
+            vd.saveAtomic(savefunc, p, vs, filetype=filetype)
             vs.hasBeenModified = False
 
+        vd.saveEach(_savefile, vsheets)
         vd.status(f'{givenpath} save finished')  #2157
 
-    return vd.execAsync(_savefiles, vsheets, givenpath, savefunc, filetype)
+    return vd.execAsync(saveFiles, vsheets, givenpath, savefunc, filetype)
+
+
+def _canReplace(dest) -> bool:
+    'Return True if *dest* does not exist, or if it is a regular file which can be replaced by a new file with the same owner and group, without splitting any hard links.'
+    if not os.path.lexists(dest):
+        return True
+    if os.path.islink(dest) or not os.path.isfile(dest):
+        return False
+    st = os.stat(dest)
+    if st.st_nlink > 1:
+        return False
+    if hasattr(os, 'geteuid') and os.geteuid() != 0:  # only root can give a file to another owner or group
+        if st.st_uid != os.geteuid() or st.st_gid not in (os.getegid(), *os.getgroups()):
+            return False
+    return True
+
+
+@VisiData.api
+def saveAtomic(vd, savefunc, p, *vsheets, filetype=''):
+    '''Call ``savefunc(p, *vsheets)`` to save into a temporary file in the same directory as *p*, then rename it to *p* when complete, so that *p* is never partially written.
+       The mode, owner and group of an existing *p* are kept.
+       Save directly into *p* if not options.save_atomic, if *filetype* is not in vd.save_atomic_filetypes, or if *p* is not a local regular file which can be replaced.'''
+    if not vd.options.save_atomic or filetype not in vd.save_atomic_filetypes:
+        return savefunc(p, *vsheets)
+    if type(p) is not Path or p.given == '-' or p.is_url() or p.has_fp() or not _canReplace(str(p)):
+        return savefunc(p, *vsheets)
+
+    dest = str(p)
+    dirname, basename = os.path.split(dest)
+    # keep the full filename at the end, for its extension and compression
+    tmpp = Path(os.path.join(dirname, '.vdsave-%s-%s' % (secrets.token_hex(4), basename)))
+    try:
+        ret = savefunc(tmpp, *vsheets)
+        if isinstance(ret, threading.Thread):  # savefunc is an asyncthread
+            vd.sync(ret)
+        if os.path.exists(dest):
+            st = os.stat(dest)
+            shutil.copymode(dest, tmpp)
+            tmpst = os.stat(tmpp)
+            if (tmpst.st_uid, tmpst.st_gid) != (st.st_uid, st.st_gid):
+                os.chown(tmpp, st.st_uid, st.st_gid)
+        os.replace(tmpp, dest)
+    except BaseException:
+        if os.path.exists(tmpp):
+            os.unlink(tmpp)
+        raise
+    return ret
+
+
+@VisiData.api
+def saveEach(vd, func, vsheets):
+    '''Call ``func(vs)`` for each of *vsheets*, up to options.save_workers at the same time.
+       Each call is in its own thread from vd.execAsync, associated with its sheet, so its Progress shows there and it can be cancelled like any other thread.'''
+    nworkers = min(vd.options.save_workers, len(vsheets))
+    if nworkers <= 1:
+        for vs in vsheets:
+            func(vs)
+        return
+
+    running = threading.BoundedSemaphore(nworkers)
+    def saveSheet(vs):
+        with running:
+            return func(vs)
+
+    threads = [vd.execAsync(saveSheet, vs, sheet=vs) for vs in vsheets]
+    vd.sync(*threads)
+    failed = [t.sheet.name for t in threads if t.status in ('exception', 'aborted by user')]
+    if failed:
+        vd.fail('could not save ' + ', '.join(failed))
 
 
 @VisiData.api
@@ -173,13 +296,21 @@ def save_zip(vd, p, *vsheets):
     import tempfile
     import zipfile
     with tempfile.TemporaryDirectory() as tmpdir:
+        # each sheet in its own directory, in case of duplicate names
+        tmppaths = {vs: Path(os.path.join(tmpdir, str(i), f'{vs.name}.{vs.options.save_filetype}')) for i, vs in enumerate(vsheets)}
+
+        def _savetmp(vs):
+            filetype = vs.options.save_filetype
+            tmpp = tmppaths[vs]
+            os.makedirs(os.path.dirname(tmpp))
+            savefunc = getattr(vs, 'save_' + filetype, None) or getattr(vd, 'save_' + filetype, None)
+            savefunc(tmpp, vs)
+
+        vd.saveEach(_savetmp, vsheets)
+
         with zipfile.ZipFile(str(p), 'w', zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=9) as zfp:
             for vs in Progress(vsheets):
-                filetype = vs.options.save_filetype
-                tmpp = Path(f'{tmpdir}{vs.name}.{filetype}')
-                savefunc = getattr(vs, 'save_' + filetype, None) or getattr(vd, 'save_' + filetype, None)
-                savefunc(tmpp, vs)
-                zfp.write(tmpp, f'{vs.name}.{vs.options.save_filetype}')
+                zfp.write(tmppaths[vs], f'{vs.name}.{vs.options.save_filetype}')
 
 
 @VisiData.api
@@ -205,6 +336,56 @@ def rootSheet(sheet):
     return r
 
 
+def test_save_atomic(vd):
+    import tempfile
+    import zipfile
+    from visidata import ItemColumn
+
+    vs = Sheet('nums', columns=[ItemColumn('n', 0, type=int)], rows=[[i] for i in range(2500)])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        p = Path(os.path.join(tmpdir, 'nums.tsv'))
+        with open(p, 'w') as fp:
+            fp.write('old\n')
+        os.chmod(p, 0o640)
+
+        def _fail(p, vs):
+            vd.save_tsv(p, vs)
+            raise Exception('disk full')
+
+        vd.options.save_atomic = True
+        try:
+            try:
+                vd.saveAtomic(_fail, p, vs, filetype='tsv')
+                assert False, 'no exception'
+            except Exception as e:
+                assert str(e) == 'disk full'
+            assert os.listdir(tmpdir) == ['nums.tsv']
+            assert open(p).read() == 'old\n'
+
+            vd.saveAtomic(vd.save_tsv, p, vs, filetype='tsv')
+            assert os.listdir(tmpdir) == ['nums.tsv']
+            assert open(p).read().splitlines()[-1] == '2499'
+            assert os.stat(p).st_mode & 0o777 == 0o640
+
+            # a hard-linked file is written in place, so all its links see the new contents
+            vs2 = Sheet('letters', columns=[ItemColumn('c', 0)], rows=[['a']])
+            linkp = os.path.join(tmpdir, 'link.tsv')
+            os.link(p, linkp)
+            vd.saveAtomic(vd.save_tsv, p, vs2, filetype='tsv')
+            assert open(linkp).read() == 'c\na\n'
+            os.unlink(linkp)
+        finally:
+            vd.options.unset('save_atomic')
+
+        vd.options.save_workers = 2
+        try:
+            vd.save_zip(Path(os.path.join(tmpdir, 'nums.zip')), vs, vs2)
+        finally:
+            vd.options.unset('save_workers')
+        with zipfile.ZipFile(os.path.join(tmpdir, 'nums.zip')) as zfp:
+            assert [zfp.read(info).count(b'\n') for info in zfp.infolist()] == [2501, 2]
+
+
 BaseSheet.addCommand('^S', 'save-sheet', 'vd.saveSheets(inputPath("save to: ", value=getDefaultSaveName()), sheet)', 'save current sheet to filename in format determined by extension (default .tsv)')
 BaseSheet.addCommand('', 'save-sheet-really', 'vd.saveSheets(Path(getDefaultSaveName()), sheet, confirm_overwrite=False)', 'save current sheet without asking for filename or confirmation')
 BaseSheet.addCommand('', 'save-source', 'vd.saveSheets(rootSheet().source, rootSheet())', 'save root sheet to its source')
@@ -1,8 +1,184 @@
 import re
+import itertools
 from visidata import vd, VisiData, BaseSheet, Sheet, Column, Progress, asyncthread, rotateRange
 
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+vd.option('search_workers', 0, 'number of worker processes for matching regex searches of large sheets (0 or 1 to match in main process)')
+vd.option('search_cache', False, 'keep display values of searched columns, for repeated searches in the same columns')
+
 VisiData.init('searchContext', dict) # [(regex, columns, backward)] -> kwargs from previous search
 
+Sheet.searchChunkRows = 1000  # rows formatted and matched together
+Sheet.searchWorkerRows = 100000  # sheets with fewer rows are matched in the main process, as sending display values to workers costs more than matching them
+Sheet.searchFormatOptions = 'disp_formatter disp_float_fmt disp_int_fmt disp_date_fmt disp_currency_fmt disp_error_val encoding encoding_errors'.split()  # options which change display values
+
+Sheet.init('_searchCached', bool)  # True if any column on the sheet may have cached display values
+Column.init('_searchValues', dict)  # [rowid] -> display value cached for options.search_cache
+Column.init('_searchFormat', lambda: None)  # (type, fmtstr, formatter, width, option values) of cached _searchValues
+
+
+def requiredLiteral(regex) -> str:
+    'Return the longest string which must be in any text matched by compiled *regex*, or "" if none is known.'
+    if regex.flags & re.IGNORECASE:
+        return ''
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return ''
+    best = run = ''
+    for op, av in parsed:
+        if op == sre_parse.LITERAL:
+            run += chr(av)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ''
+    return best
+
+
+def _matchChunk(search, dispvals, literal='') -> list:
+    '''Return list of (i, j) for each row i with a display value for which *search* matches, where j is the first matching column.
+       *dispvals* is a list of the display values of the rows, for each column.
+       Only values containing *literal* are searched; if *search* is None, containing *literal* is a match.'''
+    firstcol = {}
+    rest = range(len(dispvals[0]))
+    for j, vals in enumerate(dispvals):
+        candidates = [i for i in rest if literal in vals[i]] if literal else rest
+        for i in candidates:
+            if search is None or search(vals[i]):
+                firstcol[i] = j
+        if j < len(dispvals)-1:
+            rest = [i for i in rest if i not in firstcol]
+    return sorted(firstcol.items())
+
+
+def _searchChunk(pattern, flags, dispvals, literal) -> list:
+    'Return _matchChunk() for regex *pattern* (or None to match *literal* only) with *flags*.  Run in worker process.'
+    return _matchChunk(re.compile(pattern, flags).search if pattern is not None else None, dispvals, literal)
+
+
+@Column.api
+def getSearchValues(col, rows:list) -> list:
+    '''Return list of display values for each of *rows*, as cached by previous searches if options.search_cache.
+       Cached values are kept by rowid, so they are only as stable as the sheet's rowid (which is id(row) by default); they are dropped on reload, and for rows which are edited or deleted.'''
+    sheet = col.sheet
+    if not sheet.options.search_cache or col.cache == 'async':
+        sheet.clearSearchCaches()
+        return col.getDisplayValues(rows)
+
+    sheet._searchCached = True
+    fmt = (col.type, col.fmtstr, col.formatter, col.width, tuple(sheet.options[k] for k in sheet.searchFormatOptions))
+    if fmt != col._searchFormat:
+        col._searchValues = {}
+        col._searchFormat = fmt
+
+    cache = col._searchValues
+    rowid = sheet.rowid
+    ret = [None]*len(rows)
+    missing = []
+    for i, r in enumerate(rows):
+        v = cache.get(rowid(r))
+        if v is not None:
+            ret[i] = v
+        else:
+            missing.append(i)
+
+    if missing:
+        missingrows = [rows[i] for i in missing]
+        for i, r, v in zip(missing, missingrows, col.getDisplayValues(missingrows)):
+            ret[i] = v
+            cache[rowid(r)] = v
+    return ret
+
+
+@Sheet.api
+def clearSearchCaches(sheet):
+    'Drop the display values cached for searches in all columns of *sheet*.'
+    if not sheet._searchCached:
+        return
+    for c in sheet.columns:
+        c._searchValues = {}
+    sheet._searchCached = False
+
+
+@Column.after
+def setValue(col, row, val, setModified=True):
+    'Drop cached display values of *row* in all columns on the sheet, as they may depend on this one.'
+    if not col.sheet._searchCached:  # nothing cached without options.search_cache
+        return
+    rowid = col.sheet.rowid(row)
+    for c in col.sheet.columns:
+        if c._searchValues:
+            c._searchValues.pop(rowid, None)
+
+
+@Column.after
+def recalc(col, sheet=None):
+    col._searchValues = {}
+
+
+@Sheet.api
+def iterMatchingRows(sheet, regex, columns, rowidxs, first=False):
+    '''Generate (rowidx, col) for each of *rowidxs* (in order) for which compiled *regex* matches the display value of any of *columns*; *col* is the first matching column.
+       Display values are formatted for chunks of rows at once, or one row at a time if only the *first* match is needed.
+       Only values with the literal text required by *regex* are matched against it.  If options.search_workers > 1 and the sheet has at least searchWorkerRows rows, those values are matched in worker processes.'''
+    chunkRows = 1 if first else sheet.searchChunkRows
+    def _chunks():
+        it = iter(rowidxs)
+        while True:
+            chunk = list(itertools.islice(it, chunkRows))
+            if not chunk:
+                return
+            rows = [sheet.rows[i] for i in chunk]
+            yield chunk, [c.getSearchValues(rows) for c in columns]
+
+    literal = requiredLiteral(regex)
+    pattern = None if literal and re.escape(literal) == regex.pattern else regex.pattern
+
+    nworkers = sheet.options.search_workers
+    if nworkers <= 1 or first or pattern is None or sheet.nRows < sheet.searchWorkerRows:
+        search = regex.search if pattern is not None else None
+        for chunk, dispvals in _chunks():
+            for i, j in _matchChunk(search, dispvals, literal):
+                yield chunk[i], columns[j]
+        return
+
+    from concurrent.futures.process import BrokenProcessPool
+
+    def _candidates(chunk, dispvals):
+        'Return chunk and display values of only the rows with *literal* in any column, to send less to the workers.'
+        if not literal:
+            return chunk, dispvals
+        keep = [i for i in range(len(chunk)) if any(literal in vals[i] for vals in dispvals)]
+        return [chunk[i] for i in keep], [[vals[i] for i in keep] for vals in dispvals]
+
+    executor = vd.sessionPool('search', nworkers)
+    pending = []  # (chunk, future) in order of rows
+    try:
+        for chunk, dispvals in _chunks():
+            chunk, dispvals = _candidates(chunk, dispvals)
+            if not chunk:
+                continue
+            pending.append((chunk, executor.submit(_searchChunk, pattern, regex.flags, dispvals, literal)))
+            if len(pending) >= nworkers*2:
+                chunk, fut = pending.pop(0)
+                for i, j in fut.result():
+                    yield chunk[i], columns[j]
+
+        for chunk, fut in pending:
+            for i, j in fut.result():
+                yield chunk[i], columns[j]
+    except BrokenProcessPool:  # a worker died; start a new pool for the next search
+        vd.brokenPool('search', executor)
+        raise
+    finally:
+        for chunk, fut in pending:
+            fut.cancel()
+
 vd.help_regex_flags = '''# Regex Flags Help
 - `A` (ASCII) ASCII-only matching (not unicode)
 - `I` (IGNORECASE): case-insensitive matching
@@ -22,12 +198,6 @@ def moveRegex(vd, sheet, *args, **kwargs):
 @VisiData.api
 def searchRegex(vd, sheet, moveCursor=False, reverse=False, regex_flags=None, **kwargs):
         'Set row index if moveCursor, otherwise return list of row indexes.'
-        def findMatchingColumn(sheet, row, columns, func):
-            'Find column for which func matches the displayed value in this row'
-            for c in columns:
-                if func(c.getDisplayValue(row)):
-                    return c
-
         vd.searchContext.update(kwargs)
 
         regex = kwargs.get("regex")
@@ -60,16 +230,15 @@ def searchRegex(vd, sheet, moveCursor=False, reverse=False, regex_flags=None, **
             searchBackward = not searchBackward
 
         matchingRowIndexes = 0
-        for rowidx in rotateRange(len(sheet.rows), sheet.cursorRowIndex, reverse=searchBackward):
-            c = findMatchingColumn(sheet, sheet.rows[rowidx], columns, regex.search)
-            if c:
-                if moveCursor:
-                    sheet.cursorRowIndex = rowidx
-                    sheet.cursorVisibleColIndex = sheet.visibleCols.index(c)
-                    return
-                else:
-                    matchingRowIndexes += 1
-                    yield rowidx
+        rowidxs = rotateRange(len(sheet.rows), sheet.cursorRowIndex, reverse=searchBackward)
+        for rowidx, c in sheet.iterMatchingRows(regex, columns, rowidxs, first=moveCursor):
+            if moveCursor:
+                sheet.cursorRowIndex = rowidx
+                sheet.cursorVisibleColIndex = sheet.visibleCols.index(c)
+                return
+            else:
+                matchingRowIndexes += 1
+                yield rowidx
 
         if kwargs.get('printStatus', True):
             vd.status('%s matches for /%s/' % (matchingRowIndexes, regex.pattern))
@@ -103,6 +272,87 @@ def search_expr(sheet, expr, reverse=False, curcol=None):
     vd.fail(f'no {sheet.rowtype} where {expr}')
 
 
+def test_search_workers(vd):
+    from visidata import ColumnItem
+    vs = Sheet('test', rows=[[str(i), i*1.5] for i in range(100)])
+    vs.addColumn(ColumnItem('s', 0))
+    vs.addColumn(ColumnItem('f', 1, type=float))
+    vs.cursorRowIndex = 50
+    vd.clearCaches()
+
+    def search(nworkers, **kwargs):
+        vd.options.search_workers = nworkers
+        return list(vd.searchRegex(vs, regex='5.?', columns='visibleCols', printStatus=False, **kwargs))  # not only a literal, to be matched by the workers
+
+    try:
+        Sheet.searchChunkRows = 7
+        Sheet.searchWorkerRows = 50
+        matches = lambda idxs: [i for i in idxs if '5' in str(i) or '5' in '%.02f' % (i*1.5)]
+        expected = matches(list(range(51, 100)) + list(range(0, 51)))
+        assert search(0, backward=False) == expected
+        assert search(2, backward=False) == expected
+        assert search(2, backward=True) == matches(list(range(49, -1, -1)) + list(range(99, 49, -1)))
+        pool = vd.sessionPool('search', 2)
+        assert search(2) and vd.sessionPool('search', 2) is pool  # same worker processes for every search
+    finally:
+        Sheet.searchChunkRows = 1000
+        Sheet.searchWorkerRows = 100000
+        vd.options.search_workers = 0
+
+
+def test_search_first(vd):
+    nformatted = 0
+    def _getter(col, row):
+        nonlocal nformatted
+        nformatted += 1
+        return row[0]
+
+    vs = Sheet('test', rows=[[str(i)] for i in range(5000)])
+    vs.addColumn(Column('s', getter=_getter))
+    vs.cursorRowIndex = 10
+    vd.clearCaches()
+    vd.options.search_workers = 2
+    try:
+        list(vd.searchRegex(vs, regex='^13$', columns='visibleCols', moveCursor=True, backward=False))
+        assert vs.cursorRowIndex == 13
+        assert nformatted == 3  # only rows up to the first match
+    finally:
+        vd.options.search_workers = 0
+
+
+def test_search_cache(vd):
+    from visidata import ColumnItem
+    assert requiredLiteral(re.compile('abc')) == 'abc'
+    assert requiredLiteral(re.compile(r'x\d+hello(a|b)c?')) == 'hello'
+    assert requiredLiteral(re.compile('a|bc')) == ''
+    assert requiredLiteral(re.compile('abc', re.IGNORECASE)) == ''
+
+    vs = Sheet('test', rows=[['apple', 1], ['banana', 2], ['cherry', 3]])
+    vs.addColumn(ColumnItem('fruit', 0))
+    vs.addColumn(ColumnItem('n', 1, type=int))
+    vd.clearCaches()
+
+    def search(regex):
+        return sorted(vd.searchRegex(vs, regex=regex, columns='visibleCols', printStatus=False, backward=False))
+
+    vd.options.search_cache = True
+    try:
+        assert search('an+a') == [1]
+        assert search('an') == [1]
+        vs.columns[0].setValue(vs.rows[2], 'mango')
+        assert search('an') == [1, 2]
+        vs.columns[1].type = float
+        assert search(r'3\.00') == [2]
+        vd.options.disp_float_fmt = '{:.1f}'
+        assert search(r'3\.0$') == [2]
+        vs.deleteBy(lambda r: r[0] == 'apple', commit=True, undo=False)
+        assert not vs.columns[0]._searchValues
+        assert search('an') == [0, 1]
+    finally:
+        vd.options.search_cache = False
+        vd.options.unset('disp_float_fmt')
+
+
 Sheet.addCommand('r', 'search-keys', 'tmp=cursorVisibleColIndex; moveInputRegex("row key", type="regex-row", columns=keyCols or [visibleCols[0]]); sheet.cursorVisibleColIndex=tmp', 'go to next row with key matching regex')
 Sheet.addCommand('/', 'search-col', 'moveInputRegex("search", columns="cursorCol", backward=False)', 'search for regex forwards in current column')
 Sheet.addCommand('?', 'searchr-col', 'moveInputRegex("reverse search", columns="cursorCol", backward=True)', 'search for regex backwards in current column')
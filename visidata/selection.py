@@ -1,11 +1,116 @@
 from copy import copy
-from visidata import vd, Sheet, Progress, asyncthread, options, rotateRange, Fanout, undoAttrCopyFunc, RowColorizer
+import itertools
+from visidata import vd, Sheet, SequenceSheet, Progress, asyncthread, options, rotateRange, Fanout, undoAttrCopyFunc, RowColorizer
 
 vd.option('bulk_select_clear', False, 'clear selected rows before new bulk selections', replay=True)
 vd.option('some_selected_rows', False, 'if no rows selected, if True, someSelectedRows returns all rows; if False, fails')
 
 Sheet.init('_selectedRows', dict)  # rowid(row) -> row
 
+
+class RowBitmap:
+    '''Selected rows of a sheet with stable integer rowids (like row numbers of columnar rows), as a bytearray with a byte for each rowid in the range *rowids()* (1 if selected).
+       Has the dict interface of ``Sheet._selectedRows`` ([rowid] -> row); rows with other rowids are kept in a dict.'''
+    def __init__(self, sheet, rowids):
+        self.sheet = sheet
+        self.rowids = rowids
+        self.start = 0    # rowid of bits[0], from rowids() when bits are first extended
+        self.bits = bytearray()
+        self.others = {}  # [rowid] -> row, for rowids not in bits
+        self._nbits = 0   # number of selected rowids in bits, or None if not counted since bulk changes
+
+    def __copy__(self):
+        ret = RowBitmap(self.sheet, self.rowids)
+        ret.start = self.start
+        ret.bits = copy(self.bits)
+        ret.others = copy(self.others)
+        ret._nbits = self._nbits
+        return ret
+
+    def _bitindex(self, k):
+        'Return index into bits of rowid *k*, extending bits if necessary; or None if *k* does not belong in bits.'
+        if type(k) is not int:
+            return None
+        i = k - self.start
+        if 0 <= i < len(self.bits):
+            return i
+        r = self.rowids()
+        if not self.bits:
+            self.start = r.start
+            i = k - self.start
+        n = r.stop - self.start
+        if not 0 <= i < n:
+            return None
+        self.bits.extend(bytes(max(n, 2*len(self.bits))-len(self.bits)))
+        return i
+
+    def __contains__(self, k):
+        if type(k) is int and 0 <= k-self.start < len(self.bits):
+            return self.bits[k-self.start] == 1
+        return k in self.others
+
+    def __setitem__(self, k, row):
+        i = self._bitindex(k)
+        if i is not None:
+            if not self.bits[i]:
+                self.bits[i] = 1
+                if self._nbits is not None:
+                    self._nbits += 1
+        else:
+            self.others[k] = row
+
+    def __delitem__(self, k):
+        if type(k) is int and 0 <= k-self.start < len(self.bits) and self.bits[k-self.start]:
+            self.bits[k-self.start] = 0
+            if self._nbits is not None:
+                self._nbits -= 1
+        else:
+            del self.others[k]
+
+    def __len__(self):
+        if self._nbits is None:
+            self._nbits = self.bits.count(1)
+        return self._nbits + len(self.others)
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        return itertools.chain(itertools.compress(range(self.start, self.start+len(self.bits)), self.bits), self.others.keys())
+
+    def values(self):
+        'Return list of selected rows in sheet order.'
+        rowid = self.sheet.rowid
+        return [r for r in self.sheet.rows if rowid(r) in self]
+
+    def clear(self):
+        self.bits = bytearray()
+        self.others.clear()
+        self._nbits = 0
+
+    def setMany(self, rows, v:int):
+        'Select *rows* if *v* is 1, unselect them if 0, or toggle them if None.'
+        rowid = self.sheet.rowid
+        bits = self.bits
+        self._nbits = None
+        for r in rows:
+            k = rowid(r)
+            i = self._bitindex(k)
+            if i is None:
+                if v == 1 or (v is None and k not in self.others):
+                    self.others[k] = r
+                else:
+                    self.others.pop(k, None)
+                continue
+            bits = self.bits  # may have been extended
+            bits[i] = (bits[i] ^ 1) if v is None else v
+
+
+@SequenceSheet.before
+def loader(sheet):
+    if sheet.options.columnar_rows:
+        sheet._selectedRows = RowBitmap(sheet, lambda: sheet._columnarStore.rowids() if sheet._columnarStore is not None else range(0))
+
 vd.rowNoters.append(
         lambda sheet, row: sheet.isSelected(row) and sheet.options.disp_selected_note
 )
@@ -23,7 +128,11 @@ def isSelected(self, row):
 def toggle(self, rows):
     'Toggle selection of given *rows*.  Async.'
     self.addUndoSelection()
-    for r in Progress(rows, 'toggling', total=len(rows)):
+    rows = Progress(rows, 'toggling', total=len(rows))
+    if self.bulkSelection:
+        self._selectedRows.setMany(rows, None)
+        return
+    for r in rows:
         if self.isSelected(r):  #1671
             self.unselectRow(r)
         else:
@@ -83,8 +192,12 @@ def select(self, rows, status=True, progress=True):
     before = self.nSelectedRows
     if self.options.bulk_select_clear:
         self.clearSelected()
-    for r in (Progress(rows, 'selecting') if progress else rows):
-        self.selectRow(r)
+    rows = Progress(rows, 'selecting') if progress else rows
+    if self.bulkSelection:
+        self._selectedRows.setMany(rows, 1)
+    else:
+        for r in rows:
+            self.selectRow(r)
     if status:
         if options.bulk_select_clear:
             msg = 'selected %s %s%s' % (self.nSelectedRows, self.rowtype, ' instead' if before > 0 else '')
@@ -98,8 +211,12 @@ def unselect(self, rows, status=True, progress=True):
     "Remove *rows* from set of selected rows. Async. Don't show progress if *progress* is False; don't show status if *status* is False."
     self.addUndoSelection()
     before = self.nSelectedRows
-    for r in (Progress(rows, 'unselecting') if progress else rows):
-        self.unselectRow(r)
+    rows = Progress(rows, 'unselecting') if progress else rows
+    if self.bulkSelection:
+        self._selectedRows.setMany(rows, 0)
+    else:
+        for r in rows:
+            self.unselectRow(r)
     if status:
         vd.status('unselected %s/%s %s' % (before-self.nSelectedRows, before, self.rowtype))
 
@@ -124,9 +241,17 @@ def gatherBy(self, func, gerund='gathering'):
         except Exception as e:
             vd.exceptionCaught(e, status=False)
 
+@Sheet.property
+def bulkSelection(self) -> bool:
+    'True if rows can be selected and unselected together in the RowBitmap, without calling selectRow and unselectRow for each one.'
+    cls = type(self)
+    return isinstance(self._selectedRows, RowBitmap) and cls.selectRow is Sheet.selectRow and cls.unselectRow is Sheet.unselectRow
+
 @Sheet.property
 def selectedRows(self):
     'List of selected rows in sheet order.'
+    if isinstance(self._selectedRows, RowBitmap):
+        return Fanout(self._selectedRows.values())
     if self.nSelectedRows <= 1:
         return Fanout(self._selectedRows.values())
     return Fanout((r for r in self.rows if self.rowid(r) in self._selectedRows))
@@ -222,3 +347,42 @@ vd.addMenuItems('''
     Row > Toggle select > from top > stoggle-before
     Row > Toggle select > to bottom > stoggle-after
 ''')
+
+
+vd.addGlobals(RowBitmap=RowBitmap)
+
+
+def test_select_bitmap(vd):
+    import visidata
+    from visidata import Path
+    vd.options.columnar_rows = True
+    try:
+        vs = vd.openSource(Path(str(vd.pkg_resources_files(visidata) / 'tests/sample.tsv')))
+        vd.sync(vs.ensureLoaded())
+    finally:
+        vd.options.columnar_rows = False
+
+    assert isinstance(vs._selectedRows, RowBitmap)
+    vs.select(vs.rows[10:20], progress=False)
+    vs.toggle(vs.rows[15:25])
+    assert vs.nSelectedRows == 10
+    assert vs.selectedRows == vs.rows[10:15] + vs.rows[20:25]
+    vs.unselect(vs.rows[:12], progress=False)
+    assert vs.nSelectedRows == 8
+    assert not vs.isSelected(vs.rows[11]) and vs.isSelected(vs.rows[12])
+
+    r = vs.newRow()
+    vs.addRow(r)
+    vs.selectRow(r)
+    assert vs.isSelected(r) and vs.nSelectedRows == 9
+
+    oldrowids = set(vs.rowid(r) for r in vs.rows)
+    vd.options.columnar_rows = True
+    try:
+        vs.reload()
+        vd.sync()
+    finally:
+        vd.options.columnar_rows = False
+    assert not oldrowids & set(vs.rowid(r) for r in vs.rows)  # reloaded rows are not confused with old ones
+    vs.select(vs.rows[:3], progress=False)
+    assert vs.nSelectedRows == 3 and vs.selectedRows == vs.rows[:3]
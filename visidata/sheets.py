@@ -4,7 +4,7 @@ from copy import copy, deepcopy
 import textwrap
 
 from visidata import VisiData, Extensible, globalCommand, ColumnAttr, ColumnItem, vd, ENTER, EscapeException, drawcache, drawcache_property, LazyChainMap, asyncthread, ExpectedException
-from visidata import (options, Column, namedlist, SettableColumn, AttrDict, DisplayWrapper,
+from visidata import (options, Column, namedlist, ColumnarStore, ColumnarRow, SettableColumn, AttrDict, DisplayWrapper,
 TypedExceptionWrapper, BaseSheet, UNLOADED, wrapply,
 clipdraw, clipdraw_chunks, ColorAttr, update_attr, colors, undoAttrFunc, vlen, dispwidth)
 import visidata
@@ -112,13 +112,12 @@ class LazyComputeRow:
 
     def __getitem__(self, colid):
         try:
-            i = self.sheet.availColnames.index(colid)
-            c = self.sheet.availCols[i]
+            cols = self.sheet.availColsByName[colid]
+            c = cols[0]
             if c is self.col:  # ignore current column
-                j = self.sheet.availColnames[i+1:].index(colid)
-                c = self.sheet.availCols[i+j+1]
+                c = cols[1]
 
-        except ValueError:
+        except (KeyError, IndexError, TypeError):  # TypeError for unhashable colid
             try:
                 c = self._lcm[colid]
             except (KeyError, AttributeError) as e:
@@ -398,7 +397,10 @@ class TableSheet(BaseSheet):
         'eval() expr in the context of (row, col), with extra bindings in kwargs'
         if row is not None:
             # contexts are cached by sheet/rowid for duration of drawcycle
-            contexts = vd._evalcontexts.setdefault((self, self.rowid(row), col), LazyComputeRow(self, row, col, **kwargs))
+            k = (self, self.rowid(row), col)
+            contexts = vd._evalcontexts.get(k)
+            if contexts is None:
+                contexts = vd._evalcontexts[k] = LazyComputeRow(self, row, col, **kwargs)
         else:
             contexts = dict(sheet=self)
 
@@ -463,6 +465,14 @@ class TableSheet(BaseSheet):
         'List of all available column names, visible columns first.'
         return [c.name for c in self.availCols]
 
+    @drawcache_property
+    def availColsByName(self):
+        'Dict of column name to list of available columns with that name, in order of availCols.'
+        ret = {}
+        for c in self.availCols:
+            ret.setdefault(c.name, []).append(c)
+        return ret
+
     @property
     def cursorColIndex(self):
         'Index of current column into `Sheet.columns`. Linear search; prefer `cursorCol` or `cursorVisibleColIndex`.'
@@ -563,14 +573,23 @@ class TableSheet(BaseSheet):
             self.columns.insert(idx+i, col)
 
         # statements after addColumn in the same command may want to use these cached properties
+        self.clearColumnCaches()
+
+        return cols[0]
+
+    def clearColumnCaches(self):
+        'Invalidate cached lists of columns, after columns are added or hidden.'
         Sheet.keyCols.fget.cache_clear()
         Sheet.visibleCols.fget.cache_clear()
         Sheet.availCols.fget.cache_clear()
+        self.clearColumnNameCaches()
+
+    def clearColumnNameCaches(self):
+        'Invalidate cached lookups of columns by name, after a column is renamed.'
         Sheet.availColnames.fget.cache_clear()
+        Sheet.availColsByName.fget.cache_clear()
         Sheet.colsByName.fget.cache_clear()
 
-        return cols[0]
-
     def addColumnAtCursor(self, *cols):
         'Insert all *cols* into columns after cursor.  Return first column.'
         index = 0
@@ -1017,13 +1036,31 @@ class SequenceSheet(Sheet):
         self._rowtype = namedlist('tsvobj', [(c.name or '_') for c in self.columns])
 
     def newRow(self):
+        if self._columnarStore is not None:
+            return self._columnarRow([])
         return self._rowtype()
 
+    def rowid(self, row):
+        'Return row number in the columnar store, offset by a base unique to the store, for its rows; these are stable, and contiguous for RowBitmap.'
+        if self._columnarStore is not None and type(row) is ColumnarRow and row._store is self._columnarStore:
+            return row._store.rowidBase + row._rownum
+        return id(row)
+
+    def _columnarRow(self, row):
+        'Return *row* as a ColumnarRow in this sheet\'s columnar store.'
+        if isinstance(row, ColumnarRow) and row._store is self._columnarStore:
+            return row
+        return ColumnarRow(self._columnarStore, self._columnarStore.append(row))
+
     def addRow(self, row, index=None):
+        if self._columnarStore is not None:
+            row = self._columnarRow(row)
         for i in range(len(self.columns), len(row)):  # no-op if already done
             self.addColumn(ColumnItem('', i))
             self._rowtype = namedlist('tsvobj', [(c.name or '_') for c in self.columns])
-        if type(row) is not self._rowtype:
+            if self._columnarStore is not None:
+                self._columnarStore.fields = self._rowtype._fields
+        if self._columnarStore is None and type(row) is not self._rowtype:
             row = self._rowtype(row)
         super().addRow(row, index=index)
 
@@ -1047,13 +1084,21 @@ class SequenceSheet(Sheet):
         self.setCols(list(self.optlines(itsource, 'header')))
 
         self.rows = []
+        self._columnarStore = None
+        if self.options.columnar_rows:
+            self._columnarStore = ColumnarStore()
+            self._columnarStore.fields = getattr(self._rowtype, '_fields', [])
         # add the rest of the rows
+        maxrows = self.options.max_rows if self.precious else None
         for i, r in enumerate(vd.Progress(itsource, gerund='loading', total=0)):
-            if self.precious and i > self.options.max_rows:
+            if maxrows is not None and i > maxrows:
                 break
             self.addRow(r)
 
 
+SequenceSheet.init('_columnarStore', lambda: None, copy=True)
+
+
 @VisiData.property
 @drawcache
 def _evalcontexts(vd):
@@ -1240,6 +1285,20 @@ Sheet.addCommand('', 'setcol-formatter', 'cursorCol.formatter=input("set formatt
 Sheet.addCommand('', 'setcol-format-enum', 'cursorCol.fmtstr=input("format replacements (k=v): ", value=f"{cursorDisplay}=", i=len(cursorDisplay)+1); cursorCol.formatter="enum"', 'add secondary type translator to current column from input enum (space-separated)')
 
 
+def test_lazycomputerow_names(vd):
+    from visidata import ColumnItem
+    vs = Sheet('test', rows=[[1, 2, 3]])
+    a = vs.addColumn(ColumnItem('a', 0, type=int))
+    b = vs.addColumn(ColumnItem('b', 1, type=int))
+    a2 = vs.addColumn(ColumnItem('a', 2, type=int))
+    row = vs.rows[0]
+    assert vs.evalExpr('a+b', row) == 3
+    assert vs.evalExpr('a', row, col=a) == 3   # skip current column
+    b.name = 'c'
+    assert vs.evalExpr('c', row) == 2
+    a.hide()
+    assert vs.evalExpr('a', row) == 3   # visible columns first
+
 vd.addGlobals(
     RowColorizer=RowColorizer,
     CellColorizer=CellColorizer,
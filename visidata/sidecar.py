@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+from array import array
+
+from visidata import vd, VisiData, BaseSheet, Sheet, Path, anytype, modtime, filesize
+from visidata.settings import _get_cache_dir
+
+
+vd.option('sidecar_cache', False, 'cache row index, column types, and describe stats for local files, keyed on path/mtime/size')
+
+
+class Sidecar:
+    '''Persistent cache of data derived from one source file, stored in the user cache dir.
+
+    Stale if the file path, mtime, size, sheet type, or any replayable option changed since it was written.'''
+    def __init__(self, basepath:Path, key:dict):
+        self.basepath = basepath  # without extension; .json for metadata, .idx for row offsets
+        self.key = key
+        self.data = {}
+
+        jsonpath = self.basepath.with_suffix('.json')
+        if jsonpath.exists():
+            try:
+                with open(jsonpath, encoding='utf-8') as fp:
+                    d = json.load(fp)
+                if d.get('key') == key:
+                    self.data = d.get('data', {})
+            except Exception as e:
+                vd.debug(f'ignoring unreadable sidecar {jsonpath}: {e}')
+
+    def get(self, k, default=None):
+        return self.data.get(k, default)
+
+    def set(self, k, v):
+        'Set *k* to *v*, which must be plain json data.  Not written until save().'
+        self.data[k] = v
+
+    def save(self):
+        'Write all data to the .json sidecar file.'
+        os.makedirs(self.basepath.parent, exist_ok=True)
+        jsonpath = self.basepath.with_suffix('.json')
+        tmppath = jsonpath.with_suffix('.json.tmp')
+        with open(tmppath, mode='w', encoding='utf-8') as fp:
+            json.dump(dict(key=self.key, data=self.data), fp)
+        os.replace(tmppath, jsonpath)
+
+    def loadIndex(self, typecode='Q'):
+        'Return list of arrays saved by saveIndex(), or None if not cached.'
+        nitems = self.get('index')
+        idxpath = self.basepath.with_suffix('.idx')
+        if not nitems or not idxpath.exists():
+            return None
+
+        ret = []
+        with open(idxpath, mode='rb') as fp:
+            for n in nitems:
+                a = array(typecode)
+                a.fromfile(fp, n)
+                ret.append(a)
+        return ret
+
+    def saveIndex(self, *arrays):
+        'Save *arrays* of integers to the .idx sidecar file.  Their lengths are not written to the .json file until save().'
+        os.makedirs(self.basepath.parent, exist_ok=True)
+        idxpath = self.basepath.with_suffix('.idx')
+        with open(idxpath, mode='wb') as fp:
+            for a in arrays:
+                a.tofile(fp)
+        self.set('index', [len(a) for a in arrays])
+
+
+@VisiData.lazy_property
+def _sidecars(vd):
+    return {}  # (basepath, json key) -> Sidecar
+
+
+@BaseSheet.api
+def sidecar(sheet):
+    'Return Sidecar cache for the source file of *sheet*, or None if not enabled or not cacheable.'
+    if not sheet.options.sidecar_cache:
+        return None
+
+    p = sheet.source
+    if not isinstance(p, Path) or not p.is_local() or not p.is_file():
+        return None
+
+    abspath = os.path.abspath(p)
+    key = dict(path=abspath,
+               mtime=modtime(p),
+               size=filesize(p),
+               sheettype=type(sheet).__name__,
+               options={k:str(v) for k, v in sheet._replayableOptions()})
+
+    basepath = Path(_get_cache_dir())/'sidecar'/hashlib.sha1(abspath.encode('utf-8', 'surrogateescape')).hexdigest()
+    cachekey = (str(basepath), json.dumps(key, sort_keys=True))
+    if cachekey not in vd._sidecars:
+        vd._sidecars[cachekey] = Sidecar(basepath, key)
+    return vd._sidecars[cachekey]
+
+
+@BaseSheet.api
+def _replayableOptions(sheet):
+    'Generate (optname, value) of replayable options which are not set to their default for *sheet*.'
+    for optname in sorted(vd.options.keys()):
+        opt = vd.options._get(optname, 'default')
+        if opt and opt.replayable:
+            v = sheet.options.getobj(optname, sheet)
+            if v != opt.value:
+                yield optname, v
+
+
+@Sheet.api
+def setTypesFromSidecar(sheet):
+    'Set types of anytype columns to the types remembered in the sidecar cache.'
+    sc = sheet.sidecar()
+    types = sc.get('types', {}) if sc else {}
+    if not types:
+        vd.fail('no cached types for this sheet')
+
+    cols = [c for c in sheet.columns if c.type is anytype and types.get(c.name)]
+    for col in cols:
+        col.typestr = types[col.name]
+    vd.status(f'set types of {len(cols)} columns from sidecar cache')
+
+
+@Sheet.api
+def saveSidecarTypes(sheet):
+    'Remember the column types on *sheet* in its sidecar cache.'
+    sc = sheet.sidecar()
+    if sc is not None:
+        sc.set('types', {col.name:col.typestr for col in sheet.columns if col.type is not anytype})
+        sc.save()
+
+
+Sheet.addCommand('', 'type-cached-all', 'setTypesFromSidecar()', 'set types of anytype columns to types remembered from last describe of this file')
+
+vd.addMenuItems('''
+    Column > Type as > cached types > type-cached-all
+''')
+
+vd.addGlobals(Sidecar=Sidecar)
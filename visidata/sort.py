@@ -1,5 +1,5 @@
 from copy import copy
-from visidata import vd, asyncthread, Progress, Sheet, options, UNLOADED
+from visidata import vd, asyncthread, Progress, Sheet, TypedWrapper, TypedExceptionWrapper, options, UNLOADED
 
 @Sheet.api
 def orderBy(sheet, *cols, reverse=False):
@@ -56,6 +56,16 @@ def sortkey(sheet, r, ordering:'list[tuple[Column, bool]]'=[]):
     return ret
 
 
+def argsortKeys(perm:list, keys:list, reverse=False) -> list:
+    'Return *perm* stably sorted by keys[i] for each i in *perm*.  Errors and then nulls (TypedWrapper) sort before other values (or after, in reverse).'
+    errors = [i for i in perm if isinstance(keys[i], TypedExceptionWrapper)]
+    nulls = [i for i in perm if type(keys[i]) is TypedWrapper]
+    if errors or nulls:
+        perm = [i for i in perm if not isinstance(keys[i], TypedWrapper)]
+    perm.sort(key=keys.__getitem__, reverse=reverse)
+    return perm+nulls+errors if reverse else errors+nulls+perm
+
+
 @Sheet.api
 @asyncthread
 def sort(self):
@@ -63,15 +73,23 @@ def sort(self):
     if self.rows is UNLOADED:
         return
     try:
-        with Progress(gerund='sorting', total=self.nRows) as prog:
-            # replace ambiguous colname strings with unambiguous Column objects  #2494
-            self._ordering = self.ordering
-            def _sortkey(r):
-                prog.addProgress(1)
-                return self.sortkey(r, ordering=self._ordering)
-
-            # must not reassign self.rows: use .sort() instead of sorted()
-            self.rows.sort(key=_sortkey)
+        # replace ambiguous colname strings with unambiguous Column objects  #2494
+        self._ordering = self.ordering
+        rows = self.rows
+        with Progress(gerund='sorting', total=len(rows)*(len(self._ordering)+1)) as prog:
+            # extract typed keys for each ordering column once, instead of for every comparison
+            keycols = []
+            for col, reverse in self._ordering:
+                keycols.append((col.getTypedValues(rows, prog), reverse))
+
+            # stable argsort by each key, least significant first; reverse=True keeps stability
+            perm = list(range(len(rows)))
+            for keys, reverse in reversed(keycols):
+                perm = argsortKeys(perm, keys, reverse)
+            prog.addProgress(len(rows))
+
+            # must not reassign self.rows: assign to slice instead
+            rows[:] = [rows[i] for i in perm]
     except TypeError as e:
         vd.warning('sort incomplete due to TypeError; change column type')
         vd.exceptionCaught(e, status=False)
@@ -97,3 +115,12 @@ vd.addMenuItems('''
     Column > Sort by > key columns > ascending > sort-keys-asc
     Column > Sort by > key columns > descending > sort-keys-desc
 ''')
+
+
+def test_sort(vd):
+    from visidata import ColumnItem
+    vs = Sheet('test_sort', columns=[ColumnItem('a', 0, type=int), ColumnItem('b', 1)])
+    vs.rows = [[2, 'x'], [None, 'y'], [1, 'y'], ['e', 'z'], [2, 'y'], [1, 'x']]
+    vs._ordering = [(vs.columns[1], True), (vs.columns[0], False)]
+    vd.sync(vs.sort())
+    assert vs.rows == [['e', 'z'], [None, 'y'], [1, 'y'], [2, 'y'], [1, 'x'], [2, 'x']]
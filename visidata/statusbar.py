@@ -216,7 +216,7 @@ def threadStatus(vs) -> str:
         gerunds = [p.gerund for p in vs.progresses if p.gerund] or ['processing']
         ret += f' [:working]{vs.progressPct} {gerunds[0]}…[/]'
         return ret
-    return ''
+    return vd.cacheStatus
 
 @BaseSheet.property
 def modifiedStatus(sheet):
@@ -18,6 +18,8 @@ vd.option('min_memory_mb', 0, 'minimum memory to continue loading and async proc
 vd.theme_option('color_working', '118 5', 'color of system running smoothly')
 
 BaseSheet.init('currentThreads', list)
+VisiData.init('_sessionPools', dict)  # [name] -> (nworkers, ProcessPoolExecutor) kept for the session
+VisiData.init('_sessionPoolsLock', threading.Lock)
 
 def asynccache(key=lambda *args, **kwargs: str(args)+str(kwargs)):
     def _decorator(func):
@@ -82,6 +84,43 @@ def Progress(vd, iterable=None, gerund="", total=None, sheet=None):
     return _Progress(iterable=iterable, gerund=gerund, total=total, sheet=sheet)
 
 
+@VisiData.api
+def processPool(vd, nworkers):
+    '''Return ProcessPoolExecutor with *nworkers* worker processes.
+       Workers are started by forkserver (or spawn), because forking a process with other threads running (like the main thread, from a loader) can deadlock.'''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(['visidata'])  # import once, in the server
+    else:
+        ctx = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=nworkers, mp_context=ctx)
+
+
+@VisiData.api
+def sessionPool(vd, name, nworkers):
+    'Return ProcessPoolExecutor with *nworkers* worker processes for work of kind *name*.  The pool is kept for the rest of the session, unless *nworkers* changes, so that workers are not started again for every command.'
+    with vd._sessionPoolsLock:
+        pool = vd._sessionPools.get(name)
+        if pool and pool[0] != nworkers:
+            pool[1].shutdown(wait=False)
+            pool = None
+        if not pool:
+            pool = vd._sessionPools[name] = (nworkers, vd.processPool(nworkers))
+        return pool[1]
+
+
+@VisiData.api
+def brokenPool(vd, name, executor):
+    'Forget session pool *name* if it is still *executor*, after a worker died, so that the next sessionPool(*name*) starts a new one.'
+    with vd._sessionPoolsLock:
+        pool = vd._sessionPools.get(name)
+        if pool and pool[1] is executor:
+            del vd._sessionPools[name]
+
+
 @VisiData.api
 def cancelThread(vd, *threads, exception=EscapeException):
     'Raise *exception* in one or more *threads*.'
@@ -115,15 +154,26 @@ def elapsed_s(t):
     return (t.endTime or time.process_time())-t.startTime
 
 
+@VisiData.property
+def cacheStatus(vd) -> str:
+    'Return status of memory used by column caches, if accounted.'
+    if not vd.colCache.nentries:
+        return ''
+    cache_mb = vd.colCache.nbytes//(1024*1024)
+    limit = vd.options.cache_memory_limit
+    return f'  [:working][cache {cache_mb}MB{"/%sMB" % limit if limit else ""}][/]'
+
+
 @VisiData.api
 def checkMemoryUsage(vd):
+    cachestatus = vd.cacheStatus
     threads = vd.unfinishedThreads
     if not threads:
-        return ''
+        return cachestatus
 
     min_mem = vd.options.min_memory_mb
     if not min_mem:
-        return ''
+        return cachestatus
 
     try:
         freestats = subprocess.run('free --total --mega'.split(), check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.strip().splitlines()
@@ -132,7 +182,7 @@ def checkMemoryUsage(vd):
             vd.exceptionCaught(e)
         vd.options.min_memory_mb = 0
         vd.warning('disabling min_memory_mb: "free" not installed')
-        return ''
+        return cachestatus
     tot_m, used_m, free_m = map(int, freestats[-1].split()[1:])
     ret = f'  [{free_m}MB] '
     if free_m < min_mem:
@@ -142,7 +192,7 @@ def checkMemoryUsage(vd):
         curses.flash()
     else:
         attr = '[:working]'
-    return attr + ret + '[/]'
+    return cachestatus + attr + ret + '[/]'
 
 
 # for progress bar